@@ -13,6 +13,7 @@ import math
 import logging
 import time
 import traceback
+import threading
 
 import numpy, numpy.ma
 
@@ -78,6 +79,10 @@ class AstroImage(BaseImage):
         self.naxispath = []
         self.revnaxis = []
 
+        # number of pixels reprojected at a time when mosaicing, which
+        # bounds the memory used by each thread (see mosaic_reproject)
+        self.mosaic_band_size = 256 * 1024
+
     def load_hdu(self, hdu, fobj=None, naxispath=None):
         self.clear_metadata()
 
@@ -100,7 +105,12 @@ class AstroImage(BaseImage):
         # Try to make a wcs object on the header
         self.wcs.load_header(hdu.header, fobj=fobj)
 
-    def load_file(self, filepath, numhdu=None, naxispath=None):
+    def load_file(self, filepath, numhdu=None, naxispath=None, memmap=None):
+        """Load an image from a FITS file.  If `memmap` is True, only the
+        headers are read now and the pixel data is memory mapped, so that
+        it is read from the file on demand.  If None, the default of the
+        file handler is used.
+        """
         self.logger.debug("Loading file '%s' ..." % (filepath))
         self.clear_metadata()
 
@@ -115,7 +125,8 @@ class AstroImage(BaseImage):
         data, numhdu, naxispath = self.io.load_file(filepath, ahdr,
                                                     numhdu=numhdu,
                                                     naxispath=naxispath,
-                                                    phdr=self._primary_hdr)
+                                                    phdr=self._primary_hdr,
+                                                    memmap=memmap)
 
         if naxispath is None:
             naxispath = []
@@ -401,199 +412,300 @@ class AstroImage(BaseImage):
 
     def mosaic_inline(self, imagelist, bg_ref=None, trim_px=None,
                       merge=False, allow_expand=True, expand_pad_deg=0.01,
-                      update_minmax=True):
+                      update_minmax=True, num_threads=1, mmap_path=None):
         """Drops new images into the current image (if there is room),
         relocating them according the WCS between the two images.
+
+        The footprints of all the images are found first, so that the
+        data array is expanded at most once (see mosaic_allocate), and
+        then the images are reprojected straight into it, using up to
+        `num_threads` threads (see mosaic_fill).  Returns the location
+        (xlo, ylo, xhi, yhi) of the last image.
         """
-        # Get our own (mosaic) rotation and scale
+        boxes = [self.mosaic_footprint(image, trim_px=trim_px)
+                 for image in imagelist]
+        boxes = self.mosaic_allocate(boxes, allow_expand=allow_expand,
+                                     expand_pad_deg=expand_pad_deg,
+                                     mmap_path=mmap_path)
+        self.mosaic_fill(imagelist, boxes, bg_ref=bg_ref, trim_px=trim_px,
+                         merge=merge, update_minmax=update_minmax,
+                         num_threads=num_threads)
+        if len(boxes) == 0:
+            return None
+        return boxes[-1]
+
+    def mosaic_footprint(self, image, trim_px=None):
+        """Returns the box (xlo, ylo, xhi, yhi) of pixels of this (mosaic)
+        image covered by `image`, found from its size and the sky
+        positions of its corners.  Only the header and WCS of `image` are
+        used, so its data need not have been read (e.g. if it is memory
+        mapped).
+        """
+        header = image.get_header()
+        wd, ht = header.get('NAXIS1', None), header.get('NAXIS2', None)
+        if (wd is None) or (ht is None):
+            wd, ht = image.get_size()
+
+        t = trim_px or 0
+        xs, ys = [], []
+        for x, y in ((t, t), (wd-1-t, t), (t, ht-1-t), (wd-1-t, ht-1-t)):
+            ra, dec = image.pixtoradec(x, y)
+            x, y = self.radectopix(ra, dec)
+            xs.append(x)
+            ys.append(y)
+
+        xlo, ylo = int(round(min(xs))), int(round(min(ys)))
+        xhi, yhi = int(round(max(xs))) + 1, int(round(max(ys))) + 1
+        return (xlo, ylo, xhi, yhi)
+
+    def mosaic_allocate(self, boxes, allow_expand=True, expand_pad_deg=0.01,
+                        mmap_path=None):
+        """Make room for images at `boxes` (see mosaic_footprint).  If
+        they do not all fit, a new float32 data array is allocated, once,
+        to hold them along with the current data.  It is memory mapped to
+        the (new) file `mmap_path`, if one is given.
+
+        Returns the boxes, moved along with the current data.
+        """
+        if len(boxes) == 0:
+            return []
+
         header = self.get_header()
         ((xrot_ref, yrot_ref),
          (cdelt1_ref, cdelt2_ref)) = wcs.get_xy_rotation_and_scale(header)
-        ref_rot = yrot_ref
-
         scale_x, scale_y = math.fabs(cdelt1_ref), math.fabs(cdelt2_ref)
 
-        # drop each image in the right place in the new data array
         mydata = self._get_data()
-
-        count = 1
-        for image in imagelist:
-            name = image.get('name', 'image%d' % (count))
-            count += 1
-
-            data_np = image._get_data()
-
-            # Calculate sky position at the center of the piece
-            ctr_x, ctr_y = trcalc.get_center(data_np)
-            ra, dec = image.pixtoradec(ctr_x, ctr_y)
-
-            # User specified a trim?  If so, trim edge pixels from each
-            # side of the array
-            ht, wd = data_np.shape[:2]
-            if trim_px:
-                xlo, xhi = trim_px, wd - trim_px
-                ylo, yhi = trim_px, ht - trim_px
-                data_np = data_np[ylo:yhi, xlo:xhi, ...]
-                ht, wd = data_np.shape[:2]
-
-            # If caller asked us to match background of pieces then
-            # get the median of this piece
-            if bg_ref is not None:
-                bg = iqcalc.get_median(data_np)
-                bg_inc = bg_ref - bg
-                #print "bg=%f inc=%f" % (bg, bg_inc)
-                data_np = data_np + bg_inc
-
-            # Determine max/min to update our values
-            if update_minmax:
-                maxval = numpy.nanmax(data_np)
-                minval = numpy.nanmin(data_np)
-                self.maxval = max(self.maxval, maxval)
-                self.minval = min(self.minval, minval)
-
-            # Get rotation and scale of piece
-            header = image.get_header()
-            ((xrot, yrot),
-             (cdelt1, cdelt2)) = wcs.get_xy_rotation_and_scale(header)
-            self.logger.debug("image(%s) xrot=%f yrot=%f cdelt1=%f cdelt2=%f" % (
-                name, xrot, yrot, cdelt1, cdelt2))
-
-            # scale if necessary
-            # TODO: combine with rotation?
-            if (not numpy.isclose(math.fabs(cdelt1), scale_x) or
-                not numpy.isclose(math.fabs(cdelt2), scale_y)):
-                nscale_x = math.fabs(cdelt1) / scale_x
-                nscale_y = math.fabs(cdelt2) / scale_y
-                self.logger.debug("scaling piece by x(%f), y(%f)" % (
-                    nscale_x, nscale_y))
-                data_np, (ascale_x, ascale_y) = trcalc.get_scaled_cutout_basic(
-                    data_np, 0, 0, wd-1, ht-1, nscale_x, nscale_y)
-
-            # Rotate piece into our orientation, according to wcs
-            rot_dx, rot_dy = xrot - xrot_ref, yrot - yrot_ref
-
-            flip_x = False
-            flip_y = False
-
-            ## # Flip X due to negative CDELT1
-            ## if numpy.sign(cdelt1) < 0:
-            ##     flip_x = True
-
-            ## # Flip Y due to negative CDELT2
-            ## if numpy.sign(cdelt2) < 0:
-            ##     flip_y = True
-
-            # Optomization for 180 rotations
-            if numpy.isclose(math.fabs(rot_dx), 180.0):
-                flip_x = not flip_x
-                rot_dx = 0.0
-            if numpy.isclose(math.fabs(rot_dy), 180.0):
-                flip_y = not flip_y
-                rot_dy = 0.0
-
-            self.logger.debug("flip_x=%s flip_y=%s" % (flip_x, flip_y))
-            if flip_x or flip_y:
-                rotdata = trcalc.transform(data_np,
-                                           flip_x=flip_x, flip_y=flip_y)
+        mywd, myht = self.get_size()
+
+        # Does everything fit?
+        min_x = min([box[0] for box in boxes])
+        min_y = min([box[1] for box in boxes])
+        max_x = max([box[2] for box in boxes])
+        max_y = max([box[3] for box in boxes])
+        if min_x >= 0 and max_x <= mywd and min_y >= 0 and max_y <= myht:
+            return list(boxes)
+
+        if not allow_expand:
+            raise Exception("New piece doesn't fit on image and allow_expand=False")
+
+        #<-- Resize our data array to allow the new images
+
+        # determine amount to pad expansion by
+        expand_x = max(int(expand_pad_deg / scale_x), 0)
+        expand_y = max(int(expand_pad_deg / scale_y), 0)
+
+        nx1_off, nx2_off = 0, 0
+        if min_x < 0:
+            nx1_off = abs(min_x) + expand_x
+        if max_x > mywd:
+            nx2_off = (max_x - mywd) + expand_x
+
+        ny1_off, ny2_off = 0, 0
+        if min_y < 0:
+            ny1_off = abs(min_y) + expand_y
+        if max_y > myht:
+            ny2_off = (max_y - myht) + expand_y
+
+        new_wd = mywd + nx1_off + nx2_off
+        new_ht = myht + ny1_off + ny2_off
+        self.logger.debug("expanding mosaic to %dx%d" % (new_wd, new_ht))
+        if mmap_path is not None:
+            # a new file is zero filled
+            new_data = numpy.memmap(mmap_path, dtype=numpy.float32,
+                                    mode='w+', shape=(new_ht, new_wd))
+        else:
+            new_data = numpy.zeros((new_ht, new_wd), dtype=numpy.float32)
+        # place current data into new data
+        new_data[ny1_off:ny1_off+myht, nx1_off:nx1_off+mywd] = mydata
+        self._data = new_data
+
+        kwds = dict(NAXIS1=new_wd, NAXIS2=new_ht)
+        if (nx1_off > 0) or (ny1_off > 0):
+            # Adjust our WCS for relocation of the reference pixel
+            crpix1, crpix2 = self.get_keywords_list('CRPIX1', 'CRPIX2')
+            kwds.update(dict(CRPIX1=crpix1 + nx1_off,
+                             CRPIX2=crpix2 + ny1_off))
+        self.update_keywords(kwds)
+
+        # the whole image has changed: the padding is zeros, and
+        # results computed from the data no longer line up
+        self.clear_cache()
+        if self._stats is not None:
+            self.minval = min(self.minval, 0)
+            self.maxval = max(self.maxval, 0)
+            self.minval_noinf = min(self.minval_noinf, 0)
+            self.maxval_noinf = max(self.maxval_noinf, 0)
+        self.notify_modified()
+
+        return [(xlo + nx1_off, ylo + ny1_off, xhi + nx1_off, yhi + ny1_off)
+                for (xlo, ylo, xhi, yhi) in boxes]
+
+    def mosaic_fill(self, items, boxes, bg_ref=None, trim_px=None,
+                    merge=False, update_minmax=True, num_threads=1,
+                    load_fn=None, cb_fn=None, ev_intr=None):
+        """Reproject each image of `items` into its box of `boxes` (see
+        mosaic_reproject), using up to `num_threads` threads.  Images
+        whose boxes overlap are never done at the same time, so that each
+        thread writes to its own part of the data array.
+
+        If `load_fn` is given, it is called with each item to get its
+        image (e.g. to load it from a file), so that only the images being
+        worked on are held in memory.  As each image is done,
+        `cb_fn(item, box)` is called if it is given, or else the
+        'modified' callback is made for its box, so that the mosaic can
+        be shown as it fills in.  The work stops early if the event
+        `ev_intr` is set.
+        """
+        pending = list(range(len(items)))
+        running = []
+        errors = []
+        cond = threading.Condition()
+        # for updating our statistics
+        lock = threading.Lock()
+
+        def _overlaps(box1, box2):
+            return ((box1[0] < box2[2]) and (box2[0] < box1[2]) and
+                    (box1[1] < box2[3]) and (box2[1] < box1[3]))
+
+        def _next_index():
+            # first waiting image that does not overlap a running one
+            for i in pending:
+                if not any([_overlaps(boxes[i], boxes[j]) for j in running]):
+                    return i
+            return None
+
+        def _fill(i):
+            item = items[i]
+            if load_fn is not None:
+                image = load_fn(item)
             else:
-                rotdata = data_np
-
-            # Finish with any necessary rotation of piece
-            if not numpy.isclose(rot_dy, 0.0):
-                rot_deg = rot_dy
-                self.logger.debug("rotating %s by %f deg" % (name, rot_deg))
-                rotdata = trcalc.rotate(rotdata, rot_deg,
-                                        #rotctr_x=ctr_x, rotctr_y=ctr_y
-                                        )
-
-            # Get size and data of new image
-            ht, wd = rotdata.shape[:2]
-            ctr_x, ctr_y = trcalc.get_center(rotdata)
-
-            # Find location of image piece (center) in our array
-            x0, y0 = self.radectopix(ra, dec)
-
-            # Merge piece as closely as possible into our array
-            # Unfortunately we lose a little precision rounding to the
-            # nearest pixel--can't be helped with this approach
-            x0, y0 = int(round(x0)), int(round(y0))
-            self.logger.debug("Fitting image '%s' into mosaic at %d,%d" % (
-                name, x0, y0))
-
-            # This is for useful debugging info only
-            my_ctr_x, my_ctr_y = trcalc.get_center(mydata)
-            off_x, off_y = x0 - my_ctr_x, y0 - my_ctr_y
-            self.logger.debug("centering offsets: %d,%d" % (off_x, off_y))
-
-            # Sanity check piece placement
-            xlo, xhi = x0 - ctr_x, x0 + wd - ctr_x
-            ylo, yhi = y0 - ctr_y, y0 + ht - ctr_y
-            assert (xhi - xlo == wd), \
-                   Exception("Width differential %d != %d" % (xhi - xlo, wd))
-            assert (yhi - ylo == ht), \
-                   Exception("Height differential %d != %d" % (yhi - ylo, ht))
-
-            mywd, myht = self.get_size()
-            if xlo < 0 or xhi > mywd or ylo < 0 or yhi > myht:
-                if not allow_expand:
-                    raise Exception("New piece doesn't fit on image and allow_expand=False")
-
-                #<-- Resize our data array to allow the new image
-
-                # determine amount to pad expansion by
-                expand_x = max(int(expand_pad_deg / scale_x), 0)
-                expand_y = max(int(expand_pad_deg / scale_y), 0)
-
-                nx1_off, nx2_off = 0, 0
-                if xlo < 0:
-                    nx1_off = abs(xlo) + expand_x
-                if xhi > mywd:
-                    nx2_off = (xhi - mywd) + expand_x
-                xlo, xhi = xlo + nx1_off, xhi + nx1_off
-
-                ny1_off, ny2_off = 0, 0
-                if ylo < 0:
-                    ny1_off = abs(ylo) + expand_y
-                if yhi > myht:
-                    ny2_off = (yhi - myht) + expand_y
-                ylo, yhi = ylo + ny1_off, yhi + ny1_off
-
-                new_wd = mywd + nx1_off + nx2_off
-                new_ht = myht + ny1_off + ny2_off
-                new_data = numpy.zeros((new_ht, new_wd))
-                # place current data into new data
-                new_data[ny1_off:ny1_off+myht, nx1_off:nx1_off+mywd] = \
-                                               mydata
-                self._data = new_data
-                mydata = new_data
-
-                if (nx1_off > 0) or (ny1_off > 0):
-                    # Adjust our WCS for relocation of the reference pixel
-                    crpix1, crpix2 = self.get_keywords_list('CRPIX1', 'CRPIX2')
-                    kwds = dict(CRPIX1=crpix1 + nx1_off,
-                                CRPIX2=crpix2 + ny1_off)
-                    self.update_keywords(kwds)
-
-            # fit image piece into our array
-            try:
-                if merge:
-                    mydata[ylo:yhi, xlo:xhi, ...] += rotdata[0:ht, 0:wd, ...]
-                else:
-                    idx = (mydata[ylo:yhi, xlo:xhi, ...] == 0.0)
-                    mydata[ylo:yhi, xlo:xhi, ...][idx] = \
-                                    rotdata[0:ht, 0:wd, ...][idx]
-
-            except Exception as e:
-                self.logger.error("Error fitting tile: %s" % (str(e)))
-                raise
-
-        # TODO: recalculate min and max values
-        # Can't use usual techniques because it adds too much time to the
-        # mosacing
-        #self._set_minmax()
+                image = item
+            box = self.mosaic_reproject(image, boxes[i], bg_ref=bg_ref,
+                                        trim_px=trim_px, merge=merge,
+                                        update_minmax=update_minmax,
+                                        lock=lock)
+            if cb_fn is not None:
+                cb_fn(item, box)
+            else:
+                self.notify_modified(region=box)
+
+        def _worker():
+            while True:
+                with cond:
+                    while True:
+                        if ((len(pending) == 0) or (len(errors) > 0) or
+                            (ev_intr is not None and ev_intr.isSet())):
+                            return
+                        i = _next_index()
+                        if i is not None:
+                            break
+                        cond.wait()
+                    pending.remove(i)
+                    running.append(i)
+                try:
+                    _fill(i)
+                except Exception as e:
+                    with cond:
+                        errors.append(e)
+                finally:
+                    with cond:
+                        running.remove(i)
+                        cond.notify_all()
+
+        num_threads = min(num_threads, len(items))
+        if num_threads <= 1:
+            _worker()
 
-        # Notify watchers that our data has changed
-        self.make_callback('modified')
+        else:
+            threads = [threading.Thread(target=_worker)
+                       for n in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+    def mosaic_reproject(self, image, box, bg_ref=None, trim_px=None,
+                         merge=False, update_minmax=True, lock=None):
+        """Reproject `image` into the box (xlo, ylo, xhi, yhi) of our data
+        (see mosaic_footprint), taking the nearest pixel of `image` for
+        each of ours.  Pixels are mapped between the two images by the
+        affine transform through the corners of the box, found from the
+        WCS of both.  Unless `merge` is True, our pixels that are already
+        set (non-zero) are kept.
+
+        Our statistics are updated (holding `lock`, if it is given), but
+        no callback is made.  Returns the box, clipped to our data.
+        """
+        mydata = self._get_data()
+        myht, mywd = mydata.shape[:2]
+        xlo, ylo, xhi, yhi = box
+        xlo, ylo = max(xlo, 0), max(ylo, 0)
+        xhi, yhi = min(xhi, mywd), min(yhi, myht)
+        if (xlo >= xhi) or (ylo >= yhi):
+            return (xlo, ylo, xhi, yhi)
+
+        name = image.get('name', 'image')
+        data_np = image._get_data()
+        ht, wd = data_np.shape[:2]
+        t = trim_px or 0
+
+        # If caller asked us to match background of pieces then
+        # get the median of this piece
+        bg_inc = 0.0
+        if bg_ref is not None:
+            bg = iqcalc.get_median(data_np[t:ht-t, t:wd-t])
+            bg_inc = bg_ref - bg
+
+        # Map the corners of the box to pixels of the image
+        x2, y2 = max(xhi - 1, xlo + 1), max(yhi - 1, ylo + 1)
+        pts = []
+        for x, y in ((xlo, ylo), (x2, ylo), (xlo, y2)):
+            ra, dec = self.pixtoradec(x, y)
+            pts.append(image.radectopix(ra, dec))
+        (u0, v0), (u1, v1), (u2, v2) = pts
+        dudx, dvdx = (u1 - u0) / (x2 - xlo), (v1 - v0) / (x2 - xlo)
+        dudy, dvdy = (u2 - u0) / (y2 - ylo), (v2 - v0) / (y2 - ylo)
+        self.logger.debug("Reprojecting image '%s' into mosaic at %s" % (
+            name, str((xlo, ylo, xhi, yhi))))
+
+        # statistics of the area being overwritten, to update our
+        # values from the area alone
+        before = None
+        if update_minmax:
+            before = self.get_region_stats(xlo, ylo, xhi, yhi)
+
+        # a band of rows at a time, to limit the size of the index arrays
+        dx = numpy.arange(xhi - xlo, dtype=numpy.float64).reshape(1, -1)
+        step = max(self.mosaic_band_size // (xhi - xlo), 1)
+        for y1 in range(ylo, yhi, step):
+            y2 = min(y1 + step, yhi)
+            dy = numpy.arange(y1 - ylo, y2 - ylo,
+                              dtype=numpy.float64).reshape(-1, 1)
+            xi = numpy.floor(u0 + 0.5 + dx * dudx + dy * dudy).astype(
+                numpy.intp)
+            yi = numpy.floor(v0 + 0.5 + dx * dvdx + dy * dvdy).astype(
+                numpy.intp)
+            idx = (xi >= t) & (xi < wd - t) & (yi >= t) & (yi < ht - t)
+            src = data_np[yi[idx], xi[idx]].astype(numpy.float32)
+            if bg_inc != 0.0:
+                src += bg_inc
+
+            dst = mydata[y1:y2, xlo:xhi]
+            if merge:
+                dst[idx] += src
+            else:
+                old = dst[idx]
+                dst[idx] = numpy.where(old == 0.0, src, old)
+
+        if lock is None:
+            lock = threading.Lock()
+        with lock:
+            self.update_region(xlo, ylo, xhi, yhi, before=before,
+                               notify=False)
 
         return (xlo, ylo, xhi, yhi)
 
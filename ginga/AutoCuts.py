@@ -13,7 +13,7 @@ import threading
 
 from ginga.misc import Bunch
 #from ginga.misc.ParamSet import Param
-from ginga.util import zscale
+from ginga.util import zscale, stats
 
 have_scipy = True
 autocut_methods = ('minmax', 'median', 'histogram', 'stddev', 'zscale')
@@ -40,6 +40,11 @@ class AutoCutsBase(object):
     def get_params_metadata(cls):
         return []
     
+    # True if cut_levels() is the usual linear scaling between the cut
+    # levels, which the renderer may then combine with the color mapping
+    # (see RGBMap.get_rgbarray_from_data)
+    linear_cuts = True
+
     def __init__(self, logger):
         super(AutoCutsBase, self).__init__()
 
@@ -54,6 +59,16 @@ class AutoCutsBase(object):
         loval, hival = self.calc_cut_levels(image)
         return loval, hival
 
+    def get_cached_cut_levels(self, image):
+        """Like calc_cut_levels(), but the result is saved with the
+        image, so that it is only calculated once for the same data,
+        method and parameters.
+        """
+        params = tuple([(param.name, getattr(self, param.name, None))
+                        for param in self.get_params_metadata()])
+        key = ('autocuts', self.kind, params, self.crop_radius)
+        return image.get_cached(key, lambda: self.calc_cut_levels(image))
+
     def get_crop(self, image, crop_radius=None):
         # Even with numpy, it's kind of slow for some of the autocut
         # methods on a large image, so in those cases we can optionally
@@ -93,6 +108,8 @@ class AutoCutsBase(object):
 
 class Clip(AutoCutsBase):
 
+    linear_cuts = False
+
     def __init__(self, logger):
         super(Clip, self).__init__(logger)
         self.kind = 'clip'
@@ -162,90 +179,25 @@ class Histogram(AutoCutsBase):
         self.logger.debug("Median analysis array is %dx%d" % (
             width, height))
 
-        total_px = width * height
-        dsum = numpy.sum(data)
-        if numpy.isnan(dsum) or numpy.isinf(dsum):
-            # Oh crap, the array has a NaN or Inf value.
-            # We have to workaround this by making a copy of the array
-            # and substituting for the problem values, otherwise numpy's
-            # histogram() cannot handle it
-            self.logger.warn("NaN's found in data, using workaround for histogram")
-            data = data.copy()
-            # TODO: calculate a reasonable replacement value
-            data[numpy.isinf(data)] = 0.0
-            minval = numpy.nanmin(data)
-            maxval = numpy.nanmax(data)
-            substval = (minval + maxval)/2.0
-            data[numpy.isnan(data)] = substval
-            data[numpy.isinf(data)] = substval
-            ## dsum = numpy.sum(data)
-            ## if numpy.isnan(dsum) or numpy.isinf(dsum):
-            ##     print "NaNs STILL PRESENT"
-
-            dist, bins = numpy.histogram(data, bins=numbins,
-                                         density=False)
-        else:
-            dist, bins = numpy.histogram(data, bins=numbins,
-                                         density=False)
-
-        cutoff = int((float(total_px)*(1.0-pct))/2.0)
-        top = len(dist)-1
-        self.logger.debug("top=%d cutoff=%d" % (top, cutoff))
-        #print "DIST: %s\nBINS: %s" % (str(dist), str(bins))
-
-        # calculate low cutoff
-        cumsum = numpy.cumsum(dist)
-        li = numpy.flatnonzero(cumsum > cutoff)
-        if len(li) > 0:
-            i = li[0]
-            count_px = cumsum[i]
-        else:
-            i = 0
-            count_px = 0
-        if i > 0:
-            nprev = cumsum[i-1]
-        else:
-            nprev = 0
-        loidx = i
-
-        # interpolate between last two low bins
-        val1, val2 = bins[i], bins[i+1]
-        divisor = float(count_px) - float(nprev)
-        if divisor > 0.0:
-            interp = (float(cutoff)-float(nprev))/ divisor
-        else:
-            interp = 0.0
-        loval = val1 + ((val2 - val1) * interp)
-        self.logger.debug("loval=%f val1=%f val2=%f interp=%f" % (
-            loval, val1, val2, interp))
-
-        # calculate high cutoff
-        revdist = dist[::-1]
-        cumsum = numpy.cumsum(revdist)
-        li = numpy.flatnonzero(cumsum > cutoff)
-        if len(li) > 0:
-            i = li[0]
-            count_px = cumsum[i]
-        else:
-            i = 0
-            count_px = 0
-        if i > 0:
-            nprev = cumsum[i-1]
-        else:
-            nprev = 0
-        j = top - i
-        hiidx = j+1
-
-        # interpolate between last two high bins
-        val1, val2 = bins[j], bins[j+1]
-        divisor = float(count_px) - float(nprev)
-        if divisor > 0.0:
-            interp = (float(cutoff)-float(nprev))/ divisor
+        # NaN and Inf values are skipped
+        dist, bins = stats.calc_histogram(data, numbins=numbins)
+        top = len(dist) - 1
+
+        if pct >= 1.0:
+            loval, hival = bins[0], bins[-1]
+            loidx, hiidx = 0, top + 1
         else:
-            interp = 0.0
-        hival = val1 + ((val2 - val1) * interp)
-        self.logger.debug("hival=%f val1=%f val2=%f interp=%f" % (
-            hival, val1, val2, interp))
+            # refine the cutoff values within their bins
+            cutoff = (1.0 - pct) / 2.0
+            loval, hival = stats.calc_percentiles(data,
+                                                  [cutoff, 1.0 - cutoff],
+                                                  numbins=numbins,
+                                                  hist=(dist, bins))
+            loidx = min(max(numpy.searchsorted(bins, loval,
+                                               side='right') - 1, 0), top)
+            hiidx = min(max(numpy.searchsorted(bins, hival,
+                                               side='left'), 1), top + 1)
+        self.logger.debug("loval=%f hival=%f" % (loval, hival))
 
         return Bunch.Bunch(dist=dist, bins=bins, loval=loval, hival=hival,
                            loidx=loidx, hiidx=hiidx)
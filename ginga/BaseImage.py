@@ -8,11 +8,13 @@
 # Please see the file LICENSE.txt for details.
 #
 import math
+import time
 import numpy
 import logging
 
 from ginga.misc import Bunch, Callback
 from ginga import trcalc, AutoCuts
+from ginga.util import stats
 from ginga.util.six.moves import map, zip
 
 class ImageError(Exception):
@@ -36,7 +38,25 @@ class BaseImage(Callback.Callbacks):
             self.update_metadata(metadata)
         self.order = ''
 
-        self._set_minmax()
+        # lazily computed, successively 2x reduced versions of the data,
+        # used for drawing at zoomed out scales
+        self._pyramid = []
+        # 'mean' or 'max'
+        self.pyramid_method = 'mean'
+        # only images with more pixels than this use a pyramid
+        # (None disables the pyramid)
+        self.pyramid_threshold = 4 * 1024 * 1024
+
+        # other results computed from the data, kept until it changes
+        # (see get_cached)
+        self._cache = {}
+
+        # statistics of the data (see _set_minmax), computed when needed
+        self._stats = None
+
+        # area changed by the modification being reported through the
+        # 'modified' callback (None means the whole image)
+        self._mod_region = None
 
         self.autocuts = AutoCuts.Histogram(self.logger)
 
@@ -141,19 +161,27 @@ class BaseImage(Callback.Callbacks):
     def __setitem__(self, kwd, value):
         self.metadata[kwd] = value
 
-    def set_data(self, data_np, metadata=None, astype=None):
+    def set_data(self, data_np, metadata=None, astype=None, derived=None):
         """Use this method to SHARE (not copy) the incoming array.
+
+        `derived` can be the result of get_derived() from an image that
+        had the same data, to avoid computing those results again.
         """
         if astype:
             data = data_np.astype(astype)
         else:
             data = data_np
         self._data = data
+        self.clear_cache()
 
         if metadata:
             self.update_metadata(metadata)
 
-        self._set_minmax()
+        self._stats = None
+        if derived is not None:
+            self._stats = derived.stats
+            self._cache = derived.cache
+            self._pyramid = derived.pyramid
 
         self.make_callback('modified')
 
@@ -187,29 +215,59 @@ class BaseImage(Callback.Callbacks):
 
     def _set_minmax(self):
         data = self._get_fast_data()
-        try:
-            self.maxval = numpy.nanmax(data)
-            self.minval = numpy.nanmin(data)
-        except Exception:
-            self.maxval = 0
-            self.minval = 0
+        self._stats = stats.calc_stats(data)
+
+    def _get_stats(self):
+        if self._stats is None:
+            self._set_minmax()
+        return self._stats
+
+    def _set_stat(self, name, value):
+        if self._stats is None:
+            self._stats = Bunch.Bunch(minval=0, maxval=0, minval_noinf=0,
+                                      maxval_noinf=0, nan_count=0,
+                                      inf_count=0)
+        self._stats[name] = value
+
+    # min and max values are calculated on first use after the data is set,
+    # but can also be assigned (e.g. by subclasses that know better)
+    @property
+    def minval(self):
+        return self._get_stats().minval
 
-        # TODO: see if there is a faster way to ignore infinity
-        try:
-            if numpy.isfinite(self.maxval):
-                self.maxval_noinf = self.maxval
-            else:
-                self.maxval_noinf = numpy.nanmax(data[numpy.isfinite(data)])
-        except:
-            self.maxval_noinf = self.maxval
+    @minval.setter
+    def minval(self, value):
+        self._set_stat('minval', value)
 
-        try:
-            if numpy.isfinite(self.minval):
-                self.minval_noinf = self.minval
-            else:
-                self.minval_noinf = numpy.nanmin(data[numpy.isfinite(data)])
-        except:
-            self.minval_noinf = self.minval
+    @property
+    def maxval(self):
+        return self._get_stats().maxval
+
+    @maxval.setter
+    def maxval(self, value):
+        self._set_stat('maxval', value)
+
+    @property
+    def minval_noinf(self):
+        return self._get_stats().minval_noinf
+
+    @minval_noinf.setter
+    def minval_noinf(self, value):
+        self._set_stat('minval_noinf', value)
+
+    @property
+    def maxval_noinf(self):
+        return self._get_stats().maxval_noinf
+
+    @maxval_noinf.setter
+    def maxval_noinf(self, value):
+        self._set_stat('maxval_noinf', value)
+
+    def get_nan_count(self):
+        return self._get_stats().nan_count
+
+    def get_inf_count(self):
+        return self._get_stats().inf_count
 
     def get_minmax(self, noinf=False):
         if not noinf:
@@ -345,7 +403,28 @@ class BaseImage(Callback.Callbacks):
     def get_scaled_cutout_basic(self, x1, y1, x2, y2, scale_x, scale_y):
         new_wd = int(round(scale_x * (x2 - x1 + 1)))
         new_ht = int(round(scale_y * (y2 - y1 + 1)))
-        return self.get_scaled_cutout_wdht(x1, y1, x2, y2, new_wd, new_ht)
+
+        level = self.get_pyramid_level_for_scale(scale_x, scale_y)
+        if level == 0:
+            return self.get_scaled_cutout_wdht(x1, y1, x2, y2, new_wd, new_ht)
+
+        # sample from the reduced data instead of the full data
+        data = self.get_pyramid_level(level)
+        ht, wd = data.shape[:2]
+        lx1, ly1 = min(int(x1) >> level, wd-1), min(int(y1) >> level, ht-1)
+        lx2, ly2 = min(int(x2) >> level, wd-1), min(int(y2) >> level, ht-1)
+        view, scales = trcalc.get_scaled_cutout_wdht_view(data.shape,
+                                                          lx1, ly1, lx2, ly2,
+                                                          new_wd, new_ht)
+        newdata = data[view]
+
+        # actual scale used, relative to the full data
+        ht, wd = newdata.shape[:2]
+        scale_x = float(wd) / max(x2 - x1 + 1, 1)
+        scale_y = float(ht) / max(y2 - y1 + 1, 1)
+
+        res = Bunch.Bunch(data=newdata, scale_x=scale_x, scale_y=scale_y)
+        return res
 
     def get_scaled_cutout_by_dims(self, x1, y1, x2, y2, dst_wd, dst_ht,
                                   method='basic'):
@@ -362,6 +441,193 @@ class BaseImage(Callback.Callbacks):
 
         raise ImageError("Method not supported: '%s'" % (method))
 
+    def get_scaled_tile(self, x1, y1, x2, y2, scale_x, scale_y):
+        """Returns the region (x1, y1) to (x2, y2) (exclusive), expressed
+        in the coordinates of the data scaled by (scale_x, scale_y).
+        See trcalc.get_scaled_tile_view().
+        """
+        level = self.get_pyramid_level_for_scale(scale_x, scale_y)
+        if level == 0:
+            view = trcalc.get_scaled_tile_view(self.shape, x1, y1, x2, y2,
+                                               scale_x, scale_y)
+            return self._slice(view)
+
+        data = self.get_pyramid_level(level)
+        factor = float(1 << level)
+        view = trcalc.get_scaled_tile_view(data.shape, x1, y1, x2, y2,
+                                           scale_x * factor, scale_y * factor)
+        return data[view]
+
+    def get_pyramid_level_for_scale(self, scale_x, scale_y):
+        """Returns the pyramid level that should be used for sampling
+        the data at scale (scale_x, scale_y).  Level 0 is the data itself;
+        each level above that is reduced by a factor of 2 from the last.
+        """
+        if self.pyramid_threshold is None:
+            return 0
+        scale = max(scale_x, scale_y)
+        if scale > 0.5:
+            return 0
+        shp = self.shape
+        if (len(shp) < 2) or (shp[0] * shp[1] <= self.pyramid_threshold):
+            return 0
+        level = int(math.floor(math.log(1.0 / scale, 2)))
+        # don't reduce past a single pixel
+        max_level = int(math.floor(math.log(max(min(shp[:2]), 1), 2)))
+        return max(0, min(level, max_level))
+
+    def get_pyramid_level(self, level):
+        """Returns the data reduced by a factor of 2**`level`, building
+        (and keeping) any levels of the pyramid that are not yet computed.
+        """
+        if level == 0:
+            return self._get_data()
+        pyramid = self._pyramid
+        if len(pyramid) < level:
+            t1 = time.time()
+            # extend a copy, so that readers in other threads never see
+            # a partially built pyramid
+            pyramid = list(pyramid)
+            if len(pyramid) == 0:
+                data = self._get_data()
+            else:
+                data = pyramid[-1]
+            while len(pyramid) < level:
+                data = trcalc.block_reduce(data, method=self.pyramid_method)
+                pyramid.append(data)
+            self._pyramid = pyramid
+            self.logger.debug("built pyramid to level %d in %.4f sec" % (
+                level, time.time() - t1))
+        return pyramid[level-1]
+
+    def clear_pyramid(self):
+        self._pyramid = []
+
+    def get_cached(self, key, calc_fn):
+        """Returns a result computed from the image data by calling
+        `calc_fn()`, computing it only if there is no result for `key`
+        saved since the data was last changed.
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            res = calc_fn()
+            self._cache[key] = res
+            return res
+
+    def get_derived(self):
+        """Returns the results computed so far from the image data
+        (statistics, pyramid and results saved by get_cached), which
+        can be passed to set_data() along with the same data later.
+        """
+        return Bunch.Bunch(stats=self._stats, cache=self._cache,
+                           pyramid=self._pyramid)
+
+    def clear_cache(self):
+        """Discard everything computed from the image data (pyramid and
+        results saved by get_cached).  Call this after modifying the data
+        in place.
+        """
+        self._pyramid = []
+        self._cache = {}
+
+    def get_region_stats(self, x1, y1, x2, y2):
+        """Returns the statistics (see stats.calc_stats) of the data in
+        the box from (x1, y1) up to but not including (x2, y2).
+        """
+        data = self._get_data()
+        return stats.calc_stats(data[y1:y2, x1:x2])
+
+    def update_region(self, x1, y1, x2, y2, before=None, notify=True):
+        """Call this after modifying the data in place within the box
+        from (x1, y1) up to but not including (x2, y2).
+
+        The statistics and pyramid are updated from the data in the box
+        instead of being computed again for the whole image.  `before`
+        should be the result of get_region_stats() for the box, taken
+        before it was modified; without it, the statistics are computed
+        again when next needed.  If `notify` is True, the 'modified'
+        callback is made, with get_modified_region() returning the box.
+        """
+        ht, wd = self._get_data().shape[:2]
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, wd), min(y2, ht)
+        if (x1 < x2) and (y1 < y2):
+            self._update_region_stats(x1, y1, x2, y2, before)
+            self._update_region_pyramid(x1, y1, x2, y2)
+            # other results were computed from the whole image
+            self._cache = {}
+
+        if notify:
+            self.notify_modified(region=(x1, y1, x2, y2))
+
+    def _update_region_stats(self, x1, y1, x2, y2, before):
+        old = self._stats
+        if old is None:
+            # not computed yet
+            return
+        if before is None:
+            self._stats = None
+            return
+        new = self.get_region_stats(x1, y1, x2, y2)
+        size = self._get_data()[y1:y2, x1:x2].size
+        if new.nan_count + new.inf_count >= size:
+            # no finite values in the box to go by
+            self._stats = None
+            return
+
+        res = Bunch.Bunch(nan_count=old.nan_count - before.nan_count +
+                          new.nan_count,
+                          inf_count=old.inf_count - before.inf_count +
+                          new.inf_count)
+        for name, fn in (('minval', min), ('maxval', max),
+                         ('minval_noinf', min), ('maxval_noinf', max)):
+            val = fn(old[name], new[name])
+            if (before[name] == old[name]) and (val != new[name]):
+                # an extreme value may have been overwritten--the whole
+                # image needs to be looked at again
+                self._stats = None
+                return
+            res[name] = val
+        self._stats = res
+
+    def _update_region_pyramid(self, x1, y1, x2, y2):
+        pyramid = self._pyramid
+        data = self._get_data()
+        for i, level in enumerate(pyramid):
+            ht, wd = level.shape[:2]
+            if min(data.shape[:2]) < 2:
+                # reduced by stepping (see trcalc.block_reduce)
+                self._pyramid = pyramid[:i]
+                return
+            # blocks of this level that overlap the box
+            x1, y1 = x1 // 2, y1 // 2
+            x2, y2 = min((x2 + 1) // 2, wd), min((y2 + 1) // 2, ht)
+            if (x1 >= x2) or (y1 >= y2):
+                # box is in the odd trailing row or column that was dropped
+                break
+            level[y1:y2, x1:x2] = trcalc.block_reduce(
+                data[y1*2:y2*2, x1*2:x2*2], method=self.pyramid_method)
+            data = level
+
+    def notify_modified(self, region=None):
+        """Make the 'modified' callback, reporting that the data in
+        `region` (a box (x1, y1, x2, y2) as in update_region, or None for
+        the whole image) has changed.
+        """
+        self._mod_region = region
+        try:
+            self.make_callback('modified')
+        finally:
+            self._mod_region = None
+
+    def get_modified_region(self):
+        """Returns the box (x1, y1, x2, y2) of data being reported as
+        changed by the 'modified' callback, or None if the whole image
+        may have changed.
+        """
+        return self._mod_region
+
 
     def get_pixels_on_line(self, x1, y1, x2, y2, getvalues=True):
         """Uses Bresenham's line algorithm to enumerate the pixels along
@@ -369,41 +635,29 @@ class BaseImage(Callback.Callbacks):
         (see http://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm)
 
         If `getvalues`==False then it will return tuples of (x, y) coordinates
-        instead of pixel values.
+        instead of pixel values.  Pixels off the image have the value NaN.
         """
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        if x1 < x2:
-            sx = 1
-        else:
-            sx = -1
-        if y1 < y2:
-            sy = 1
-        else:
-            sy = -1
-        err = dx - dy
+        if not getvalues:
+            x_arr, y_arr = trcalc.get_line_coords(x1, y1, x2, y2)
+            return list(zip(x_arr.tolist(), y_arr.tolist()))
 
-        res = []
-        x, y = x1, y1
-        while True:
-            if getvalues:
-                try:
-                    val = self.get_data_xy(x, y)
-                except Exception:
-                    val = numpy.NaN
-                res.append(val)
-            else:
-                res.append((x, y))
-            if (x == x2) and (y == y2):
-                break
-            e2 = 2 * err
-            if e2 > -dy:
-                err = err - dy
-                x += sx
-            if e2 <  dx:
-                err = err + dx
-                y += sy
+        res = self.get_pixels_on_lines([(x1, y1, x2, y2)])
+        return res[0].data.tolist()
+
+    def get_pixels_on_lines(self, lines, width=1, method='nearest'):
+        """Samples the data along each of the lines (x1, y1, x2, y2) in
+        `lines` (see trcalc.sample_line for `width` and `method`).
 
+        Returns a list with a Bunch for each line, holding arrays of the
+        positions (x, y) along the line and the `data` values there.
+        """
+        data = self._get_data()
+        res = []
+        for x1, y1, x2, y2 in lines:
+            x_arr, y_arr, values = trcalc.sample_line(data, x1, y1, x2, y2,
+                                                      width=width,
+                                                      method=method)
+            res.append(Bunch.Bunch(x=x_arr, y=y_arr, data=values))
         return res
 
 
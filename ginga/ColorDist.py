@@ -31,6 +31,8 @@ class ColorDistBase(object):
         self.maxhashsize = 1024*1024
         # this actually holds the hash array
         self.hash = None
+        # incremented whenever the hash array changes
+        self.version = 0
         self.calc_hash()
 
     def hash_array(self, idx):
@@ -48,6 +50,16 @@ class ColorDistBase(object):
                ColorDistError("Bad hash size!")
         self.hashsize = size
         self.calc_hash()
+        self.version += 1
+
+    def get_version(self):
+        return self.version
+
+    def is_data_dependent(self):
+        """Returns True if the result of hash_array() for a value depends
+        on the other values in the array passed to it.
+        """
+        return False
 
     def check_hash(self):
         hashlen = len(self.hash)
@@ -270,34 +282,69 @@ class HistogramEqualizationDist(ColorDistBase):
     """
     
     def __init__(self, hashsize, colorlen=None):
+        # histogram the hash is computed from, if one has been set
+        self.hist = None
         super(HistogramEqualizationDist, self).__init__(hashsize,
                                                          colorlen=colorlen)
 
     def calc_hash(self):
-        pass
-
-    # TODO: this method has a lot more overhead compared to the other
-    # scaling methods because the hash array must be computed each time
-    # the data is delivered to hash_array()--in the other scaling
-    # methods it is precomputed in calc_hash().  Investigate whether
-    # there is a way to make this more efficient.
-    #
-    def hash_array(self, idx):
-        # NOTE: data could be assumed to be in the range 0..hashsize-1
-        # at this point but clip as a precaution
-        idx = idx.clip(0, self.hashsize-1)
-        
-        #get image histogram
-        hist, bins = numpy.histogram(idx.flatten(),
-                                     self.hashsize, density=False)
+        if (self.hist is not None) and (len(self.hist) == self.hashsize):
+            self._calc_hash_hist(self.hist)
+        else:
+            self.hist = None
+
+    def _calc_hash_hist(self, hist):
         cdf = hist.cumsum()
 
         # normalize to color range
-        l = (cdf - cdf.min()) * (self.colorlen - 1) / (
-            cdf.max() - cdf.min())
+        cdf_min, cdf_max = cdf.min(), cdf.max()
+        l = (cdf - cdf_min) * (self.colorlen - 1) / max(cdf_max - cdf_min, 1)
         self.hash = l.astype(numpy.uint)
         self.check_hash()
 
+    def calc_histogram(self, idx):
+        """Returns the histogram of index array `idx`, as needed by
+        set_histogram(): one bin for each index value 0..hashsize-1.
+        (Without a histogram set, hash_array() instead bins each array
+        over the range of its own values.)
+        """
+        # NOTE: data could be assumed to be in the range 0..hashsize-1
+        # at this point but clip as a precaution
+        idx = idx.clip(0, self.hashsize-1).astype(numpy.intp, copy=False)
+        return numpy.bincount(idx.ravel(), minlength=self.hashsize)
+
+    def set_histogram(self, hist):
+        """Fix the hash to the one computed from histogram `hist`, e.g.
+        one computed (with calc_histogram) from a sample of a whole image.
+        hash_array() then works like that of the other distributions,
+        until this is called again or clear_histogram() is called.
+        """
+        self._calc_hash_hist(hist)
+        self.hist = hist
+        self.version += 1
+
+    def get_histogram(self):
+        return self.hist
+
+    def clear_histogram(self):
+        self.hist = None
+        self.version += 1
+
+    def is_data_dependent(self):
+        return self.hist is None
+
+    def hash_array(self, idx):
+        # NOTE: data could be assumed to be in the range 0..hashsize-1
+        # at this point but clip as a precaution
+        idx = idx.clip(0, self.hashsize-1)
+
+        if self.hist is None:
+            # no histogram has been set, so compute the hash from this
+            # data, binned over its own range of values as it always was
+            hist, bins = numpy.histogram(idx.ravel(), self.hashsize,
+                                         density=False)
+            self._calc_hash_hist(hist)
+
         arr = self.hash[idx]
         return arr
         
@@ -40,6 +40,7 @@ except (ImportError, Exception):
 # Local application imports
 from ginga import cmap, imap, AstroImage, RGBImage, ImageView
 from ginga.misc import Bunch, Datasrc, Callback, Timer, Task, Future
+from ginga.misc import LoadQueue
 from ginga.util import catalog, iohelper
 
 #pluginconfpfx = 'plugins'
@@ -90,8 +91,6 @@ class GingaControl(Callback.Callbacks):
         self.chncnt = 0
         self.wscount = 0
         self.statustask = None
-        self.preloadLock = threading.RLock()
-        self.preloadList = []
 
         # Create general preferences
         self.settings = self.prefs.createCategory('general')
@@ -105,10 +104,42 @@ class GingaControl(Callback.Callbacks):
                                   channel_follows_focus=False,
                                   share_readout=True,
                                   numImages=10,
+                                  # memory limits (MB) for images held in
+                                  # each channel and in all channels
+                                  # (0 for no limit)
+                                  max_image_mb=0,
+                                  max_total_image_mb=0,
+                                  # number of images after and before the
+                                  # current one, among those held in the
+                                  # channel, whose statistics and cut
+                                  # levels are calculated in the background
+                                  # when stepping through a channel
+                                  prepare_ahead=2,
+                                  prepare_behind=1,
+                                  # number of images loaded at the same
+                                  # time in the background
+                                  preload_max_concurrent=2,
                                   # Offset to add to numpy-based coords
                                   pixel_coords_offset=1.0,
                                   # inherit from primary header
-                                  inherit_primary_header=False)
+                                  inherit_primary_header=False,
+                                  # memory map FITS pixel data (None:
+                                  # default of astropy/pyfits)
+                                  fits_memmap=None)
+
+        # Limit on the memory used by images in all channels
+        self.image_budget = Datasrc.MemoryBudget(
+            self.settings['max_total_image_mb'] * 1024 * 1024)
+        self.settings.getSetting('max_total_image_mb').add_callback(
+            'set', self._set_image_budget_cb)
+
+        # image preparations older than this generation are cancelled
+        self._prepare_gen = 0
+
+        # queue of images to be loaded in the background
+        self.preload_queue = LoadQueue.LoadQueue(
+            self.logger, self.nongui_do,
+            max_concurrent=self.settings['preload_max_concurrent'])
 
         # Should channel change as mouse moves between windows
         self.channel_follows_focus = self.settings['channel_follows_focus']
@@ -507,7 +538,8 @@ class GingaControl(Callback.Callbacks):
             inherit_prihdr = self.settings.get('inherit_primary_header', False)
             image = AstroImage.AstroImage(logger=self.logger,
                                           inherit_primary_header=inherit_prihdr)
-            kwdargs.update(dict(numhdu=idx))
+            memmap = self.settings.get('fits_memmap', None)
+            kwdargs.update(dict(numhdu=idx, memmap=memmap))
 
         try:
             self.logger.info("Loading image from %s kwdargs=%s" % (
@@ -647,22 +679,29 @@ class GingaControl(Callback.Callbacks):
         # Return the image
         return image
 
-    def add_preload(self, chname, imname, path, image_future=None):
-        bnch = Bunch.Bunch(chname=chname, imname=imname, path=path,
-                           image_future=image_future)
-        with self.preloadLock:
-            self.preloadList.append(bnch)
-        self.nongui_do(self.preload_scan)
+    def add_preload(self, chname, imname, path, image_future=None,
+                    priority=LoadQueue.PRI_PREFETCH):
+        """Load an image in the background and add it silently to
+        channel `chname`, unless it is already there.  Preloads of the
+        same image are only done once, and higher `priority` loads (see
+        ginga.misc.LoadQueue) are done first.
+        """
+        key = (chname.lower(), imname)
+        self.preload_queue.add(key, priority, chname.lower(),
+                               self.preload_file, chname, imname, path,
+                               image_future=image_future)
+
+    def cancel_preloads(self, chname=None):
+        """Cancel background loads that have not started yet, for
+        channel `chname` or, if it is None, for all channels.
+        """
+        if chname is None:
+            return self.preload_queue.cancel(lambda group: True)
+        return self.preload_queue.cancel_group(chname.lower())
 
     def preload_scan(self):
-        # preload any pending files
-        # TODO: do we need any throttling of loading here?
-        with self.preloadLock:
-            while len(self.preloadList) > 0:
-                bnch = self.preloadList.pop(0)
-                self.nongui_do(self.preload_file, bnch.chname,
-                               bnch.imname, bnch.path,
-                               image_future=bnch.image_future)
+        # start any pending loads, within the concurrency limit
+        self.preload_queue.schedule()
 
     def preload_file(self, chname, imname, path, image_future=None):
         # sanity check to see if the file is already in memory
@@ -674,11 +713,14 @@ class GingaControl(Callback.Callbacks):
             # not there--load image in a non-gui thread, then have the
             # gui add it to the channel silently
             self.logger.info("preloading image %s" % (path))
+            start_time = time.time()
             if image_future is None:
                 # TODO: need index info?
                 image = self.load_image(path)
             else:
                 image = image_future.thaw()
+            self.preload_queue.record_timing('load',
+                                             time.time() - start_time)
 
             self.gui_do(self.add_image, imname, image,
                            chname=chname, silent=True)
@@ -723,6 +765,7 @@ class GingaControl(Callback.Callbacks):
                 chinfo.cursor -= 1
             image = chinfo.datasrc.index2value(chinfo.cursor)
             self._switch_image(chinfo, image)
+            self.prepare_images(chinfo, -1)
 
         return True
 
@@ -742,9 +785,72 @@ class GingaControl(Callback.Callbacks):
 
             image = chinfo.datasrc.index2value(chinfo.cursor)
             self._switch_image(chinfo, image)
+            self.prepare_images(chinfo, 1)
 
         return True
 
+    def prepare_images(self, chinfo, direction):
+        """Prepare the images next to the cursor in channel `chinfo`
+        in the background, so that they display without delay: the
+        'prepare_ahead' images in `direction` (1 or -1) and the
+        'prepare_behind' images in the other direction.  This cancels
+        any preparation that is still in progress.
+
+        Only the images held in the channel are stepped through by
+        next_img/prev_img, so these are all in memory already; what is
+        prepared is their min/max and auto cut levels.  Images that have
+        been ejected from the channel are not reloaded here (see
+        switch_name).
+        """
+        self._prepare_gen += 1
+        gen = self._prepare_gen
+
+        num_ahead = self.settings.get('prepare_ahead', 0)
+        num_behind = self.settings.get('prepare_behind', 0)
+        datasrc = chinfo.datasrc
+        n = len(datasrc)
+        offsets = ([direction * i for i in range(1, num_ahead+1)] +
+                   [-direction * i for i in range(1, num_behind+1)])
+        images = []
+        for offset in offsets:
+            if abs(offset) >= n:
+                continue
+            try:
+                image = datasrc.index2value((chinfo.cursor + offset) % n)
+            except (IndexError, KeyError):
+                continue
+            if image not in images:
+                images.append(image)
+
+        if len(images) > 0:
+            name = chinfo.name.lower()
+            self.preload_queue.add(('prepare', name), LoadQueue.PRI_PREFETCH,
+                                   name, self._prepare_bg, gen, chinfo,
+                                   images)
+
+    def _prepare_bg(self, gen, chinfo, images):
+        # executed in a non-gui thread
+        viewer = chinfo.fitsimage
+        for image in images:
+            if gen != self._prepare_gen:
+                # user has moved on
+                self.logger.debug("image preparation cancelled")
+                return
+            try:
+                # statistics are calculated lazily and then saved in
+                # the image, as are auto cut levels (for the viewer's
+                # current method)
+                start_time = time.time()
+                image.get_minmax()
+                if viewer.t_.get('autocuts', 'off') != 'off':
+                    viewer.autocuts.get_cached_cut_levels(image)
+                self.preload_queue.record_timing('prepare',
+                                                 time.time() - start_time)
+
+            except Exception as e:
+                self.logger.warn("Error preparing image '%s': %s" % (
+                    image.get('name', 'NONAME'), str(e)))
+
 
     def add_workspace(self, wsname, wstype, inSpace='channels'):
 
@@ -869,12 +975,19 @@ class GingaControl(Callback.Callbacks):
                 def _load_n_switch(imname, chname, image_future):
                     # this will be executed in a non-gui thread
                     # reconstitute the image
+                    start_time = time.time()
                     image = image_future.thaw()
+                    self.preload_queue.record_timing('load',
+                                                     time.time() - start_time)
                     # perpetuate the image_future
                     image.set(image_future=image_future, name=imname, path=path)
                     self.gui_do(_switch, imname, image, chname)
 
-                self.nongui_do(_load_n_switch, imname, chname, image_future)
+                # supersedes any preload of the same image
+                self.preload_queue.add((chname.lower(), imname),
+                                       LoadQueue.PRI_INTERACTIVE,
+                                       chname.lower(), _load_n_switch,
+                                       imname, chname, image_future)
 
             elif path is not None:
                 # Do we have a path? We can try to reload it
@@ -943,6 +1056,11 @@ class GingaControl(Callback.Callbacks):
             with self.lock:
                 self.chinfo = chinfo
 
+            # cancel any image preparation and preloads for the old channel
+            self._prepare_gen += 1
+            if oldchname is not None:
+                self.cancel_preloads(oldchname)
+
             # change plugin manager info
             chinfo.opmon.update_taskbar(localmode=False)
 
@@ -1003,7 +1121,8 @@ class GingaControl(Callback.Callbacks):
                 return name
         return None
 
-    def add_channel_internal(self, chname, datasrc=None, num_images=1):
+    def add_channel_internal(self, chname, datasrc=None, num_images=1,
+                             max_image_mb=0):
         name = chname.lower()
         with self.lock:
             try:
@@ -1011,7 +1130,9 @@ class GingaControl(Callback.Callbacks):
             except KeyError:
                 self.logger.debug("Adding channel '%s'" % (chname))
                 if datasrc is None:
-                    datasrc = Datasrc.Datasrc(num_images)
+                    datasrc = Datasrc.Datasrc(num_images,
+                                              maxbytes=max_image_mb * 1024 * 1024,
+                                              budget=self.image_budget)
 
                 chinfo = Bunch.Bunch(datasrc=datasrc,
                                  name=chname, cursor=0)
@@ -1073,12 +1194,16 @@ class GingaControl(Callback.Callbacks):
             num_images = settings.get('numImages',
                                       self.settings.get('numImages', 1))
         settings.setDefaults(switchnew=True, numImages=num_images,
-                             raisenew=True, genthumb=True)
+                             raisenew=True, genthumb=True,
+                             max_image_mb=self.settings.get('max_image_mb', 0))
 
         use_readout = not self.settings.get('share_readout', True)
 
         chinfo = self.add_channel_internal(name,
-                                           num_images=num_images)
+                                           num_images=num_images,
+                                           max_image_mb=settings['max_image_mb'])
+        settings.getSetting('max_image_mb').add_callback(
+            'set', self._set_channel_image_mb_cb, chinfo)
 
         with self.lock:
             bnch = self.add_viewer(chname, settings,
@@ -1126,8 +1251,16 @@ class GingaControl(Callback.Callbacks):
             self.ds.remove_tab(chname)
             del self.channel[name]
 
+        self.image_budget.remove_datasrc(chinfo.datasrc)
+
         self.make_callback('delete-channel', chinfo)
 
+    def _set_channel_image_mb_cb(self, setting, value, chinfo):
+        chinfo.datasrc.set_maxbytes(value * 1024 * 1024)
+
+    def _set_image_budget_cb(self, setting, value):
+        self.image_budget.set_maxbytes(value * 1024 * 1024)
+
     def get_channelNames(self):
         with self.lock:
             return [ self.channel[key].name for key in self.channel.keys() ]
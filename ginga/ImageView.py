@@ -13,8 +13,9 @@ import logging
 import threading
 import sys, traceback
 import time
+import weakref
 
-from ginga.misc import Callback, Settings
+from ginga.misc import Callback, Settings, LRUCache, Bunch
 from ginga import RGBMap, AstroImage, AutoCuts, ColorDist
 from ginga import cmap, imap, trcalc, version
 from ginga.canvas import coordmap, CanvasObject
@@ -123,7 +124,12 @@ class ImageViewBase(Callback.Callbacks):
         # for auto cut levels
         self.autocuts_options = ('on', 'override', 'once', 'off')
         self.t_.addDefaults(autocuts='override', autocut_method='zscale',
-                            autocut_params={})
+                            autocut_params={},
+                            # calculate auto cut levels in the background
+                            autocut_async=False,
+                            # cuts to show until they are done: 'minmax'
+                            # or 'last' (the current cuts)
+                            autocut_provisional='minmax')
         for name in ('autocut_method', 'autocut_params'):
             self.t_.getSetting(name).add_callback('set', self.auto_levels_cb)
 
@@ -163,12 +169,30 @@ class ImageViewBase(Callback.Callbacks):
         self.t_.addDefaults(use_embedded_profile=True, auto_orient=False,
                             defer_redraw=True, defer_lagtime=0.025)
 
+        # for tiled rendering of images.  Tiles sample scaled pixel i from
+        # data pixel floor(i / scale), anchored at the data origin, so at
+        # fractional scales they may pick a neighbouring pixel compared to
+        # the untiled path, which is anchored at the cutout corner
+        self.t_.addDefaults(render_tiles=True, tile_size=256,
+                            tile_cache_mb=128)
+        for name in ('render_tiles', 'tile_size', 'tile_cache_mb'):
+            self.t_.getSetting(name).add_callback('set', self.tile_cache_cb)
+
         # Object that calculates auto cut levels
         name = self.t_.get('autocut_method', 'zscale')
         klass = AutoCuts.get_autocuts(name)
         self.autocuts = klass(self.logger)
+        # incremented for each auto cut levels request, so that results
+        # of out of date background calculations can be discarded
+        self._autocut_gen = 0
+        # functions for running work off and on the GUI thread
+        # (see set_task_handlers)
+        self._nongui_do = None
+        self._gui_do = None
 
         self.time_last_redraw = time.time()
+        # time the last redraw started
+        self._time_redraw_start = self.time_last_redraw
 
         # PRIVATE IMPLEMENTATION STATE
 
@@ -214,16 +238,37 @@ class ImageViewBase(Callback.Callbacks):
         self._org_scale_x = 1.0
         self._org_scale_y = 1.0
 
+        # backing arrays for the images on the canvas, used in turn: the
+        # next one to draw into and the last one drawn
         self._rgbarr = None
         self._rgbarr2 = None
+        # array for a contiguous copy of the transformed backing array
+        self._rgbarr3 = None
         self._rgbobj = None
 
+        # window sized output arrays (see getwin_view), and arrays
+        # filled with the background, kept by channel order
+        self._win_arrays = {}
+        self._win_backgrounds = {}
+
+        # cache of rendered image tiles (see NormImage)
+        maxbytes = int(self.t_['tile_cache_mb'] * 1024 * 1024)
+        self.tile_cache = LRUCache.LRUCache(maxbytes=maxbytes)
+        # weak references to images that may have tiles in the cache
+        self._tile_refs = {}
+
         # optimization of redrawing
         self.defer_redraw = self.t_.get('defer_redraw', True)
         self.defer_lagtime = self.t_.get('defer_lagtime', 0.025)
         self._defer_whence = 0
         self._defer_lock = threading.RLock()
         self._defer_flag = False
+        # moving averages of the time taken by redraw_now(), by whence
+        self._redraw_cost = {}
+        # statistics of redrawing (see get_redraw_stats())
+        self._redraw_stats = Bunch.Bunch(num_requests=0, num_coalesced=0,
+                                         num_redraws=0, time_start=None,
+                                         interval=None)
 
         self.img_bg = (0.2, 0.2, 0.2)
 
@@ -528,9 +573,35 @@ class ImageViewBase(Callback.Callbacks):
         # update our display if the image changes underneath us
         image.add_callback('modified', self._image_updated)
 
+        self.watch_tiled_image(image)
+
         self.make_callback('image-set', image)
 
+    def watch_tiled_image(self, image):
+        """
+        Purge the cached tiles of `image` (any image drawn in tiles on
+        our canvas, see NormImage) when it is modified or freed.
+        """
+        imkey = id(image)
+        if imkey in self._tile_refs:
+            return
+        self._tile_refs[imkey] = weakref.ref(
+            image, lambda ref: self._image_freed(imkey))
+        image.add_callback('modified', self._tiled_image_modified)
+
+    def _tiled_image_modified(self, image):
+        if image is self.get_image():
+            # taken care of by _image_updated()
+            return
+        region = image.get_modified_region()
+        self.clear_tile_cache(image=image, region=region)
+        self.redraw(whence=0)
+
     def _image_updated(self, image):
+        region = image.get_modified_region()
+        # cached tiles of (this part of) the image are no longer valid
+        self.clear_tile_cache(image=image, region=region)
+
         if self._normimg is not None:
             self._normimg.set_image(image)
 
@@ -563,6 +634,63 @@ class ImageViewBase(Callback.Callbacks):
         ##     if raise_initialize_errors:
         ##         raise e
 
+        if (region is not None) and (not self._region_is_shown(region)):
+            # change is outside of the area being viewed
+            return
+
+        self.redraw(whence=0)
+
+    def _region_is_shown(self, region):
+        x1, y1, x2, y2 = region
+        points = self.get_pan_rect()
+        xs = [pt[0] for pt in points]
+        ys = [pt[1] for pt in points]
+        # allow for the pixels at the edges, which are partially shown
+        return ((x1 <= max(xs) + 1) and (x2 >= min(xs) - 1) and
+                (y1 <= max(ys) + 1) and (y2 >= min(ys) - 1))
+
+    def _image_freed(self, imkey):
+        self._tile_refs.pop(imkey, None)
+        self.tile_cache.remove_if(lambda key: key[0] == imkey)
+
+    def clear_tile_cache(self, image=None, region=None):
+        """
+        Discard cached rendered tiles of `image`, or of all images if
+        `image` is None.  If `region` (x1, y1, x2, y2) is given, only
+        the tiles showing that part of the image data are discarded.
+        """
+        if image is None:
+            self.tile_cache.clear()
+            return
+        imkey = id(image)
+        if region is None:
+            self.tile_cache.remove_if(lambda key: key[0] == imkey)
+            return
+
+        x1, y1, x2, y2 = region
+
+        def overlaps(key):
+            if key[0] != imkey:
+                return False
+            # see NormImage._assemble_tiles for the layout of the key
+            scale_x, scale_y, tile_size = key[1:4]
+            row, col = key[-2:]
+            # tiles are sampled from the data (or a pyramid level, whose
+            # pixels cover up to 1/scale data pixels), so be generous
+            pad_x, pad_y = 1.0 / scale_x + 1, 1.0 / scale_y + 1
+            tx1, ty1 = col * tile_size / scale_x, row * tile_size / scale_y
+            tx2 = (col + 1) * tile_size / scale_x
+            ty2 = (row + 1) * tile_size / scale_y
+            return ((tx1 - pad_x < x2) and (tx2 + pad_x > x1) and
+                    (ty1 - pad_y < y2) and (ty2 + pad_y > y1))
+
+        self.tile_cache.remove_if(overlaps)
+
+    def tile_cache_cb(self, setting, value):
+        maxbytes = int(self.t_['tile_cache_mb'] * 1024 * 1024)
+        self.tile_cache.set_budget(maxbytes)
+        if setting.name == 'tile_size':
+            self.clear_tile_cache()
         self.redraw(whence=0)
 
     def set_data(self, data, metadata=None, redraw=True):
@@ -624,6 +752,9 @@ class ImageViewBase(Callback.Callbacks):
         target.set_image(image)
 
     def redraw(self, whence=0):
+        with self._defer_lock:
+            self._redraw_stats.num_requests += 1
+
         if not self.defer_redraw:
             self.redraw_now(whence=whence)
             return
@@ -634,10 +765,11 @@ class ImageViewBase(Callback.Callbacks):
             whence = min(self._defer_whence, whence)
             # If there is no redraw scheduled:
             if not self._defer_flag:
-                elapsed = time.time() - self.time_last_redraw
-                # If more time than defer_lagtime has passed since the
-                # last redraw then just do the redraw immediately
-                if elapsed > self.defer_lagtime:
+                elapsed = time.time() - self._time_redraw_start
+                interval = self.get_redraw_interval(whence)
+                # If more time than the redraw interval has passed since
+                # the last redraw started then just do the redraw immediately
+                if elapsed > interval:
                     self._defer_whence = 3
                     self.redraw_now(whence=whence)
                     return
@@ -646,12 +778,22 @@ class ImageViewBase(Callback.Callbacks):
                 self._defer_flag = True
                 self._defer_whence = whence
 
-                # schedule a redraw by the end of the defer_lagtime
-                self.reschedule_redraw(self.defer_lagtime - elapsed)
+                # schedule a redraw by the end of the interval
+                self.reschedule_redraw(interval - elapsed)
 
             else:
-                # A redraw is already scheduled.  Just record whence.
+                # A redraw is already scheduled.  Just record whence;
+                # the states in between (e.g. during a pan or zoom
+                # gesture) are never drawn.
+                if whence < self._defer_whence:
+                    # a costlier redraw may need more time since the last
+                    elapsed = time.time() - self._time_redraw_start
+                    interval = self.get_redraw_interval(whence)
+                    if (interval > self.get_redraw_interval(self._defer_whence)
+                        and interval > elapsed):
+                        self.reschedule_redraw(interval - elapsed)
                 self._defer_whence = whence
+                self._redraw_stats.num_coalesced += 1
 
     def canvas_changed_cb(self, canvas, whence):
         self.logger.debug("root canvas changed, whence=%d" % (whence))
@@ -675,6 +817,74 @@ class ImageViewBase(Callback.Callbacks):
         if self.defer_redraw:
             self.defer_lagtime = lag_sec
 
+    def set_redraw_fps(self, fps):
+        """Limit deferred redraws to at most `fps` per second.
+        An `fps` of zero or less removes the limit: redraws are then
+        done immediately, as with set_redraw_lag(0).
+        """
+        if fps <= 0:
+            self.set_redraw_lag(0)
+        else:
+            self.set_redraw_lag(1.0 / fps)
+
+    def get_redraw_interval(self, whence=0):
+        """
+        Returns the minimum time (in seconds) from the start of one redraw
+        to the start of the next: the redraw lag (one frame at the target
+        frame rate), or one and a half times the average time taken by a
+        redraw at this `whence`, if that is longer--so that redraws too
+        slow for the frame rate leave time for handling the events in
+        between.
+        """
+        cost = self._redraw_cost.get(int(whence), 0.0)
+        return max(self.defer_lagtime, 1.5 * cost)
+
+    def get_redraw_stats(self):
+        """
+        Returns a Bunch of redraw statistics:
+
+        num_requests   number of redraws requested
+        num_coalesced  number of requests merged into a pending redraw
+        num_redraws    number of redraws done
+        time_redraw    dict of average seconds per redraw, by whence
+        interval       average seconds between redraws (None if unknown)
+        fps            redraws per second from `interval`
+        """
+        with self._defer_lock:
+            stats = self._redraw_stats
+            res = Bunch.Bunch(num_requests=stats.num_requests,
+                              num_coalesced=stats.num_coalesced,
+                              num_redraws=stats.num_redraws,
+                              time_redraw=self._redraw_cost.copy(),
+                              interval=stats.interval)
+        res.fps = None
+        if res.interval:
+            res.fps = 1.0 / res.interval
+        return res
+
+    def clear_redraw_stats(self):
+        with self._defer_lock:
+            self._redraw_stats.update(dict(num_requests=0, num_coalesced=0,
+                                           num_redraws=0, time_start=None,
+                                           interval=None))
+            self._redraw_cost = {}
+
+    def _record_redraw(self, whence, time_start, time_elapsed):
+        with self._defer_lock:
+            stats = self._redraw_stats
+            stats.num_redraws += 1
+            # moving averages of the time taken and between redraws
+            whence = int(whence)
+            cost = self._redraw_cost.get(whence, time_elapsed)
+            self._redraw_cost[whence] = 0.8 * cost + 0.2 * time_elapsed
+            if stats.time_start is not None:
+                delta = time_start - stats.time_start
+                if stats.interval is None:
+                    stats.interval = delta
+                else:
+                    stats.interval = 0.8 * stats.interval + 0.2 * delta
+            stats.time_start = time_start
+
     def redraw_now(self, whence=0):
         """
         Redraw the displayed image.
@@ -691,6 +901,8 @@ class ImageViewBase(Callback.Callbacks):
             time_delta = time_start - self.time_last_redraw
             time_elapsed = time_done - time_start
             self.time_last_redraw = time_done
+            self._time_redraw_start = time_start
+            self._record_redraw(whence, time_start, time_elapsed)
             self.logger.debug("widget '%s' redraw (whence=%d) delta=%.4f elapsed=%.4f sec" % (
                 self.name, whence, time_delta, time_elapsed))
 
@@ -721,9 +933,33 @@ class ImageViewBase(Callback.Callbacks):
         if whence <= 0:
             self.make_callback('redraw')
 
-    def getwin_array(self, order='RGB', alpha=1.0):
+    def _get_win_background(self, order, alpha, shape):
+        """Returns an array of `shape` filled with the background color,
+        (re)making it only if the size or colors have changed.
+        """
+        key = (shape, self.img_bg, alpha)
+        bnch = self._win_backgrounds.get(order, None)
+        if (bnch is not None) and (bnch.key == key):
+            return bnch.arr
+
+        r, g, b = self.img_bg
+        bgval = dict(A=int(255*alpha), R=int(255*r), G=int(255*g), B=int(255*b))
+        arr = numpy.empty(shape, dtype=numpy.uint8)
+        arr[:] = numpy.array([bgval[c] for c in order], dtype=numpy.uint8)
+        self._win_backgrounds[order] = Bunch.Bunch(key=key, arr=arr)
+        return arr
+
+    def getwin_view(self, order='RGB', alpha=1.0, out=None):
+        """
+        Returns the contents of the window (image on the background) as
+        an array with channels in `order`.
+
+        The array is kept and written again on the next call, so it
+        must not be held on to; use getwin_array() for an array of one's
+        own.  Alternatively, the window can be written straight into the
+        array `out`, which must be of the right shape.
+        """
         order = order.upper()
-        depth = len(order)
 
         # Prepare data array for rendering
         data = self._rgbobj.get_array(order)
@@ -732,27 +968,57 @@ class ImageViewBase(Callback.Callbacks):
         height, width, depth = data.shape
 
         imgwin_wd, imgwin_ht = self.get_window_size()
-
-        # create RGBA array for output
-        outarr = numpy.zeros((imgwin_ht, imgwin_wd, depth), dtype='uint8')
-
-        # fill image array with the background color
-        r, g, b = self.img_bg
-        bgval = dict(A=int(255*alpha), R=int(255*r), G=int(255*g), B=int(255*b))
-
-        for i in range(len(order)):
-            outarr[:, :, i] = bgval[order[i]]
+        shape = (imgwin_ht, imgwin_wd, depth)
+        bgarr = self._get_win_background(order, alpha, shape)
+
+        # without alpha the data is opaque, so only the part of the window
+        # not covered by it needs to be filled with the background, if the
+        # array was filled before with the same one
+        refill = True
+        if out is None:
+            bnch = self._win_arrays.get(order, None)
+            if (bnch is not None) and (bnch.arr.shape == shape):
+                refill = ('A' in order) or (bnch.bgarr is not bgarr)
+                out = bnch.arr
+            else:
+                out = numpy.empty(shape, dtype=numpy.uint8)
+            self._win_arrays[order] = Bunch.Bunch(arr=out, bgarr=bgarr)
+
+        x1, y1 = max(self._dst_x, 0), max(self._dst_y, 0)
+        x2 = min(self._dst_x + width, imgwin_wd)
+        y2 = min(self._dst_y + height, imgwin_ht)
+        if refill or (x1 >= x2) or (y1 >= y2):
+            out[...] = bgarr
+        else:
+            out[:y1] = bgarr[:y1]
+            out[y2:] = bgarr[y2:]
+            out[y1:y2, :x1] = bgarr[y1:y2, :x1]
+            out[y1:y2, x2:] = bgarr[y1:y2, x2:]
 
         # overlay our data
-        trcalc.overlay_image(outarr, self._dst_x, self._dst_y,
+        trcalc.overlay_image(out, self._dst_x, self._dst_y,
                              data, flipy=False, fill=False, copy=False)
 
-        return outarr
+        return out
+
+    def getwin_array(self, order='RGB', alpha=1.0):
+        """
+        Returns a new array of the contents of the window (see
+        getwin_view).
+        """
+        return self.getwin_view(order=order, alpha=alpha).copy()
 
     def getwin_buffer(self, order='RGB'):
-        outarr = self.getwin_array(order=order)
+        """
+        Returns the contents of the window as a buffer of bytes: a flat,
+        read-only view of the array from getwin_view (not a copy), which
+        can be passed wherever a string of bytes is expected.
+        """
+        outarr = self.getwin_view(order=order).reshape(-1)
+        # read-only, as some backends only take read-only buffers
+        outarr.flags.writeable = False
 
-        return outarr.tostring(order='C')
+        return outarr
 
     def get_datarect(self):
         """
@@ -786,14 +1052,20 @@ class ImageViewBase(Callback.Callbacks):
                                               self._pan_x, self._pan_y,
                                               win_wd, win_ht)
 
-            # create backing image
+            # create backing images, if the size has changed
             depth = len(order)
-            rgba = numpy.zeros((ht, wd, depth), dtype=numpy.uint8)
-            self._rgbarr = rgba
+            shape = (ht, wd, depth)
+            if (self._rgbarr is None) or (self._rgbarr.shape != shape):
+                self._rgbarr = numpy.zeros(shape, dtype=numpy.uint8)
+                self._rgbarr2 = numpy.zeros(shape, dtype=numpy.uint8)
+
+        if (whence <= 2.0) or (self._rgbobj is None):
+            # draw into the backing image not drawn last time, keeping
+            # the last one intact
+            self._rgbarr, self._rgbarr2 = self._rgbarr2, self._rgbarr
+            self._clear_backing_image(self._rgbarr2, order)
 
-        if (whence <= 2.0) or (self._rgbarr2 is None):
             # Apply any RGB image overlays
-            self._rgbarr2 = numpy.copy(self._rgbarr)
             self.overlay_images(self.canvas, self._rgbarr2, whence=whence)
 
         if (whence <= 2.5) or (self._rgbobj is None):
@@ -803,7 +1075,13 @@ class ImageViewBase(Callback.Callbacks):
             # if not applied earlier
             rotimg = self.apply_transforms(rotimg,
                                            self.t_['rot_deg'])
-            rotimg = numpy.ascontiguousarray(rotimg)
+            if not rotimg.flags.c_contiguous:
+                out = self._rgbarr3
+                if (out is None) or (out.shape != rotimg.shape):
+                    out = numpy.empty(rotimg.shape, dtype=numpy.uint8)
+                    self._rgbarr3 = out
+                out[...] = rotimg
+                rotimg = out
 
             self._rgbobj = RGBMap.RGBPlanes(rotimg, order)
 
@@ -813,6 +1091,22 @@ class ImageViewBase(Callback.Callbacks):
         return self._rgbobj
 
 
+    def _clear_backing_image(self, rgbarr, order):
+        """Zero the part of backing image `rgbarr` that was drawn into.
+        Everything drawn by the canvas images is opaque in the alpha
+        channel, so that gives the area to clear.
+        """
+        if 'A' not in order:
+            rgbarr.fill(0)
+            return
+
+        alpha = rgbarr[:, :, order.index('A')]
+        rows = numpy.nonzero(alpha.any(axis=1))[0]
+        if len(rows) == 0:
+            return
+        cols = numpy.nonzero(alpha.any(axis=0))[0]
+        rgbarr[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1, :] = 0
+
     def _calc_bg_dimensions(self, scale_x, scale_y,
                             pan_x, pan_y, win_wd, win_ht):
 
@@ -869,10 +1163,26 @@ class ImageViewBase(Callback.Callbacks):
         self._org_x2 = x2
         self._org_y2 = y2
 
-        # Make a square from the scaled cutout, with room to rotate
+        # side of a square that has room to rotate the window
         slop = 20
         side = int(math.sqrt(win_wd**2 + win_ht**2) + slop)
-        wd = ht = side
+
+        rot_deg = self.t_['rot_deg']
+        if math.fmod(rot_deg, 90.0) == 0.0:
+            # no rotation, or by a multiple of 90 deg (see apply_transforms):
+            # the backing image just needs to cover the window, turned
+            # to the orientation of the data, with a little room for
+            # rounding at the edges.  The sides are those of the square
+            # modulo 4, so that images are placed in it (and rounded)
+            # just as they are in the square
+            slop = 4
+            wd, ht = win_wd + slop, win_ht + slop
+            wd, ht = wd + (side - wd) % 4, ht + (side - ht) % 4
+            if self.t_['swap_xy'] != (math.fmod(rot_deg, 180.0) != 0.0):
+                wd, ht = ht, wd
+        else:
+            # Make a square from the scaled cutout, with room to rotate
+            wd = ht = side
 
         # Find center of new array
         ncx, ncy = wd // 2, ht // 2
@@ -908,7 +1218,27 @@ class ImageViewBase(Callback.Callbacks):
         wd, ht = self.get_dims(data)
 
         # Rotate the image as necessary
-        if rot_deg != 0:
+        if math.fmod(rot_deg, 90.0) == 0.0:
+            # multiples of 90 deg just turn the array (a view).  The
+            # pixel that rotate_clip() would turn around moves with it,
+            # and the offsets (which a flip may have moved away from
+            # that pixel) keep their distance from it
+            k = int(round(rot_deg / 90.0)) % 4
+            cx, cy = wd // 2, ht // 2
+            dx, dy = xoff - cx, yoff - cy
+            if k == 1:
+                data = numpy.rot90(data, -1)
+                cx, cy = ht - 1 - cy, cx
+            elif k == 2:
+                data = data[::-1, ::-1]
+                cx, cy = wd - 1 - cx, ht - 1 - cy
+            elif k == 3:
+                data = numpy.rot90(data, 1)
+                cx, cy = cy, wd - 1 - cx
+            xoff, yoff = cx + dx, cy + dy
+            wd, ht = self.get_dims(data)
+
+        else:
             # TODO: this is the slowest part of the rendering
             # need to find a way to speed it up!
             data = trcalc.rotate_clip(data, -rot_deg, out=data)
@@ -1467,6 +1797,9 @@ class ImageViewBase(Callback.Callbacks):
         hival : float
             the high value of the cut levels
         """
+        # cancel any auto cut levels in progress
+        self._autocut_gen += 1
+
         self.t_.set(cuts=(loval, hival))
 
         # If user specified "override" or "once" for auto levels,
@@ -1498,7 +1831,45 @@ class ImageViewBase(Callback.Callbacks):
         if image is None:
             return
 
-        loval, hival = autocuts.calc_cut_levels(image)
+        # this supersedes any calculation in progress
+        self._autocut_gen += 1
+        gen = self._autocut_gen
+
+        if self.t_.get('autocut_async', False) and (self._gui_do is None):
+            # results could not be applied safely from another thread
+            self.logger.debug("no GUI task handler set--calculating "
+                              "auto cut levels synchronously")
+
+        elif self.t_.get('autocut_async', False):
+            # show the image now with provisional cut levels and
+            # calculate the real ones in the background
+            if self.t_.get('autocut_provisional', 'minmax') == 'minmax':
+                loval, hival = image.get_minmax()
+                self.t_.set(cuts=(float(loval), float(hival)))
+            self._run_nongui(self._calc_autocuts_bg, gen, autocuts, image)
+            return
+
+        loval, hival = autocuts.get_cached_cut_levels(image)
+        self._set_autocuts(gen, image, loval, hival)
+
+    def _calc_autocuts_bg(self, gen, autocuts, image):
+        if gen != self._autocut_gen:
+            # superseded while waiting to run
+            return
+        try:
+            loval, hival = autocuts.get_cached_cut_levels(image)
+
+        except Exception as e:
+            self.logger.error("Error calculating auto cut levels: %s" % (
+                str(e)))
+            return
+
+        self._run_gui(self._set_autocuts, gen, image, loval, hival)
+
+    def _set_autocuts(self, gen, image, loval, hival):
+        if (gen != self._autocut_gen) or (image is not self.get_image()):
+            self.logger.debug("discarding out of date auto cut levels")
+            return
 
         # this will invoke cut_levels_cb()
         self.t_.set(cuts=(loval, hival))
@@ -1508,6 +1879,33 @@ class ImageViewBase(Callback.Callbacks):
         if self.t_['autocuts'] == 'once':
             self.t_.set(autocuts='off')
 
+    def set_task_handlers(self, nongui_do, gui_do):
+        """
+        Set the functions used to run work in a background thread and
+        to deliver results on the GUI thread (e.g. for asynchronous
+        auto cut levels).  Both are called as fn(method, *args).  The
+        reference viewer passes its nongui_do() and gui_do() here.
+
+        Without `nongui_do`, a new thread is started for background work.
+        Without `gui_do`, auto cut levels are calculated synchronously.
+        """
+        self._nongui_do = nongui_do
+        self._gui_do = gui_do
+
+    def _run_nongui(self, method, *args):
+        if self._nongui_do is not None:
+            self._nongui_do(method, *args)
+        else:
+            thr = threading.Thread(target=method, args=args)
+            thr.daemon = True
+            thr.start()
+
+    def _run_gui(self, method, *args):
+        if self._gui_do is not None:
+            self._gui_do(method, *args)
+        else:
+            method(*args)
+
 
     def auto_levels_cb(self, setting, value):
         # Did we change the method?
@@ -79,6 +79,17 @@ class RGBMapper(Callback.Callbacks):
             dist = ColorDist.LinearDist(hashsize)
         self.dist = dist
 
+        # incremented whenever the mapping changes, so that users can tell
+        # whether results cached from an earlier mapping are still valid
+        self.version = 0
+
+        # combined lookup table (hash value -> RGB) used by
+        # get_rgbarray_from_data(), and the state it was computed for
+        self._lut = None
+        self._lut_key = None
+        # number of pixels processed at a time by get_rgbarray_from_data()
+        self.chunk_size = 65536
+
         # For callbacks
         for name in ('changed', ):
             self.enable_callback(name)
@@ -106,6 +117,18 @@ class RGBMapper(Callback.Callbacks):
         #self.carr = arr.astype('uint8')
         self.carr = numpy.round(arr).astype('uint8')
 
+    def get_version(self):
+        """
+        Return a number that changes whenever the mapping done by this
+        RGBMapper changes.
+        """
+        return self.version
+
+    def _changed(self, callback):
+        self.version += 1
+        if callback:
+            self.make_callback('changed')
+
     def get_rgb(self, index):
         """
         Return a tuple of (R, G, B) values in the 0-255 range associated
@@ -148,16 +171,14 @@ class RGBMapper(Callback.Callbacks):
 
     def reset_sarr(self, callback=True):
         self.sarr = numpy.array(list(range(256)))
-        if callback:
-            self.make_callback('changed')
+        self._changed(callback)
 
     def set_sarr(self, sarr, callback=True):
         assert len(sarr) == 256, \
                RGBMapError("shift map length %d != 256" % (len(sarr)))
         self.sarr = sarr.astype('uint')
 
-        if callback:
-            self.make_callback('changed')
+        self._changed(callback)
 
     def get_sarr(self):
         return self.sarr
@@ -178,8 +199,7 @@ class RGBMapper(Callback.Callbacks):
 
     def set_hash_size(self, size, callback=True):
         self.dist.set_hash_size(size)
-        if callback:
-            self.make_callback('changed')
+        self._changed(callback)
     
     def get_hash_algorithms(self):
         return ColorDist.get_dist_names()
@@ -195,8 +215,7 @@ class RGBMapper(Callback.Callbacks):
     
     def set_dist(self, dist, callback=True):
         self.dist = dist
-        if callback:
-            self.make_callback('changed')
+        self._changed(callback)
     
     def set_hash_algorithm(self, name, callback=True, **kwdargs):
         hashsize = self.dist.get_hash_size()
@@ -283,6 +302,96 @@ class RGBMapper(Callback.Callbacks):
     
     def get_hasharray(self, idx):
         return self.dist.hash_array(idx)
+
+    def can_map_data(self, data):
+        """Returns True if get_rgbarray_from_data() can be used to map
+        `data`.
+        """
+        return (len(data.shape) == 2) and not self.dist.is_data_dependent()
+
+    def get_lut(self, order='RGB'):
+        """
+        Return a (hashsize, len(order)) uint8 array that maps a hash index
+        (see get_hasharray) directly to output pixel values in `order`.
+        It combines the color distribution, shift map, intensity map and
+        color map, and is recomputed only when one of them changes.
+        """
+        order = order.upper()
+        dist = self.dist
+        key = (self.version, id(dist), dist.get_version(), order)
+        lut_key, lut = self._lut_key, self._lut
+        if lut_key == key:
+            return lut
+
+        # same steps as get_hasharray() + _get_rgbarray(), applied to
+        # every possible index
+        idx = dist.hash.clip(0, 255)
+        idx = self.sarr[idx]
+        idx.clip(0, 255, out=idx)
+
+        lut = numpy.empty((len(idx), len(order)), dtype=numpy.uint8)
+        ri, gi, bi = self.get_order_indexes(order, 'RGB')
+        lut[:, ri] = self.arr[0][idx]
+        lut[:, gi] = self.arr[1][idx]
+        lut[:, bi] = self.arr[2][idx]
+        if 'A' in order:
+            lut[:, order.index('A')] = 255
+
+        self._lut, self._lut_key = lut, key
+        return lut
+
+    def get_rgbarray_from_data(self, data, loval, hival, out=None,
+                               order='RGB'):
+        """
+        Like get_rgbarray(), but takes the raw (2D) data and the cut levels
+        instead of an index array.  Does the equivalent of the linear
+        AutoCuts cut_levels(), get_hasharray() and the color mapping in
+        one pass through a combined lookup table (see get_lut), working
+        on pieces of the data to avoid allocating full size temporaries.
+        Check can_map_data() before calling this.
+        """
+        ht, wd = data.shape[:2]
+        depth = len(order)
+        res_shape = (ht, wd, depth)
+        if out is None:
+            out = numpy.empty(res_shape, dtype=numpy.uint8, order='C')
+        else:
+            assert res_shape == out.shape, \
+                   RGBMapError("Output array shape %s doesn't match result shape %s" % (
+                str(out.shape), str(res_shape)))
+
+        lut = self.get_lut(order)
+        vmax = len(lut) - 1
+        loval, hival = float(loval), float(hival)
+        delta = hival - loval
+        if delta == 0.0:
+            raise RGBMapError("Cut levels must not be equal")
+
+        # work arrays, reused for each piece
+        if issubclass(data.dtype.type, numpy.floating):
+            ftype = data.dtype
+        else:
+            ftype = numpy.float64
+        rows = max(1, self.chunk_size // max(wd, 1))
+        fbuf = numpy.empty((rows, wd), dtype=ftype)
+        ibuf = numpy.empty((rows, wd), dtype=numpy.uint)
+
+        for y in range(0, ht, rows):
+            n = min(rows, ht - y)
+            f, i = fbuf[:n], ibuf[:n]
+            # See NOTE [A]
+            numpy.clip(data[y:y+n], loval, hival, out=f)
+            f -= loval
+            f /= delta
+            f.clip(0.0, 1.0, out=f)
+            f *= vmax
+            numpy.copyto(i, f, casting='unsafe')
+            # NaNs end up as very large values here
+            numpy.minimum(i, vmax, out=i)
+            numpy.take(lut, i.view(numpy.intp), axis=0, out=out[y:y+n],
+                       mode='clip')
+
+        return RGBPlanes(out, order)
         
     def _shift(self, sarr, pct, rotate=False):
         n = len(sarr)
@@ -313,8 +422,7 @@ class RGBMapper(Callback.Callbacks):
         assert len(work) == 256, \
                RGBMapError("shifted shift map is != 256")
         self.sarr = work
-        if callback:
-            self.make_callback('changed')
+        self._changed(callback)
         
     def scaleNshift(self, scale_pct, shift_pct, callback=True):
         """Stretch and/or shrink the color map via altering the shift map.
@@ -349,8 +457,7 @@ class RGBMapper(Callback.Callbacks):
                RGBMapError("shifted shift map is != 256")
 
         self.sarr = work
-        if callback:
-            self.make_callback('changed')
+        self._changed(callback)
 
 
     def copy_attributes(self, dst_rgbmap):
@@ -369,6 +476,10 @@ class PassThruRGBMapper(RGBMapper):
 
         # ignore passed in distribution 
         self.dist = ColorDist.LinearDist(256)
+
+    def can_map_data(self, data):
+        # data is the final RGB values, no mapping to fuse
+        return False
             
     def get_rgbarray(self, idx, out=None, order='RGB', image_order='RGB'):
         # prepare output array
@@ -7,8 +7,16 @@
 # This is open-source software licensed under a BSD license.
 # Please see the file LICENSE.txt for details.
 #
+import numpy
 
+import ginga.util.six as six
+if six.PY2:
+    import xmlrpclib
+else:
+    import xmlrpc.client as xmlrpclib
 from ginga.AstroImage import AstroImage, AstroHeader
+from ginga.misc import Bunch
+from ginga import trcalc
 
 class RemoteImage(AstroImage):
 
@@ -24,6 +32,10 @@ class RemoteImage(AstroImage):
                             logger=logger, #wcsclass=wcsClass, ioclass=ioClass,
                             inherit_primary_header=inherit_primary_header)
         self._data = None
+        # False if the server cannot sample several lines in one call
+        self._remote_lines = True
+        # building a pyramid would require fetching all the data
+        self.pyramid_threshold = None
 
     @property
     def shape(self):
@@ -61,5 +73,36 @@ class RemoteImage(AstroImage):
         # TODO: cache some points for faster response?
         return self._proxy.get_data_xy(self.id, x, y)
 
-    def get_pixels_on_line(self, x1, y1, x2, y2):
-        return self._proxy.get_pixels_on_line(self.id, x1, y1, x2, y2)
+    def get_pixels_on_lines(self, lines, width=1, method='nearest'):
+        """
+        Sample all the lines on the remote server, in one call.  The
+        server returns the lists (x, y, values) for each line.
+
+        Older servers only have get_pixels_on_line(); for those each line
+        is fetched separately, sampling the nearest pixels.
+        """
+        lines = list(lines)
+        if self._remote_lines:
+            try:
+                res = self._proxy.get_pixels_on_lines(self.id, lines,
+                                                      width, method)
+                return [Bunch.Bunch(x=numpy.asarray(x_l),
+                                    y=numpy.asarray(y_l),
+                                    data=numpy.asarray(values,
+                                                       dtype=numpy.float64))
+                        for x_l, y_l, values in res]
+
+            except xmlrpclib.Fault as e:
+                self.logger.warning("Server cannot sample lines (%s); "
+                                    "fetching them one at a time" % (
+                    str(e)))
+                self._remote_lines = False
+
+        res = []
+        for x1, y1, x2, y2 in lines:
+            x_arr, y_arr = trcalc.get_line_coords(x1, y1, x2, y2)
+            values = self._proxy.get_pixels_on_line(self.id, x1, y1, x2, y2)
+            res.append(Bunch.Bunch(x=x_arr, y=y_arr,
+                                   data=numpy.asarray(values,
+                                                      dtype=numpy.float64)))
+        return res
@@ -13,7 +13,7 @@ import numpy
 from ginga.misc import Callback, Bunch
 from ginga.misc.ParamSet import Param
 from ginga.util import wcs
-from ginga import trcalc, Mixins, colors
+from ginga import trcalc, Mixins, colors, ColorDist
 from ginga.util.six.moves import map, filter
 
 from .CompoundMixin import CompoundMixin
@@ -2488,10 +2488,29 @@ class NormImage(Image):
         # `whence` they may not need to be recomputed.
         self._prergb = None
         self._rgbarr = None
+        # region of the scaled image covered by tiles, if tiling
+        self._tile_rect = None
+        # max number of pixels to sample for histogram equalization
+        self.histeq_samples = 1024 * 1024
 
     def draw_image(self, viewer, dstarr, whence=0.0):
         #print("redraw whence=%f" % (whence))
 
+        if self.rgbmap is not None:
+            rgbmap = self.rgbmap
+        else:
+            rgbmap = viewer.get_rgbmap()
+        dist = rgbmap.get_dist()
+        if isinstance(dist, ColorDist.HistogramEqualizationDist):
+            self._set_histogram(viewer, dist)
+
+        # use the viewer's tile cache, if it has one and tiling is enabled
+        tile_cache = getattr(viewer, 'tile_cache', None)
+        if ((tile_cache is not None) and self.optimize and
+            viewer.t_.get('render_tiles', False) and
+            self.can_tile(viewer)):
+            return self._draw_tiled(viewer, tile_cache, dstarr, whence=whence)
+
         if (whence <= 0.0) or (self._cutout is None) or (not self.optimize):
             # get extent of our data coverage in the window
             ((x0, y0), (x1, y1), (x2, y2), (x3, y3)) = viewer.get_pan_rect()
@@ -2545,23 +2564,120 @@ class NormImage(Image):
             self._cvs_x = int(round(wd / 2.0  + off_x))
             self._cvs_y = int(round(ht / 2.0  + off_y))
 
-        if self.rgbmap is not None:
-            rgbmap = self.rgbmap
+        dst_order = viewer.get_rgb_order()
+        image_order = self.image.get_order()
+        get_order = dst_order
+        if ('A' in dst_order) and not ('A' in image_order):
+            get_order = dst_order.replace('A', '')
+
+        if self.can_map_data(viewer, rgbmap, self._cutout):
+            # cut levels and color mapping are done together, straight
+            # from the data
+            self._prergb = None
+            if (whence <= 2.5) or (self._rgbarr is None) or (not self.optimize):
+                # reuse our last output array, if possible
+                ht, wd = self._cutout.shape[:2]
+                out = self._rgbarr
+                if (out is None) or (out.shape != (ht, wd, len(get_order))):
+                    out = None
+                loval, hival = viewer.t_['cuts']
+                rgbobj = rgbmap.get_rgbarray_from_data(self._cutout,
+                                                       loval, hival,
+                                                       out=out,
+                                                       order=get_order)
+                self._rgbarr = rgbobj.rgbarr
+
         else:
+            if (whence <= 1.0) or (self._prergb is None) or (not self.optimize):
+                # apply visual changes prior to color mapping (cut levels, etc)
+                vmax = rgbmap.get_hash_size() - 1
+                newdata = self.apply_visuals(viewer, self._cutout, 0, vmax)
+
+                # result becomes an index array fed to the RGB mapper
+                if not numpy.issubdtype(newdata.dtype, numpy.dtype('uint')):
+                    newdata = newdata.astype(numpy.uint)
+                idx = newdata
+
+                self.logger.debug("shape of index is %s" % (str(idx.shape)))
+                self._prergb = idx
+
+            if (whence <= 2.5) or (self._rgbarr is None) or (not self.optimize):
+                # get RGB mapped array
+                rgbobj = rgbmap.get_rgbarray(self._prergb, order=dst_order,
+                                             image_order=image_order)
+                self._rgbarr = rgbobj.get_array(get_order)
+
+        # composite the image into the destination array at the
+        # calculated position
+        trcalc.overlay_image(dstarr, self._cvs_x, self._cvs_y, self._rgbarr,
+                             dst_order=dst_order, src_order=get_order,
+                             alpha=self.alpha, flipy=False)
+
+    def can_tile(self, viewer):
+        """Returns True if this image can be rendered in independent tiles.
+        """
+        rgbmap = self.rgbmap
+        if rgbmap is None:
             rgbmap = viewer.get_rgbmap()
+        # e.g. histogram equalization, without a histogram set
+        return not rgbmap.get_dist().is_data_dependent()
 
-        if (whence <= 1.0) or (self._prergb is None) or (not self.optimize):
-            # apply visual changes prior to color mapping (cut levels, etc)
-            vmax = rgbmap.get_hash_size() - 1
-            newdata = self.apply_visuals(viewer, self._cutout, 0, vmax)
+    def _draw_tiled(self, viewer, tile_cache, dstarr, whence=0.0):
+        if (whence <= 0.0) or (self._tile_rect is None):
+            # get extent of our data coverage in the window
+            ((x0, y0), (x1, y1), (x2, y2), (x3, y3)) = viewer.get_pan_rect()
+            xmin = int(min(x0, x1, x2, x3))
+            ymin = int(min(y0, y1, y2, y3))
+            xmax = int(max(x0, x1, x2, x3))
+            ymax = int(max(y0, y1, y2, y3))
 
-            # result becomes an index array fed to the RGB mapper
-            if not numpy.issubdtype(newdata.dtype, numpy.dtype('uint')):
-                newdata = newdata.astype(numpy.uint)
-            idx = newdata
+            # destination location in data_coords
+            dst_x, dst_y = self.x, self.y
+
+            a1, b1, a2, b2 = 0, 0, self.image.width, self.image.height
 
-            self.logger.debug("shape of index is %s" % (str(idx.shape)))
-            self._prergb = idx
+            # calculate the part of the image that is visible
+            dst_x, dst_y, a1, b1, a2, b2 = \
+                   trcalc.calc_image_merge_clip(xmin, ymin, xmax, ymax,
+                                                dst_x, dst_y, a1, b1, a2, b2)
+
+            # is image completely off the screen?
+            if (a2 - a1 <= 0) or (b2 - b1 <= 0):
+                # no overlay needed
+                self._tile_rect = None
+                return
+
+            scale_x, scale_y = viewer.get_scale_xy()
+            # scale additionally by our scale
+            _scale_x, _scale_y = scale_x * self.scale_x, scale_y * self.scale_y
+
+            # region we need, in the coordinates of the scaled image
+            # (the clipped region is inclusive of a2, b2)
+            a2 = min(a2 + 1, self.image.width)
+            b2 = min(b2 + 1, self.image.height)
+            x1 = int(math.floor(a1 * _scale_x))
+            y1 = int(math.floor(b1 * _scale_y))
+            x2 = int(math.ceil(a2 * _scale_x))
+            y2 = int(math.ceil(b2 * _scale_y))
+            self._tile_rect = (x1, y1, x2, y2, _scale_x, _scale_y)
+
+            # calculate our offset from the pan position
+            pan_x, pan_y = viewer.get_pan()
+            pan_off = viewer.data_off
+            pan_x, pan_y = pan_x + pan_off, pan_y + pan_off
+            off_x = (self.x - pan_x) * scale_x + x1
+            off_y = (self.y - pan_y) * scale_y + y1
+
+            # dst position in the pre-transformed array should be calculated
+            # from the center of the array plus offsets
+            ht, wd, dp = dstarr.shape
+            self._cvs_x = int(round(wd / 2.0  + off_x))
+            self._cvs_y = int(round(ht / 2.0  + off_y))
+
+        if self.rgbmap is not None:
+            rgbmap = self.rgbmap
+        else:
+            rgbmap = viewer.get_rgbmap()
 
         dst_order = viewer.get_rgb_order()
         image_order = self.image.get_order()
@@ -2569,11 +2685,11 @@ class NormImage(Image):
         if ('A' in dst_order) and not ('A' in image_order):
             get_order = dst_order.replace('A', '')
 
-        if (whence <= 2.5) or (self._rgbarr is None) or (not self.optimize):
-            # get RGB mapped array
-            rgbobj = rgbmap.get_rgbarray(self._prergb, order=dst_order,
-                                         image_order=image_order)
-            self._rgbarr = rgbobj.get_array(get_order)
+        if (whence <= 2.5) or (self._rgbarr is None):
+            # our tiles must be purged if the image changes or goes away
+            viewer.watch_tiled_image(self.image)
+            self._rgbarr = self._assemble_tiles(viewer, tile_cache, rgbmap,
+                                                dst_order, get_order)
 
         # composite the image into the destination array at the
         # calculated position
@@ -2581,6 +2697,113 @@ class NormImage(Image):
                              dst_order=dst_order, src_order=get_order,
                              alpha=self.alpha, flipy=False)
 
+    def _assemble_tiles(self, viewer, tile_cache, rgbmap, dst_order,
+                        get_order):
+        x1, y1, x2, y2, scale_x, scale_y = self._tile_rect
+        tile_size = viewer.t_.get('tile_size', 256)
+
+        if self.autocuts is not None:
+            autocuts = self.autocuts
+        else:
+            autocuts = viewer.autocuts
+        loval, hival = viewer.t_['cuts']
+
+        # everything that determines the appearance of a tile is in its key
+        key_pfx = (id(self.image), scale_x, scale_y, tile_size,
+                   loval, hival, autocuts.__class__,
+                   id(rgbmap), rgbmap.get_version(), dst_order, get_order)
+
+        # extent of the whole scaled image
+        wd = int(math.ceil(self.image.width * scale_x))
+        ht = int(math.ceil(self.image.height * scale_y))
+
+        outarr = numpy.empty((y2 - y1, x2 - x1, len(get_order)),
+                             dtype=numpy.uint8)
+
+        for row in range(y1 // tile_size, (y2 - 1) // tile_size + 1):
+            ty1 = row * tile_size
+            ty2 = min(ty1 + tile_size, ht)
+            for col in range(x1 // tile_size, (x2 - 1) // tile_size + 1):
+                tx1 = col * tile_size
+                tx2 = min(tx1 + tile_size, wd)
+
+                key = key_pfx + (row, col)
+                tile = tile_cache.get(key, None)
+                if tile is None:
+                    tile = self._render_tile(viewer, rgbmap, tx1, ty1,
+                                             tx2, ty2, scale_x, scale_y,
+                                             dst_order, get_order)
+                    tile_cache.put(key, tile)
+
+                # copy the part of the tile that overlaps our region
+                ox1, oy1 = max(x1, tx1), max(y1, ty1)
+                ox2, oy2 = min(x2, tx2), min(y2, ty2)
+                outarr[oy1-y1:oy2-y1, ox1-x1:ox2-x1] = \
+                        tile[oy1-ty1:oy2-ty1, ox1-tx1:ox2-tx1]
+
+        return outarr
+
+    def _render_tile(self, viewer, rgbmap, x1, y1, x2, y2, scale_x, scale_y,
+                     dst_order, get_order):
+        data = self.image.get_scaled_tile(x1, y1, x2, y2, scale_x, scale_y)
+
+        if self.can_map_data(viewer, rgbmap, data):
+            loval, hival = viewer.t_['cuts']
+            rgbobj = rgbmap.get_rgbarray_from_data(data, loval, hival,
+                                                   order=get_order)
+            return rgbobj.rgbarr
+
+        # apply visual changes prior to color mapping (cut levels, etc)
+        vmax = rgbmap.get_hash_size() - 1
+        newdata = self.apply_visuals(viewer, data, 0, vmax)
+
+        # result becomes an index array fed to the RGB mapper
+        if not numpy.issubdtype(newdata.dtype, numpy.dtype('uint')):
+            newdata = newdata.astype(numpy.uint)
+
+        rgbobj = rgbmap.get_rgbarray(newdata, order=dst_order,
+                                     image_order=self.image.get_order())
+        return rgbobj.get_array(get_order)
+
+    def _set_histogram(self, viewer, dist):
+        """Set the histogram used by the histogram equalization `dist`
+        to the one of our image at the current cut levels.  It is computed
+        from a sample of the whole image and saved with the image, so it
+        only needs to be computed again if the data or cut levels change.
+        """
+        if self.autocuts is not None:
+            autocuts = self.autocuts
+        else:
+            autocuts = viewer.autocuts
+        loval, hival = viewer.t_['cuts']
+        hashsize = dist.get_hash_size()
+        key = ('histeq', str(autocuts), loval, hival, hashsize)
+
+        def calc_hist():
+            wd, ht = self.image.get_size()
+            # limit the number of pixels sampled
+            step = int(math.ceil(math.sqrt(wd * ht / float(self.histeq_samples))))
+            step = max(step, 1)
+            data = self.image.cutout_data(0, 0, wd, ht, xstep=step, ystep=step)
+            idx = self.apply_visuals(viewer, data, 0, hashsize - 1)
+            return dist.calc_histogram(idx.astype(numpy.uint))
+
+        hist = self.image.get_cached(key, calc_hist)
+        if dist.get_histogram() is not hist:
+            dist.set_histogram(hist)
+
+    def can_map_data(self, viewer, rgbmap, data):
+        """Returns True if the cut levels and color mapping can be applied
+        to `data` in one step by the RGB mapper.
+        """
+        if self.autocuts is not None:
+            autocuts = self.autocuts
+        else:
+            autocuts = viewer.autocuts
+        loval, hival = viewer.t_['cuts']
+        return (autocuts.linear_cuts and (float(loval) != float(hival)) and
+                rgbmap.can_map_data(data))
+
     def apply_visuals(self, viewer, data, vmin, vmax):
         if self.autocuts is not None:
             autocuts = self.autocuts
@@ -2597,6 +2820,7 @@ class NormImage(Image):
         super(NormImage, self)._reset_optimize()
         self._prergb = None
         self._rgbarr = None
+        self._tile_rect = None
 
     def set_image(self, image):
         self.image = image
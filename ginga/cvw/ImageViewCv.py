@@ -69,10 +69,8 @@ class ImageViewCv(ImageView.ImageViewBase):
         canvas = self.surface
         self.logger.debug("redraw surface")
 
-        # get window contents as an array and store it into the CV surface
-        rgb_arr = self.getwin_array(order=self._rgb_order)
-        # TODO: is there a faster way to copy this array in?
-        canvas[:,:,:] = rgb_arr
+        # render the window contents straight into the CV surface
+        self.getwin_view(order=self._rgb_order, out=canvas)
 
         cr = CvHelp.CvContext(canvas)
 
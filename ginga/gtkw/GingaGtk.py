@@ -319,6 +319,7 @@ class GingaView(GtkMain.GtkMain):
                                                 rgbmap=rgbmap,
                                                 settings=settings,
                                                 bindings=bd)
+        fi.set_task_handlers(self.nongui_do, self.gui_do)
         fi.add_callback('motion', self.motion_cb)
         fi.add_callback('cursor-down', self.force_focus_cb)
         fi.add_callback('key-press', self.keypress)
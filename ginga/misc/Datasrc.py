@@ -6,21 +6,62 @@
 # Please see the file LICENSE.txt for details.
 #
 import threading
+import itertools
+import bisect
 
 class TimeoutError(Exception):
     pass
 
-class Datasrc(object):
+# global counter ordering pushes to all Datasrc's, so that the oldest
+# item can be found across several of them
+_push_count = itertools.count()
+_push_lock = threading.Lock()
+
+def _next_tick():
+    with _push_lock:
+        return next(_push_count)
+
+def get_nbytes(value):
+    """Default sizing function for items in a Datasrc.  Understands
+    images (anything with a get_data() method returning an array) and
+    anything with an `nbytes` attribute.
+    """
+    try:
+        return value.get_data().nbytes
+    except AttributeError:
+        return getattr(value, 'nbytes', 0)
 
-    def __init__(self, length=0):
+
+class Datasrc(object):
+    """A buffer of named items (usually images), kept in the order they
+    were pushed.  The oldest items are dropped when there are more than
+    `length` of them, or when their combined size is over `maxbytes`
+    bytes.  A `budget` (MemoryBudget) can be shared between several
+    Datasrc's to limit their total size.
+    """
+
+    def __init__(self, length=0, maxbytes=None, budget=None, sizefn=None):
         self.length = length
+        self.maxbytes = maxbytes
+        if sizefn is None:
+            sizefn = get_nbytes
+        self.sizefn = sizefn
         self.cursor = -1
         self.datums = {}
+        # key -> (push tick, size in bytes)
+        self.info = {}
+        self.nbytes = 0
+        # keys and their push ticks, oldest first
         self.history = []
+        self.ticks = []
         self.sortedkeys = []
         self.cond = threading.Condition()
         self.newdata = threading.Event()
 
+        self.budget = budget
+        if budget is not None:
+            budget.add_datasrc(self)
+
     def __getitem__(self, key):
         with self.cond:
             return self.datums[key]
@@ -45,10 +86,17 @@ class Datasrc(object):
 
     def push(self, key, value):
         with self.cond:
-            if key in self.history:
-                self.history.remove(key)
+            if key in self.datums:
+                self._remove(key)
+            else:
+                bisect.insort(self.sortedkeys, key)
 
+            tick = _next_tick()
+            nbytes = self.sizefn(value)
             self.history.append(key)
+            self.ticks.append(tick)
+            self.info[key] = (tick, nbytes)
+            self.nbytes += nbytes
 
             self.datums[key] = value
             self._eject_old()
@@ -56,6 +104,11 @@ class Datasrc(object):
             self.newdata.set()
             self.cond.notify()
 
+        # done outside of our lock, because it may need to lock
+        # other Datasrc's
+        if self.budget is not None:
+            self.budget.eject_old()
+
 
     def pop_one(self):
         return self.remove(self.history[0])
@@ -70,29 +123,58 @@ class Datasrc(object):
 
     def remove(self, key):
         with self.cond:
-            val = self.datums[key]
-            self.history.remove(key)
-            del self.datums[key]
-
-            self.sortedkeys = list(self.datums.keys())
-            self.sortedkeys.sort()
+            val = self._remove(key)
+            i = bisect.bisect_left(self.sortedkeys, key)
+            del self.sortedkeys[i]
             return val
 
-    def _eject_old(self):
-        if (self.length is None) or (self.length <= 0):
-            # no limit
-            return
-        while len(self.history) > self.length:
-            oldest = self.history.pop(0)
-            del self.datums[oldest]
-
-        self.sortedkeys = list(self.datums.keys())
-        self.sortedkeys.sort()
+    def _remove(self, key):
+        """Remove `key` from the history; the caller maintains
+        `sortedkeys`.
+        """
+        val = self.datums.pop(key)
+        tick, nbytes = self.info.pop(key)
+        i = bisect.bisect_left(self.ticks, tick)
+        del self.history[i]
+        del self.ticks[i]
+        self.nbytes -= nbytes
+        return val
+
+    def _is_full(self):
+        if (self.length is not None) and (self.length > 0) and \
+               (len(self.history) > self.length):
+            return True
+        return ((self.maxbytes is not None) and (self.maxbytes > 0) and
+                (self.nbytes > self.maxbytes))
 
+    def _eject_old(self):
+        # never eject the item that was just added
+        while (len(self.history) > 1) and self._is_full():
+            self.remove(self.history[0])
+
+    def eject_oldest(self):
+        """Remove the oldest item, unless it is the only one.  Returns
+        True if an item was removed.
+        """
+        with self.cond:
+            if len(self.history) <= 1:
+                return False
+            self.remove(self.history[0])
+            return True
+
+    def get_oldest_tick(self):
+        """Returns the push tick of the oldest item that could be
+        ejected, or None if there is none.
+        """
+        with self.cond:
+            if len(self.history) <= 1:
+                return None
+            return self.ticks[0]
 
     def index(self, key):
         with self.cond:
-            return self.history.index(key)
+            tick, nbytes = self.info[key]
+            return bisect.bisect_left(self.ticks, tick)
 
     def index2key(self, index):
         with self.cond:
@@ -117,9 +199,9 @@ class Datasrc(object):
     def keys(self, sort='alpha'):
         with self.cond:
             if sort == 'alpha':
-                return self.sortedkeys
+                return list(self.sortedkeys)
             elif sort == 'time':
-                return self.history
+                return list(self.history)
             else:
                 return self.datums.keys()
 
@@ -144,5 +226,70 @@ class Datasrc(object):
             self.length = length
             self._eject_old()
 
+    def get_nbytes(self):
+        return self.nbytes
+
+    def get_maxbytes(self):
+        with self.cond:
+            return self.maxbytes
+
+    def set_maxbytes(self, maxbytes):
+        with self.cond:
+            self.maxbytes = maxbytes
+            self._eject_old()
+
+
+class MemoryBudget(object):
+    """A limit on the total size of the items held in several Datasrc's.
+    When it is exceeded, the oldest items among all of them are ejected.
+
+    A `maxbytes` of None or <= 0 means that there is no limit.
+    """
+
+    def __init__(self, maxbytes=None):
+        self.maxbytes = maxbytes
+        self.lock = threading.RLock()
+        self.datasrcs = []
+
+    def add_datasrc(self, datasrc):
+        with self.lock:
+            if datasrc not in self.datasrcs:
+                self.datasrcs.append(datasrc)
+
+    def remove_datasrc(self, datasrc):
+        with self.lock:
+            if datasrc in self.datasrcs:
+                self.datasrcs.remove(datasrc)
+
+    def get_nbytes(self):
+        with self.lock:
+            return sum([ds.get_nbytes() for ds in self.datasrcs])
+
+    def get_maxbytes(self):
+        return self.maxbytes
+
+    def set_maxbytes(self, maxbytes):
+        with self.lock:
+            self.maxbytes = maxbytes
+        self.eject_old()
+
+    def eject_old(self):
+        with self.lock:
+            if (self.maxbytes is None) or (self.maxbytes <= 0):
+                # no limit
+                return
+            while self.get_nbytes() > self.maxbytes:
+                # find the Datasrc holding the oldest item
+                oldest, oldest_ds = None, None
+                for ds in self.datasrcs:
+                    tick = ds.get_oldest_tick()
+                    if (tick is not None) and \
+                           ((oldest is None) or (tick < oldest)):
+                        oldest, oldest_ds = tick, ds
+                if oldest_ds is None:
+                    # nothing more can be ejected
+                    break
+                oldest_ds.eject_oldest()
+
 
 #END
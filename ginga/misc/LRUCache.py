@@ -0,0 +1,133 @@
+#
+# LRUCache.py -- a least-recently-used cache with a memory budget
+#
+# Eric Jeschke (eric@naoj.org)
+#
+# Copyright (c) Eric R. Jeschke.  All rights reserved.
+# This is open-source software licensed under a BSD license.
+# Please see the file LICENSE.txt for details.
+#
+import threading
+from collections import OrderedDict
+
+from ginga.misc import Bunch
+
+
+def get_nbytes(value):
+    """Default sizing function for cached items.  Understands numpy
+    arrays and anything else that has an `nbytes` attribute.
+    """
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUCache(object):
+    """A thread-safe cache that evicts the least recently used items
+    when the combined size of the items exceeds a budget (in bytes).
+
+    A `maxbytes` of None or <= 0 means that the cache is not limited.
+    """
+
+    def __init__(self, maxbytes=None, sizefn=None):
+        self.maxbytes = maxbytes
+        if sizefn is None:
+            sizefn = get_nbytes
+        self.sizefn = sizefn
+
+        self.lock = threading.RLock()
+        # key -> (value, nbytes), in order of last use (oldest first)
+        self.items = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def get(self, key, *args):
+        """Look up `key`, marking it as most recently used.  If it is not
+        present, returns the default, if one was given, else raises
+        KeyError.
+        """
+        with self.lock:
+            try:
+                tup = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                if len(args) > 0:
+                    return args[0]
+                raise
+            self.items[key] = tup
+            self.hits += 1
+            return tup[0]
+
+    def put(self, key, value):
+        nbytes = self.sizefn(value)
+        with self.lock:
+            if key in self.items:
+                self._remove(key)
+            self.items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self._eject_old()
+
+    def remove(self, key):
+        with self.lock:
+            return self._remove(key)
+
+    def _remove(self, key):
+        value, nbytes = self.items.pop(key)
+        self.nbytes -= nbytes
+        return value
+
+    def remove_if(self, pred_fn):
+        """Remove all items whose key satisfies `pred_fn(key)`.
+        Returns the number of items removed.
+        """
+        with self.lock:
+            keys = [key for key in self.items.keys() if pred_fn(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.items = OrderedDict()
+            self.nbytes = 0
+
+    def keys(self):
+        with self.lock:
+            return list(self.items.keys())
+
+    def _eject_old(self):
+        if (self.maxbytes is None) or (self.maxbytes <= 0):
+            # no limit
+            return
+        # never evict the item that was just added
+        while (self.nbytes > self.maxbytes) and (len(self.items) > 1):
+            key = next(iter(self.items))
+            self._remove(key)
+            self.evictions += 1
+
+    def get_budget(self):
+        return self.maxbytes
+
+    def set_budget(self, maxbytes):
+        with self.lock:
+            self.maxbytes = maxbytes
+            self._eject_old()
+
+    def get_nbytes(self):
+        return self.nbytes
+
+    def get_stats(self):
+        with self.lock:
+            return Bunch.Bunch(count=len(self.items), nbytes=self.nbytes,
+                               maxbytes=self.maxbytes, hits=self.hits,
+                               misses=self.misses, evictions=self.evictions)
+
+#END
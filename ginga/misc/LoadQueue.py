@@ -0,0 +1,151 @@
+#
+# LoadQueue.py -- a prioritized queue of jobs for loading data
+#
+# Eric Jeschke (eric@naoj.org)
+#
+# Copyright (c) Eric R. Jeschke.  All rights reserved.
+# This is open-source software licensed under a BSD license.
+# Please see the file LICENSE.txt for details.
+#
+import threading
+import time
+import heapq
+import itertools
+
+from ginga.misc import Bunch
+
+# Priorities of jobs (lower numbers run first)
+PRI_INTERACTIVE = 0
+PRI_PREFETCH = 1
+PRI_THUMBNAIL = 2
+PRI_BACKGROUND = 3
+
+
+class LoadQueue(object):
+    """Runs load jobs on a thread pool, at most `max_concurrent` of them
+    at a time, in order of priority (and then in the order they were
+    added).  Interactive jobs are started right away, regardless of the
+    limit.
+
+    Each job has a key: adding a job whose key is already waiting
+    replaces the waiting one (keeping the higher priority).  Jobs also
+    have a group (e.g. a channel name), so that all jobs for a group
+    can be cancelled if they have not started yet.
+
+    The time spent waiting and running is recorded, along with any other
+    stages reported by the jobs through record_timing().
+
+    `nongui_do` is a function that runs a method in a non-gui thread.
+    """
+
+    def __init__(self, logger, nongui_do, max_concurrent=2):
+        self.logger = logger
+        self.nongui_do = nongui_do
+        self.max_concurrent = max_concurrent
+
+        self.lock = threading.RLock()
+        self.count = itertools.count()
+        # heap of (priority, count, key); may contain stale entries
+        self.heap = []
+        # key -> job bunch, for jobs that are waiting
+        self.pending = {}
+        self.running = 0
+        # stage -> [count, total seconds]
+        self.timings = {}
+
+    def add(self, key, priority, group, method, *args, **kwdargs):
+        """Queue `method(*args, **kwdargs)` to be run, identified by `key`."""
+        with self.lock:
+            job = self.pending.get(key, None)
+            if job is not None:
+                # already waiting: replace it
+                priority = min(priority, job.priority)
+            job = Bunch.Bunch(key=key, priority=priority, group=group,
+                              method=method, args=args, kwdargs=kwdargs,
+                              count=next(self.count),
+                              time_added=time.time())
+            self.pending[key] = job
+            heapq.heappush(self.heap, (priority, job.count, key))
+
+        self.schedule()
+
+    def cancel(self, pred_fn):
+        """Cancel the waiting jobs whose group satisfies `pred_fn(group)`.
+        Returns the number of jobs cancelled.
+        """
+        with self.lock:
+            keys = [key for key, job in self.pending.items()
+                    if pred_fn(job.group)]
+            for key in keys:
+                # entries left in the heap are skipped when popped
+                del self.pending[key]
+            if len(keys) > 0:
+                self.logger.debug("cancelled %d load jobs" % (len(keys)))
+            return len(keys)
+
+    def cancel_group(self, group):
+        return self.cancel(lambda grp: grp == group)
+
+    def get_num_pending(self):
+        with self.lock:
+            return len(self.pending)
+
+    def get_num_running(self):
+        with self.lock:
+            return self.running
+
+    def schedule(self):
+        """Start as many waiting jobs as the concurrency limit allows."""
+        with self.lock:
+            while len(self.heap) > 0:
+                priority, count, key = self.heap[0]
+                job = self.pending.get(key, None)
+                if (job is None) or (job.count != count):
+                    # cancelled or replaced
+                    heapq.heappop(self.heap)
+                    continue
+                if (self.running >= self.max_concurrent) and \
+                       (priority != PRI_INTERACTIVE):
+                    break
+                heapq.heappop(self.heap)
+                del self.pending[key]
+                self.running += 1
+                self.nongui_do(self._run_job, job)
+
+    def _run_job(self, job):
+        start_time = time.time()
+        self.record_timing('wait', start_time - job.time_added)
+        try:
+            job.method(*job.args, **job.kwdargs)
+
+        except Exception as e:
+            self.logger.error("Error in load job %s: %s" % (
+                str(job.key), str(e)))
+
+        finally:
+            self.record_timing('run', time.time() - start_time)
+            with self.lock:
+                self.running -= 1
+            self.schedule()
+
+    def record_timing(self, stage, secs):
+        """Add `secs` seconds to the time recorded for `stage`."""
+        with self.lock:
+            tup = self.timings.setdefault(stage, [0, 0.0])
+            tup[0] += 1
+            tup[1] += secs
+
+    def get_timings(self):
+        """Returns a dict of stage -> Bunch(count, total, avg)."""
+        with self.lock:
+            res = {}
+            for stage, (count, total) in self.timings.items():
+                res[stage] = Bunch.Bunch(count=count, total=total,
+                                         avg=total / max(count, 1))
+            return res
+
+    def clear_timings(self):
+        with self.lock:
+            self.timings = {}
+
+#END
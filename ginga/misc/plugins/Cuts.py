@@ -286,19 +286,19 @@ Keyboard shortcuts: press 'h' for a full horizontal cut and 'j' for a full verti
         image = self.fitsimage.get_image()
         # Get points on the line
         if obj.kind == 'line':
-            points = image.get_pixels_on_line(int(obj.x1), int(obj.y1),
-                                              int(obj.x2), int(obj.y2))
+            res = image.get_pixels_on_lines([(int(obj.x1), int(obj.y1),
+                                              int(obj.x2), int(obj.y2))])
+            points = res[0].data
         elif obj.kind in ('path', 'freepath'):
-            points = []
+            lines = []
             x1, y1 = obj.points[0]
             for x2, y2 in obj.points[1:]:
-                pts = image.get_pixels_on_line(int(x1), int(y1),
-                                               int(x2), int(y2))
-                # don't repeat last point when adding next segment
-                points.extend(pts[:-1])
+                lines.append((int(x1), int(y1), int(x2), int(y2)))
                 x1, y1 = x2, y2
+            res = image.get_pixels_on_lines(lines)
+            # don't repeat last point when adding next segment
+            points = numpy.concatenate([bnch.data[:-1] for bnch in res])
 
-        points = numpy.array(points)
         self.plot.cuts(points, xtitle="Line Index", ytitle="Pixel Value",
                        color=color)
 
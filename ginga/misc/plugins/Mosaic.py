@@ -273,55 +273,79 @@ class Mosaic(GingaPlugin.LocalPlugin):
         self.canvas.deleteAllObjects()
         self.update_status("Creating blank image...")
 
-    def ingest_one(self, image):
-        self.fv.assert_gui_thread()
-
-        time_intr1 = time.time()
-        imname = image.get('name', 'image')
-        imname, ext = os.path.splitext(imname)
-
-        # Get optional parameters
+    def load_item(self, item, image_loader, memmap=False):
+        """Load `item`, a (path, HDU index) pair, where the index is None
+        for the image that `image_loader` loads from the path.  If `memmap`
+        is True, the pixel data is only mapped, so that just the header is
+        read now (if the file allows).
+        """
+        # NOTE: this runs in a non-gui thread
+        url, idx = item
+        if idx is None:
+            if memmap:
+                try:
+                    image = AstroImage.AstroImage(logger=self.logger)
+                    image.load_file(url, memmap=True)
+                    return image
+
+                except Exception as e:
+                    self.logger.debug("Cannot map '%s' (%s); loading it" % (
+                        url, str(e)))
+            return image_loader(url)
+
+        # User wants us to mosaic HDUs
+        with pyfits.open(url, 'readonly', memmap=memmap) as in_f:
+            image = AstroImage.AstroImage(logger=self.logger)
+            image.load_hdu(in_f[idx])
+        image.set(name='hdu%d' % (idx + 1))
+        return image
+
+    def find_footprints(self, paths, image_loader):
+        """Returns the items (see load_item) to be placed from `paths`,
+        and where they go in the mosaic, found from their headers.
+        """
+        # NOTE: this runs in a non-gui thread
+        mosaic_hdus = self.settings.get('mosaic_hdus', False)
         trim_px = self.settings.get('trim_px', 0)
-        match_bg = self.settings.get('match_bg', False)
-        merge = self.settings.get('merge', False)
-        allow_expand = self.settings.get('allow_expand', True)
-        expand_pad_deg = self.settings.get('expand_pad_deg', 0.010)
-        annotate = self.settings.get('annotate_images', False)
-        bg_ref = None
-        if match_bg:
-            bg_ref = self.bg_ref
 
-        # Any special processing before inlining
-        msg = "Processing '%s' ..." % (imname)
-        self.update_status(msg)
-        self.logger.info(msg)
+        items, boxes = [], []
+        for url in paths:
+            if self.ev_intr.isSet():
+                break
+            if mosaic_hdus:
+                self.logger.debug("mosaicing hdus")
+                with pyfits.open(url, 'readonly', memmap=True) as in_f:
+                    # TODO: I think we need a little more rigorous test
+                    # than just whether the data section is empty
+                    idxs = [i for i, hdu in enumerate(in_f)
+                            if hdu.header.get('NAXIS', 0) > 0]
+            else:
+                idxs = [None]
 
-        image = self.preprocess(image)
+            for idx in idxs:
+                item = (url, idx)
+                image = self.load_item(item, image_loader, memmap=True)
+                items.append(item)
+                boxes.append(self.img_mosaic.mosaic_footprint(image,
+                                                              trim_px=trim_px))
+        return items, boxes
 
-        # Inline the image
-        loc = self.img_mosaic.mosaic_inline([ image ],
-                                            bg_ref=bg_ref,
-                                            trim_px=trim_px,
-                                            merge=merge,
-                                            allow_expand=allow_expand,
-                                            expand_pad_deg=expand_pad_deg)
+    def ingest_one(self, name, box):
+        self.fv.assert_gui_thread()
 
-        (xlo, ylo, xhi, yhi) = loc
+        # show the part of the mosaic that was filled in
+        self.img_mosaic.notify_modified(region=box)
 
         # annotate ingested image with its name?
+        annotate = self.settings.get('annotate_images', False)
+        allow_expand = self.settings.get('allow_expand', True)
         if annotate and (not allow_expand):
+            (xlo, ylo, xhi, yhi) = box
             x, y = (xlo+xhi)//2, (ylo+yhi)//2
-            self.canvas.add(self.dc.Text(x, y, imname, color='red'))
+            self.canvas.add(self.dc.Text(x, y, name, color='red'))
 
         self.ingest_count += 1
-
-        time_intr2 = time.time()
-        self.process_elapsed += time_intr2 - time_intr1
-
-        # special hack for GUI responsiveness during entire ingestion
-        # process
-        self.fv.update_pending(timeout=0.0)
-
+        self.update_progress(float(self.ingest_count)/self.total_files)
 
     def close(self):
         self.img_mosaic = None
@@ -380,54 +404,6 @@ class Mosaic(GingaPlugin.LocalPlugin):
     def allow_expand_cb(self, widget, tf):
         self.settings.set(allow_expand=tf)
 
-    def mosaic_some(self, paths, image_loader=None):
-        if image_loader is None:
-            image_loader = self.fv.load_image
-
-        for url in paths:
-            if self.ev_intr.isSet():
-                break
-            mosaic_hdus = self.settings.get('mosaic_hdus', False)
-            if mosaic_hdus:
-                self.logger.debug("mosaicing hdus")
-                # User wants us to mosaic HDUs
-                # TODO: do this in a different thread?
-                with pyfits.open(url, 'readonly') as in_f:
-                    i = 0
-                    for hdu in in_f:
-                        i += 1
-                        # TODO: I think we need a little more rigorous test
-                        # than just whether the data section is empty
-                        if hdu.data is None:
-                            continue
-                        self.logger.debug("ingesting hdu #%d" % (i))
-                        image = AstroImage.AstroImage(logger=self.logger)
-                        image.load_hdu(hdu)
-                        image.set(name='hdu%d' % (i))
-
-                        with self.lock:
-                            self.fv.gui_call(self.fv.error_wrap, self.ingest_one, image)
-
-                with self.lock:
-                    count = self.ingest_count
-
-            else:
-                image = image_loader(url)
-
-                with self.lock:
-                    self.fv.gui_call(self.fv.error_wrap, self.ingest_one, image)
-                    count = self.ingest_count
-
-            self.update_progress(float(count)/self.total_files)
-
-        if count == self.total_files:
-            self.end_progress()
-            total_elapsed = time.time() - self.start_time
-            msg = "Done. Total=%.2f Process=%.2f (sec)" % (
-                total_elapsed, self.process_elapsed)
-            self.update_status(msg)
-
-
     def mosaic(self, paths, new_mosaic=False, image_loader=None):
         if image_loader is None:
             image_loader = self.fv.load_image
@@ -472,17 +448,64 @@ class Mosaic(GingaPlugin.LocalPlugin):
             if dist > max_center_deg_delta:
                 self.prepare_mosaic(image, fov_deg)
 
-        #self.fv.gui_call(self.fv.error_wrap, self.ingest_one, image)
-        #self.update_progress(float(self.ingest_count)/self.total_files)
-
         time_intr2 = time.time()
         self.process_elapsed += time_intr2 - time_intr1
 
+        # Get optional parameters
+        trim_px = self.settings.get('trim_px', 0)
+        match_bg = self.settings.get('match_bg', False)
+        merge = self.settings.get('merge', False)
+        allow_expand = self.settings.get('allow_expand', True)
+        expand_pad_deg = self.settings.get('expand_pad_deg', 0.010)
         num_threads = self.settings.get('num_threads', 4)
-        groups = self.split_n(paths, num_threads)
-        for group in groups:
-            self.fv.nongui_do(self.mosaic_some, group,
-                              image_loader=image_loader)
+        bg_ref = None
+        if match_bg:
+            bg_ref = self.bg_ref
+
+        # Find where all of the images go first, from their headers, so
+        # that the mosaic is expanded at most once
+        self.update_status("Finding the footprints of %d files ..." % (
+            len(paths)))
+        items, boxes = self.find_footprints(paths, image_loader)
+        self.total_files = len(items)
+        boxes = self.fv.gui_call(self.img_mosaic.mosaic_allocate, boxes,
+                                 allow_expand=allow_expand,
+                                 expand_pad_deg=expand_pad_deg)
+
+        names = {}
+        def _load(item):
+            image = self.load_item(item, image_loader)
+            imname = image.get('name', 'image')
+            names[item], ext = os.path.splitext(imname)
+
+            # Any special processing before inlining
+            msg = "Processing '%s' ..." % (imname)
+            self.update_status(msg)
+            self.logger.info(msg)
+
+            return self.preprocess(image)
+
+        def _placed(item, box):
+            self.fv.gui_do(self.fv.error_wrap, self.ingest_one,
+                           names.pop(item), box)
+
+        # Reproject the images straight into the mosaic, several at a
+        # time in parallel threads, each into its own part of it
+        time_intr1 = time.time()
+        try:
+            self.img_mosaic.mosaic_fill(items, boxes, bg_ref=bg_ref,
+                                        trim_px=trim_px, merge=merge,
+                                        num_threads=num_threads,
+                                        load_fn=_load, cb_fn=_placed,
+                                        ev_intr=self.ev_intr)
+        finally:
+            self.process_elapsed += time.time() - time_intr1
+
+            self.end_progress()
+            total_elapsed = time.time() - self.start_time
+            msg = "Done. Total=%.2f Process=%.2f (sec)" % (
+                total_elapsed, self.process_elapsed)
+            self.update_status(msg)
 
         return self.img_mosaic
 
@@ -10,8 +10,10 @@
 import time
 import re
 
+import numpy
+
 from ginga import AstroImage
-from ginga.misc import Widgets, Future
+from ginga.misc import Widgets, Future, Bunch, LRUCache, LoadQueue
 from ginga import GingaPlugin
 import ginga.util.six as six
 
@@ -44,10 +46,23 @@ class MultiDim(GingaPlugin.LocalPlugin):
         self.play_idx = 1
         self.play_max = 1
         self.play_int_sec = 0.1
-        self.play_min_sec = 0.1
+        self.play_min_sec = 0.05
         self.timer = fv.get_timer()
         self.timer.set_callback('expired', self.play_next)
 
+        prefs = self.fv.get_preferences()
+        self.settings = prefs.createCategory('plugin_MultiDim')
+        self.settings.addDefaults(plane_cache_mb=512,
+                                  prefetch_planes=4)
+        self.settings.load(onError='silent')
+
+        # cache of planes of the cube, read from the file, with results
+        # computed from them (statistics, cut levels)
+        self.plane_cache = LRUCache.LRUCache(
+            maxbytes=self.settings.get('plane_cache_mb', 512) * 1024 * 1024,
+            sizefn=self._get_plane_nbytes)
+        self.plane_key = None
+
 
     def build_gui(self, container):
         assert have_pyfits == True, \
@@ -105,9 +120,9 @@ class MultiDim(GingaPlugin.LocalPlugin):
         b.last.add_callback('activated', lambda w: self.last())
         b.play.add_callback('activated', lambda w: self.play_start())
         b.stop.add_callback('activated', lambda w: self.play_stop())
-        lower, upper = 0.1, 8.0
-        b.interval.set_limits(lower, upper, incr_value=0.1)
-        b.interval.set_value(lower)
+        lower, upper = self.play_min_sec, 8.0
+        b.interval.set_limits(lower, upper, incr_value=0.05)
+        b.interval.set_value(self.play_int_sec)
         b.interval.set_decimals(2)
         b.interval.add_callback('value-changed', self.play_int_cb)
 
@@ -235,6 +250,7 @@ class MultiDim(GingaPlugin.LocalPlugin):
 
     def stop(self):
         self.play_stop()
+        self.clear_planes()
         try:
             self.fits_f.close()
         except:
@@ -311,6 +327,7 @@ class MultiDim(GingaPlugin.LocalPlugin):
             self.fv.show_error(errmsg)
 
     def set_naxis(self, idx, n):
+        direction = 1 if idx >= self.play_idx else -1
         self.play_idx = idx
         self.w['choose_naxis%d' % (n+1)].set_value(idx)
         idx = idx - 1
@@ -334,9 +351,6 @@ class MultiDim(GingaPlugin.LocalPlugin):
             self.naxispath[m] = idx
             self.logger.debug("m=%d naxispath=%s" % (m, str(self.naxispath)))
 
-            for i in self.naxispath:
-                data = data[i]
-
             if n == 2:
                 # Try to print the spectral coordinate
                 try:
@@ -346,15 +360,92 @@ class MultiDim(GingaPlugin.LocalPlugin):
                 except:
                     pass
 
-            image.set_data(data)
+            # keep what was computed for the plane we are leaving
+            self._save_plane(image)
+
+            key = (self.curhdu, tuple(self.naxispath))
+            plane = self.plane_cache.get(key, None)
+            if plane is None:
+                plane = Bunch.Bunch(data=self._read_plane(data,
+                                                          self.naxispath),
+                                    derived=None)
+                self.plane_cache.put(key, plane)
+
+            self.plane_key = key
+            image.set_data(plane.data, derived=plane.derived)
             self.logger.debug("NAXIS%d slice %d loaded." % (n+1, idx+1))
 
+            self.prefetch_planes(m, direction)
+
         except Exception as e:
             errmsg = "Error loading NAXIS%d slice %d: %s" % (
                 n+1, idx+1, str(e))
             self.logger.error(errmsg)
             self.fv.error(errmsg)
 
+    def _read_plane(self, data, naxispath):
+        # read a plane from the (memory mapped) cube into memory
+        for i in naxispath:
+            data = data[i]
+        return numpy.array(data)
+
+    def _get_plane_nbytes(self, plane):
+        nbytes = plane.data.nbytes
+        if plane.derived is not None:
+            nbytes += sum([level.nbytes for level in plane.derived.pyramid])
+        return nbytes
+
+    def _save_plane(self, image):
+        # save the results computed from the data of the plane being shown
+        plane = self.plane_cache.get(self.plane_key, None)
+        if (plane is not None) and (plane.data is image.get_data()):
+            plane.derived = image.get_derived()
+            # store again to update its size
+            self.plane_cache.put(self.plane_key, plane)
+
+    def prefetch_planes(self, m, direction):
+        """Read the next planes along axis index `m` of the naxis path, in
+        `direction`, in the background, and calculate their statistics
+        and cut levels.
+        """
+        num = self.settings.get('prefetch_planes', 0)
+        group = ('multidim', id(self))
+        self.fv.preload_queue.cancel_group(group)
+
+        hdu = self.fits_f[self.curhdu]
+        data = hdu.data
+        n = data.shape[m]
+        for i in range(1, min(num, n - 1) + 1):
+            naxispath = list(self.naxispath)
+            naxispath[m] = (naxispath[m] + direction * i) % n
+            key = (self.curhdu, tuple(naxispath))
+            if key in self.plane_cache:
+                continue
+            self.fv.preload_queue.add(('plane', id(self), key),
+                                      LoadQueue.PRI_PREFETCH, group,
+                                      self._prefetch_plane, key, data,
+                                      naxispath)
+
+    def _prefetch_plane(self, key, data, naxispath):
+        # executed in a non-gui thread
+        if key in self.plane_cache:
+            return
+        start_time = time.time()
+        data = self._read_plane(data, naxispath)
+        image = AstroImage.AstroImage(data_np=data, logger=self.logger)
+        image.get_minmax()
+        if self.fitsimage.t_.get('autocuts', 'off') != 'off':
+            self.fitsimage.autocuts.get_cached_cut_levels(image)
+        plane = Bunch.Bunch(data=data, derived=image.get_derived())
+        self.plane_cache.put(key, plane)
+        self.fv.preload_queue.record_timing('plane',
+                                            time.time() - start_time)
+
+    def clear_planes(self):
+        self.fv.preload_queue.cancel_group(('multidim', id(self)))
+        self.plane_cache.clear()
+        self.plane_key = None
+
     def play_start(self):
         self._isplaying = True
         self.play_next(self.timer)
@@ -437,7 +528,9 @@ class MultiDim(GingaPlugin.LocalPlugin):
             idx = int(match.group(2))
         self.imgname = name
 
-        self.fits_f = pyfits.open(path, 'readonly')
+        # planes of cubes are read through memory mapping
+        self.clear_planes()
+        self.fits_f = pyfits.open(path, 'readonly', memmap=True)
 
         lower = 0
         upper = len(self.fits_f) - 1
@@ -96,6 +96,11 @@ class Pick(GingaPlugin.LocalPlugin):
         self.min_ellipse = self.settings.get('min_ellipse', 0.5)
         self.edgew = self.settings.get('edge_width', 0.01)
         self.show_candidates = self.settings.get('show_candidates', False)
+        self.num_threads = self.settings.get('num_threads', 1)
+        # Estimate the FWHM of all candidates quickly (method 2), then fit
+        # the best few (num_refine) again with gaussians (method 1)
+        self.fwhm_method = self.settings.get('fwhm_method', 2)
+        self.num_refine = self.settings.get('num_refine', 10)
         # Report in 0- or 1-based coordinates
         coord_offset = self.fv.settings.get('pixel_coords_offset', 0.0)
         self.pixel_coords_offset = self.settings.get('pixel_coords_offset',
@@ -947,24 +952,29 @@ class Pick(GingaPlugin.LocalPlugin):
         if serialnum != self.get_serial():
             return
         with self.lock2:
-            self.pgs_cnt = 0
             self.ev_intr.clear()
             self.fv.gui_call(self.init_progress)
 
             msg, results, qs = None, None, None
             try:
                 self.update_status("Finding bright peaks...")
+                def peaks_cb(peaks):
+                    # show peaks as they are found
+                    if self.show_candidates and (len(peaks) > 0):
+                        self.fv.gui_do(self.show_peaks, serialnum, peaks,
+                                       x1, y1)
+
                 # Find bright peaks in the cutout
                 peaks = self.iqcalc.find_bright_peaks(data,
                                                       threshold=self.threshold,
-                                                      radius=self.radius)
+                                                      radius=self.radius,
+                                                      num_threads=self.num_threads,
+                                                      cb_fn=peaks_cb)
                 num_peaks = len(peaks)
                 if num_peaks == 0:
                     raise Exception("Cannot find bright peaks")
 
-                def cb_fn(obj):
-                    self.pgs_cnt += 1
-                    pct = float(self.pgs_cnt) / num_peaks
+                def progress_fn(pct):
                     self.fv.gui_do(self.update_progress, pct)
 
                 # Evaluate those peaks
@@ -972,7 +982,8 @@ class Pick(GingaPlugin.LocalPlugin):
                     num_peaks))
                 objlist = self.iqcalc.evaluate_peaks(peaks, data,
                                                      fwhm_radius=self.radius,
-                                                     cb_fn=cb_fn,
+                                                     fwhm_method=self.fwhm_method,
+                                                     progress_fn=progress_fn,
                                                      ev_intr=self.ev_intr)
 
                 num_candidates = len(objlist)
@@ -987,9 +998,24 @@ class Pick(GingaPlugin.LocalPlugin):
                                                      maxfwhm=self.max_fwhm,
                                                      minelipse=self.min_ellipse,
                                                      edgew=self.edgew)
+
                 if len(results) == 0:
                     raise Exception("No object matches selection criteria")
-                qs = results[0]
+
+                if (self.fwhm_method != 1) and (self.num_refine > 0):
+                    # Measure the best candidates more precisely to choose
+                    # one; the candidates shown are still the ones above
+                    self.update_status("Refining best candidates...")
+                    qs = self.iqcalc.refine_select(results, data,
+                                                   fwhm_radius=self.radius,
+                                                   minfwhm=self.min_fwhm,
+                                                   maxfwhm=self.max_fwhm,
+                                                   minelipse=self.min_ellipse,
+                                                   edgew=self.edgew,
+                                                   num_refine=self.num_refine,
+                                                   ev_intr=self.ev_intr)
+                else:
+                    qs = results[0]
 
             except Exception as e:
                 msg = str(e)
@@ -1052,6 +1078,15 @@ class Pick(GingaPlugin.LocalPlugin):
 
         return d
 
+    def show_peaks(self, serialnum, peaks, x1, y1):
+        if serialnum != self.get_serial():
+            return
+        for x, y in peaks:
+            self.fitsimage.add(self.dc.Point(x1+x, y1+y, 5, linewidth=1,
+                                             color=self.candidate_color),
+                               tagpfx='peak', redraw=False)
+        self.fitsimage.redraw(whence=3)
+
     def update_pick(self, serialnum, objlist, qs, x1, y1, wd, ht, fig, msg):
         if serialnum != self.get_serial():
             return
@@ -1067,6 +1102,9 @@ class Pick(GingaPlugin.LocalPlugin):
 
             # Mark new peaks, if desired
             if self.show_candidates:
+                # replace the marks of the peaks found
+                objs = self.fitsimage.getObjectsByTagpfx('peak')
+                self.fitsimage.deleteObjects(objs, redraw=False)
                 for obj in objlist:
                     tag = self.fitsimage.add(self.dc.Point(x1+obj.objx,
                                                            y1+obj.objy,
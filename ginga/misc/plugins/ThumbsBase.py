@@ -10,9 +10,12 @@
 import os
 import hashlib
 import threading
+import json
 
-from ginga import GingaPlugin
-from ginga.misc import Bunch, Future
+import numpy
+
+from ginga import GingaPlugin, AstroImage, RGBImage
+from ginga.misc import Bunch, Future, LoadQueue
 
 
 class ThumbsBase(GingaPlugin.GlobalPlugin):
@@ -57,6 +60,11 @@ class ThumbsBase(GingaPlugin.GlobalPlugin):
         self.thmbtask.set_callback('expired', self.redo_delay_timer)
         self.lagtime = self.settings.get('rebuild_wait', 4.0)
         self.thmblock = threading.RLock()
+        # persistent indexes of thumbnail metadata, by thumb directory
+        self.thumb_index = {}
+        self.thumb_index_dirty = set([])
+        # keys of the thumbnails waiting to be made by make_thumbs()
+        self.thumb_jobs = set([])
 
         # TODO: these maybe should be configurable by channel
         # different instruments have different keywords of interest
@@ -203,7 +211,8 @@ class ThumbsBase(GingaPlugin.GlobalPlugin):
             if not preload:
                 return
 
-            # TODO: clear any existing files waiting to be preloaded?
+            # clear any existing files waiting to be preloaded
+            self.fv.cancel_preloads(chname)
 
             # queue next and previous files for preloading
             if index < len(self.thumbList)-1:
@@ -401,7 +410,8 @@ class ThumbsBase(GingaPlugin.GlobalPlugin):
         self.reorder_thumbs()
 
     def _make_thumb(self, chname, image, path, thumbkey,
-                    image_future, save_thumb=False, thumbpath=None):
+                    image_future, save_thumb=False, thumbpath=None,
+                    metadata=None):
         # This is called by the make_thumbs() as a gui thread
         with self.thmblock:
             self.thumb_generator.set_image(image)
@@ -412,13 +422,9 @@ class ThumbsBase(GingaPlugin.GlobalPlugin):
 
             imgwin = self.thumb_generator.get_image_as_widget()
 
+        if metadata is None:
             # Get metadata for mouse-over tooltip
-            image = self.thumb_generator.get_image()
-
-        header = image.get_header()
-        metadata = {}
-        for kwd in self.keywords:
-            metadata[kwd] = header.get(kwd, 'N/A')
+            metadata = self.get_metadata(image)
 
         dirname, name = os.path.split(path)
 
@@ -438,9 +444,12 @@ class ThumbsBase(GingaPlugin.GlobalPlugin):
 
         cache_thumbs = self.settings.get('cache_thumbs', False)
 
+        # a new list of files supersedes thumbnails not yet started
+        with self.thmblock:
+            self.fv.preload_queue.cancel_group('thumbs')
+            self.thumb_jobs = set([])
+
         for path in filelist:
-            self.logger.info("generating thumb for %s..." % (
-                path))
             imname = self.fv.name_image_from_path(path)
 
             # Do we already have this thumb loaded?
@@ -456,35 +465,156 @@ class ThumbsBase(GingaPlugin.GlobalPlugin):
                         continue
                 except KeyError:
                     pass
-
+                # (a job for the same key replaces one still waiting)
+                self.thumb_jobs.add(thumbkey)
+
+            # thumbnails are made by the worker threads of the load queue
+            self.fv.preload_queue.add(('thumb', thumbkey),
+                                      LoadQueue.PRI_THUMBNAIL, 'thumbs',
+                                      self._load_thumb, chname, path,
+                                      thumbkey, thumbpath, image_loader,
+                                      cache_thumbs)
+
+    def _load_thumb(self, chname, path, thumbkey, thumbpath,
+                    image_loader, save_thumb):
+        # This is called by make_thumbs() as a non-gui thread
+        self.logger.info("generating thumb for %s..." % (path))
+        try:
             # Is there a cached thumbnail image on disk we can use?
-            save_thumb = cache_thumbs
-            image = None
+            image, metadata = None, None
             if (thumbpath is not None) and os.path.exists(thumbpath):
-                save_thumb = False
+                metadata = self.lookup_thumb_index(thumbpath)
                 try:
                     image = image_loader(thumbpath)
+                    save_thumb = False
                 except Exception as e:
                     pass
 
-            try:
-                if image is None:
-                    image = image_loader(path)
+            if image is None:
+                image = self.load_thumb_image(path, image_loader)
+                metadata = None
+
+            if metadata is None:
+                metadata = self.get_metadata(image)
+                if save_thumb and (thumbpath is not None):
+                    self.update_thumb_index(thumbpath, metadata)
+
+            image_future = Future.Future()
+            image_future.freeze(image_loader, path)
+
+            self.fv.gui_do(self._make_thumb, chname, image, path,
+                           thumbkey, image_future,
+                           save_thumb=save_thumb,
+                           thumbpath=thumbpath, metadata=metadata)
 
-                image_future = Future.Future()
-                image_future.freeze(image_loader, path)
+        except Exception as e:
+            self.logger.error("Error generating thumbnail for '%s': %s" % (
+                path, str(e)))
+            # TODO: generate "broken thumb"?
 
-                self.fv.gui_do(self._make_thumb, chname, image, path,
-                               thumbkey, image_future,
-                               save_thumb=save_thumb,
-                               thumbpath=thumbpath)
+        finally:
+            with self.thmblock:
+                self.thumb_jobs.discard(thumbkey)
+                if len(self.thumb_jobs) == 0:
+                    self.save_thumb_indexes()
+
+    def load_thumb_image(self, path, image_loader):
+        """Load an image for making a thumbnail of file `path`.  If
+        `image_loader` is the standard one, this avoids reading all of
+        the pixel data: for FITS files the header is read and the data is
+        memory mapped and sampled on a grid; for other files an embedded
+        (EXIF) thumbnail is used if there is one.
+        """
+        if image_loader != self.fv.load_image:
+            return image_loader(path)
+
+        try:
+            typ, subtyp = self.fv.guess_filetype(path)
+        except Exception as e:
+            typ, subtyp = 'image', 'fits'
+
+        if typ != 'image':
+            return image_loader(path)
+
+        if subtyp in ('fits', 'x-fits'):
+            image = AstroImage.AstroImage(logger=self.logger)
+            image.load_file(path, memmap=True)
+            data = image.get_data()
+            ht, wd = data.shape[:2]
+            step = max(1, max(wd, ht) // self.thumbWidth)
+            if step > 1:
+                # only the sampled rows are read from the file
+                image.set_data(numpy.array(data[::step, ::step]))
+            return image
+
+        rgbimage = RGBImage.RGBImage(logger=self.logger)
+        try:
+            data_np = rgbimage.io.get_thumb(path)
+        except Exception as e:
+            data_np = None
+        if data_np is None:
+            return image_loader(path)
+        rgbimage.set_data(data_np)
+        rgbimage.set(path=path)
+        return rgbimage
+
+    def get_metadata(self, image):
+        """Get the metadata for the mouse-over tooltip of a thumbnail."""
+        header = image.get_header()
+        metadata = {}
+        for kwd in self.keywords:
+            value = header.get(kwd, 'N/A')
+            if not isinstance(value, (int, float)):
+                value = str(value)
+            metadata[kwd] = value
+        return metadata
+
+    def _get_thumb_index(self, thumbdir):
+        # get the index for `thumbdir`, reading it from disk if necessary
+        # (caller holds thmblock)
+        try:
+            return self.thumb_index[thumbdir]
+        except KeyError:
+            index = {}
+            indexfile = os.path.join(thumbdir, "index.json")
+            if os.path.exists(indexfile):
+                try:
+                    with open(indexfile, 'r') as in_f:
+                        index = json.load(in_f)
+                except Exception as e:
+                    self.logger.warn("Error reading thumb index '%s': %s" % (
+                        indexfile, str(e)))
+            self.thumb_index[thumbdir] = index
+            return index
+
+    def lookup_thumb_index(self, thumbpath):
+        """Returns the metadata saved for the thumbnail at `thumbpath`,
+        or None.
+        """
+        thumbdir, thumbname = os.path.split(thumbpath)
+        with self.thmblock:
+            index = self._get_thumb_index(thumbdir)
+            return index.get(thumbname, None)
 
-            except Exception as e:
-                self.logger.error("Error generating thumbnail for '%s': %s" % (
-                    path, str(e)))
-                continue
-                # TODO: generate "broken thumb"?
+    def update_thumb_index(self, thumbpath, metadata):
+        thumbdir, thumbname = os.path.split(thumbpath)
+        with self.thmblock:
+            index = self._get_thumb_index(thumbdir)
+            index[thumbname] = metadata
+            self.thumb_index_dirty.add(thumbdir)
 
+    def save_thumb_indexes(self):
+        """Write the thumb indexes that have changed to disk."""
+        with self.thmblock:
+            for thumbdir in list(self.thumb_index_dirty):
+                indexfile = os.path.join(thumbdir, "index.json")
+                try:
+                    with open(indexfile, 'w') as out_f:
+                        json.dump(self.thumb_index[thumbdir], out_f)
+                except Exception as e:
+                    self.logger.error("Error writing thumb index '%s': %s" % (
+                        indexfile, str(e)))
+            self.thumb_index_dirty = set([])
 
     def _gethex(self, s):
         return hashlib.sha1(s.encode()).hexdigest()
@@ -135,7 +135,7 @@ class ImageViewMock(ImageView.ImageViewBase):
     def get_rgb_image_as_buffer(self, output=None, format='png',
                                 quality=90):
         # copy pixmap to ibuf
-        data_np = self.getwin_array(order=self.get_rgb_order())
+        data_np = self.getwin_view(order=self.get_rgb_order())
         header = {}
         fmt_buf = self.rgb_fh.get_buffer(data_np, header, format,
                                          output=output)
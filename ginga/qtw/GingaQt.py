@@ -409,6 +409,7 @@ class GingaView(QtMain.QtMain):
                                                rgbmap=rgbmap,
                                                settings=settings,
                                                bindings=bd)
+        fi.set_task_handlers(self.nongui_do, self.gui_do)
         fi.enable_draw(False)
         fi.set_follow_focus(settings.get('follow_focus', True))
         fi.enable_auto_orient(True)
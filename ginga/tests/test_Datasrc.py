@@ -0,0 +1,60 @@
+import unittest
+import numpy
+
+from ginga.misc import Datasrc
+
+class TestError(Exception):
+    pass
+
+class TestDatasrc(unittest.TestCase):
+
+    def setUp(self):
+        # each item is 1000 bytes
+        self.item = numpy.zeros(1000, dtype=numpy.uint8)
+
+    def test_length(self):
+        ds = Datasrc.Datasrc(length=3)
+        for key in ['d', 'b', 'a', 'c']:
+            ds[key] = self.item
+        assert ds.keys(sort='time') == ['b', 'a', 'c'], \
+               TestError("Unexpected history %s" % (ds.keys(sort='time')))
+        assert ds.keys(sort='alpha') == ['a', 'b', 'c'], \
+               TestError("Unexpected keys %s" % (ds.keys(sort='alpha')))
+
+        # pushing again moves an item to the end
+        ds['b'] = self.item
+        assert ds.index('b') == 2 and ds.index2key(0) == 'a', \
+               TestError("Item not moved to end of history")
+        del ds['a']
+        assert ds.keys(sort='time') == ['c', 'b'], \
+               TestError("Unexpected history %s" % (ds.keys(sort='time')))
+
+    def test_maxbytes(self):
+        ds = Datasrc.Datasrc(length=0, maxbytes=2500)
+        for key in ['a', 'b', 'c']:
+            ds[key] = self.item
+        assert ds.keys(sort='time') == ['b', 'c'], \
+               TestError("Unexpected history %s" % (ds.keys(sort='time')))
+        assert ds.get_nbytes() == 2000, \
+               TestError("Unexpected size %d" % (ds.get_nbytes()))
+
+        # an item over the budget is kept if it is the only one
+        ds['big'] = numpy.zeros(5000, dtype=numpy.uint8)
+        assert ds.keys(sort='time') == ['big'], \
+               TestError("Unexpected history %s" % (ds.keys(sort='time')))
+
+    def test_budget(self):
+        budget = Datasrc.MemoryBudget(3500)
+        ds1 = Datasrc.Datasrc(budget=budget)
+        ds2 = Datasrc.Datasrc(budget=budget)
+        ds1['a'] = self.item
+        ds2['b'] = self.item
+        ds1['c'] = self.item
+        ds2['d'] = self.item
+        # oldest item of all is ejected
+        assert ('a' not in ds1) and ('c' in ds1) and (len(ds2) == 2), \
+               TestError("Unexpected ejection")
+        assert budget.get_nbytes() == 3000, \
+               TestError("Unexpected size %d" % (budget.get_nbytes()))
+
+#END
@@ -1,6 +1,7 @@
 import unittest
 import logging
 import numpy
+import time
 
 from ginga import AstroImage
 from ginga.mockw.ImageViewCanvasMock import ImageViewCanvas
@@ -57,6 +58,325 @@ class TestImageView(unittest.TestCase):
         ## print (dst_x, dst_y)
         
         
+    def _render(self, render_tiles, scale):
+        viewer = ImageViewCanvas(logger=self.logger)
+        viewer.t_.set(render_tiles=render_tiles)
+        viewer.set_autocut_params('minmax')
+        viewer.set_window_size(300, 200)
+        viewer.set_image(self.image)
+        viewer.scale_to(scale, scale)
+        viewer.set_pan(700.0, 900.0)
+        viewer.redraw_now(whence=0)
+        return viewer
+
+    def test_pyramid(self):
+        image = self.image
+        image.pyramid_threshold = 0
+        res = image.get_scaled_cutout(0, 0, 1999, 1999, 0.25, 0.25)
+        assert image.get_pyramid_level_for_scale(0.25, 0.25) == 2, \
+               TestError("Unexpected pyramid level")
+        assert res.data.shape == (500, 500), \
+               TestError("Unexpected cutout shape %s" % (str(res.data.shape)))
+        # each pixel of level 2 is the mean of a 4x4 block of the identity
+        assert numpy.allclose(res.data, numpy.identity(500) * 0.25), \
+               TestError("Reduced data has unexpected values")
+
+        image.set_data(self.data * 2.0)
+        assert len(image._pyramid) == 0, \
+               TestError("Pyramid not discarded after image was modified")
+
+    def test_derived(self):
+        image = self.image
+        image.get_minmax()
+        image.get_cached('test', lambda: 42)
+        derived = image.get_derived()
+
+        data = self.data * 2.0
+        image.set_data(data)
+        assert image.get_cached('test', lambda: 0) == 0, \
+               TestError("Cached result not discarded after set_data")
+
+        # restoring results avoids recalculating them
+        image.set_data(self.data, derived=derived)
+        assert image.get_cached('test', lambda: 0) == 42, \
+               TestError("Cached result not restored")
+        assert image.get_minmax() == (0.0, 1.0), \
+               TestError("Unexpected min/max %s" % (str(image.get_minmax())))
+
+    def test_tiled_render(self):
+        # compare against a plain sampling of the data
+        self.image.pyramid_threshold = None
+        for scale in (1.0, 0.1):
+            viewer1 = self._render(False, scale)
+            viewer2 = self._render(True, scale)
+            arr1 = viewer1.getwin_array(order='RGB')
+            arr2 = viewer2.getwin_array(order='RGB')
+            assert numpy.array_equal(arr1, arr2), \
+                   TestError("Tiled rendering differs at scale %f" % (scale))
+
+        # panning a little should reuse the tiles already rendered
+        stats1 = viewer2.tile_cache.get_stats()
+        viewer2.set_pan(710.0, 905.0)
+        viewer2.redraw_now(whence=0)
+        stats2 = viewer2.tile_cache.get_stats()
+        assert stats2.misses == stats1.misses, \
+               TestError("Tiles were re-rendered after a small pan")
+
+        # modifying the image invalidates its tiles
+        self.image.set_data(self.data * 2.0)
+        assert len(viewer2.tile_cache) == 0, \
+               TestError("Tiles not purged after image was modified")
+
+    def test_tiled_sampling(self):
+        # tiles sample scaled pixel i from data pixel floor(i / scale),
+        # anchored at the data origin
+        data = numpy.random.RandomState(0).randint(0, 256, (2000, 2000))
+        self.image.set_data(data.astype(numpy.float64))
+        self.image.pyramid_threshold = None
+        wd, ht = 301, 201
+        pan_x, pan_y = 700.3, 900.2
+        for scale in (0.37, 0.6, 1.7):
+            viewer1 = ImageViewCanvas(logger=self.logger)
+            viewer1.t_.set(render_tiles=True)
+            viewer1.set_autocut_params('minmax')
+            viewer1.set_window_size(wd, ht)
+            viewer1.set_image(self.image)
+            viewer1.scale_to(scale, scale)
+            viewer1.set_pan(pan_x, pan_y)
+            viewer1.redraw_now(whence=0)
+
+            # window pixel w shows scaled pixel w - round(wd/2 - pan*scale)
+            off = viewer1.data_off
+            x0 = int(round(wd / 2.0 - (pan_x + off) * scale))
+            y0 = int(round(ht / 2.0 - (pan_y + off) * scale))
+            # (with a margin of one pixel, which the window may include)
+            xi = (numpy.arange(-1, wd + 1) - x0) // scale
+            yi = (numpy.arange(-1, ht + 1) - y0) // scale
+            expected = data[yi.astype(int).reshape(-1, 1),
+                            xi.astype(int).reshape(1, -1)]
+
+            # render the expected samples unscaled, with the same cuts
+            image2 = AstroImage.AstroImage(logger=self.logger)
+            image2.set_data(expected.astype(numpy.float64))
+            viewer2 = ImageViewCanvas(logger=self.logger)
+            viewer2.t_.set(render_tiles=False)
+            viewer2.set_autocut_params('minmax')
+            viewer2.set_window_size(wd, ht)
+            viewer2.enable_autocuts('off')
+            viewer2.set_image(image2)
+            viewer2.cut_levels(*viewer1.get_cut_levels())
+            viewer2.scale_to(1.0, 1.0)
+            viewer2.set_pan(wd / 2.0 + 1 - off, ht / 2.0 + 1 - off)
+            viewer2.redraw_now(whence=0)
+
+            # (the edge rows of the reference may not be covered)
+            arr1 = viewer1.getwin_array(order='RGB')[1:-1, 1:-1]
+            arr2 = viewer2.getwin_array(order='RGB')[1:-1, 1:-1]
+            assert numpy.array_equal(arr1, arr2), \
+                   TestError("Tiled sampling differs at scale %f" % (scale))
+
+            # the same mapping, straight from the image
+            x1, y1 = int(700 * scale), int(900 * scale)
+            tile = self.image.get_scaled_tile(x1, y1, x1 + 50, y1 + 30,
+                                              scale, scale)
+            xi = (numpy.arange(x1, x1 + 50) / scale).astype(int)
+            yi = (numpy.arange(y1, y1 + 30) / scale).astype(int)
+            assert numpy.array_equal(tile, data[yi.reshape(-1, 1),
+                                                xi.reshape(1, -1)]), \
+                   TestError("Tile sampling differs at scale %f" % (scale))
+
+    def test_tiled_overlay(self):
+        from ginga.canvas.CanvasObject import NormImage
+        viewer = self._render(True, 1.0)
+        image2 = AstroImage.AstroImage(logger=self.logger)
+        image2.set_data(numpy.ones((100, 100)))
+        viewer.add(NormImage(650, 850, image2, alpha=1.0))
+        viewer.redraw_now(whence=0)
+        imkey = id(image2)
+        keys = [key for key in viewer.tile_cache.keys() if key[0] == imkey]
+        assert len(keys) > 0, \
+               TestError("Overlaid image was not drawn in tiles")
+
+        # tiles of an image that is not the main one are purged too
+        image2.set_data(numpy.zeros((100, 100)))
+        keys = [key for key in viewer.tile_cache.keys() if key[0] == imkey]
+        assert len(keys) == 0, \
+               TestError("Tiles of overlaid image not purged")
+
+    def test_update_region(self):
+        image = self.image
+        image.pyramid_threshold = 0
+        viewer = self._render(True, 0.5)
+        image.get_pyramid_level(3)
+        ntiles = len(viewer.tile_cache)
+
+        # modify a part of the image in place
+        data = image.get_data()
+        before = image.get_region_stats(600, 800, 700, 900)
+        data[800:900, 600:700] = 5.0
+        data[820, 620] = -1.0
+        data[850, 650] = numpy.nan
+        image.update_region(600, 800, 700, 900, before=before)
+
+        assert image._stats is not None, \
+               TestError("Statistics not updated from the region")
+        assert image.get_minmax() == (-1.0, 5.0), \
+               TestError("Unexpected min/max %s" % (str(image.get_minmax())))
+        assert image.get_nan_count() == 1, \
+               TestError("Unexpected NaN count %d" % (image.get_nan_count()))
+        assert 0 < len(viewer.tile_cache) < ntiles, \
+               TestError("Expected only some of the tiles to be purged")
+
+        # pyramid matches one built from scratch
+        levels = [image.get_pyramid_level(i) for i in (1, 2, 3)]
+        image.clear_pyramid()
+        for i, level in zip((1, 2, 3), levels):
+            assert numpy.allclose(level, image.get_pyramid_level(i),
+                                  equal_nan=True), \
+                   TestError("Pyramid level %d not updated" % (i))
+
+        # what is shown matches a fresh rendering of the image
+        viewer.redraw_now(whence=0)
+        arr1 = viewer.getwin_array(order='RGB')
+        viewer.clear_tile_cache()
+        viewer.redraw_now(whence=0)
+        arr2 = viewer.getwin_array(order='RGB')
+        assert numpy.array_equal(arr1, arr2), \
+               TestError("View not updated for the modified region")
+
+    def test_getwin(self):
+        viewer = self._render(True, 1.0)
+        arr1 = viewer.getwin_array(order='RGB')
+
+        # output array is reused, but getwin_array() returns a copy
+        viewer.set_pan(100.0, 100.0)
+        viewer.redraw_now(whence=0)
+        view = viewer.getwin_view(order='RGB')
+        assert viewer.getwin_view(order='RGB') is view, \
+               TestError("Output array not reused")
+        viewer.set_pan(700.0, 900.0)
+        viewer.redraw_now(whence=0)
+        arr2 = viewer.getwin_array(order='RGB')
+        assert numpy.array_equal(arr1, arr2) and (arr2 is not view), \
+               TestError("Window contents differ after panning back")
+
+        buf = viewer.getwin_buffer(order='RGBA')
+        arr = viewer.getwin_array(order='RGBA')
+        assert buf.tobytes() == arr.tobytes(), \
+               TestError("Window buffer differs from window array")
+
+    def test_rotate_90(self):
+        viewer = self._render(False, 1.5)
+        shape = viewer._rgbarr2.shape
+        assert shape[:2] == (204, 304), \
+               TestError("Unexpected backing image shape %s" % (str(shape)))
+
+        # turns by 90 deg match the general rotation, with flips and on
+        # windows of odd size too
+        image = AstroImage.AstroImage(logger=self.logger)
+        image.set_data(numpy.random.RandomState(0).rand(500, 600))
+        viewer.set_image(image)
+        viewer.set_pan(310.3, 240.7)
+        for wd, ht in ((300, 200), (301, 201)):
+            viewer.set_window_size(wd, ht)
+            for flips in ((False, False, False), (True, False, False),
+                          (False, True, True), (True, True, False)):
+                viewer.transform(*flips)
+                for rot in (90, 180, 270):
+                    viewer.rotate(rot + 1.0e-6)
+                    viewer.redraw_now(whence=0)
+                    arr1 = viewer.getwin_array(order='RGB')
+                    viewer.rotate(rot)
+                    viewer.redraw_now(whence=0)
+                    arr2 = viewer.getwin_array(order='RGB')
+                    assert numpy.array_equal(arr1, arr2), \
+                           TestError("Rotation by %d deg differs (%dx%d %s)" % (
+                        rot, wd, ht, str(flips)))
+
+    def test_redraw_schedule(self):
+        viewer = self._render(True, 1.0)
+        viewer.defer_redraw = True
+        scheduled = []
+        viewer.reschedule_redraw = lambda time_sec: scheduled.append(time_sec)
+        # finish any redraw left pending by the mock widget
+        viewer.delayed_redraw()
+        viewer.clear_redraw_stats()
+
+        stats = viewer.get_redraw_stats()
+        assert (stats.num_redraws == 0) and (stats.interval is None) and \
+               (len(stats.time_redraw) == 0), \
+               TestError("Redraw statistics not cleared %s" % (str(stats)))
+
+        # a redraw is started one frame after the last one started, even
+        # if that one took most of the frame
+        viewer.set_redraw_fps(10)
+        viewer._time_redraw_start = time.time() - 0.06
+        viewer.redraw(whence=2)
+        assert 0.0 < scheduled[-1] <= 0.04, \
+               TestError("Unexpected redraw schedule %s" % (str(scheduled)))
+        viewer.delayed_redraw()
+
+        # requests soon after a redraw are merged into one redraw, at the
+        # lowest whence, spaced by the average time a redraw takes
+        viewer.clear_redraw_stats()
+        viewer._redraw_cost[0] = 0.5
+        viewer.redraw_now(whence=3)
+        for whence in (2, 0, 1):
+            viewer.redraw(whence=whence)
+        assert 0.5 < scheduled[-1] <= 0.75, \
+               TestError("Unexpected redraw schedule %s" % (str(scheduled)))
+        assert viewer._defer_whence == 0, \
+               TestError("Pending redraw whence is %s" % (viewer._defer_whence))
+
+        viewer.delayed_redraw()
+        stats = viewer.get_redraw_stats()
+        assert ((stats.num_requests, stats.num_coalesced,
+                 stats.num_redraws) == (3, 2, 2)), \
+               TestError("Unexpected redraw statistics %s" % (str(stats)))
+        assert stats.fps is not None, \
+               TestError("Redraw rate not measured")
+
+        # no frame rate limit means immediate redraws
+        viewer.set_redraw_fps(0)
+        assert not viewer.defer_redraw, \
+               TestError("Redraws still deferred without a frame rate")
+
+    def test_autocuts_async(self):
+        viewer = self.viewer
+        viewer.set_window_size(300, 200)
+        viewer.set_autocut_params('histogram')
+        # run background work on demand, to control the order of events
+        pending = []
+        viewer.t_.set(autocut_async=True)
+
+        # without a way to apply results on the GUI thread, the cut levels
+        # are calculated synchronously
+        viewer.set_image(self.image)
+        cuts = viewer.autocuts.calc_cut_levels(self.image)
+        assert viewer.get_cut_levels() == cuts, \
+               TestError("Cut levels not calculated synchronously")
+
+        viewer.set_task_handlers(lambda fn, *args: pending.append((fn, args)),
+                                 lambda fn, *args: fn(*args))
+
+        viewer.set_image(self.image)
+        # image is shown with provisional cuts
+        assert viewer.get_cut_levels() == self.image.get_minmax(), \
+               TestError("Provisional cut levels are not min/max")
+
+        image2 = AstroImage.AstroImage(logger=self.logger)
+        image2.set_data(self.data * 10.0)
+        viewer.set_image(image2)
+
+        # finish the calculations out of order
+        for fn, args in reversed(pending):
+            fn(*args)
+        # only the calculation for the current image should be applied
+        cuts = viewer.autocuts.calc_cut_levels(image2)
+        assert viewer.get_cut_levels() == cuts, \
+               TestError("Unexpected cut levels %s" % (
+            str(viewer.get_cut_levels())))
+
     def tearDown(self):
         pass
 
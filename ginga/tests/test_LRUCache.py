@@ -0,0 +1,50 @@
+import unittest
+import numpy
+
+from ginga.misc import LRUCache
+
+class TestError(Exception):
+    pass
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        # room for three 1000-byte arrays
+        self.cache = LRUCache.LRUCache(maxbytes=3000)
+
+    def _arr(self):
+        return numpy.zeros(1000, dtype=numpy.uint8)
+
+    def test_budget(self):
+        for i in range(5):
+            self.cache.put(i, self._arr())
+        assert self.cache.get_nbytes() <= 3000, \
+               TestError("Cache exceeds its budget")
+        assert self.cache.keys() == [2, 3, 4], \
+               TestError("Unexpected keys in cache: %s" % (
+            str(self.cache.keys())))
+
+    def test_lru_order(self):
+        for i in range(3):
+            self.cache.put(i, self._arr())
+        # touch the oldest item, so the next one should be evicted
+        self.cache.get(0)
+        self.cache.put(3, self._arr())
+        assert (0 in self.cache) and not (1 in self.cache), \
+               TestError("Least recently used item was not evicted")
+
+    def test_remove_if(self):
+        for i in range(3):
+            self.cache.put(('a', i), self._arr())
+        self.cache.put(('b', 0), self._arr())
+        self.cache.remove_if(lambda key: key[0] == 'a')
+        assert self.cache.keys() == [('b', 0)], \
+               TestError("remove_if left unexpected keys")
+        assert self.cache.get_nbytes() == 1000, \
+               TestError("Size accounting is off after remove_if")
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+#END
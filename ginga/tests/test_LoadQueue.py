@@ -0,0 +1,66 @@
+import unittest
+import logging
+
+from ginga.misc import LoadQueue
+
+class TestError(Exception):
+    pass
+
+class TestLoadQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("TestLoadQueue")
+        # jobs handed to the "thread pool", run by the test
+        self.started = []
+        self.done = []
+        self.queue = LoadQueue.LoadQueue(self.logger, self.nongui_do,
+                                         max_concurrent=1)
+
+    def nongui_do(self, method, *args):
+        self.started.append((method, args))
+
+    def run_next(self):
+        method, args = self.started.pop(0)
+        method(*args)
+
+    def load(self, name):
+        self.done.append(name)
+
+    def test_priority(self):
+        queue = self.queue
+        queue.add('a', LoadQueue.PRI_BACKGROUND, 'ch1', self.load, 'a')
+        queue.add('b', LoadQueue.PRI_BACKGROUND, 'ch1', self.load, 'b')
+        queue.add('c', LoadQueue.PRI_PREFETCH, 'ch1', self.load, 'c')
+        # same key again is not queued twice
+        queue.add('c', LoadQueue.PRI_BACKGROUND, 'ch1', self.load, 'c')
+        assert len(self.started) == 1, \
+               TestError("Concurrency limit not respected")
+
+        # interactive jobs start right away
+        queue.add('d', LoadQueue.PRI_INTERACTIVE, 'ch1', self.load, 'd')
+        assert len(self.started) == 2, \
+               TestError("Interactive job not started")
+
+        while len(self.started) > 0:
+            self.run_next()
+        assert self.done == ['a', 'd', 'c', 'b'], \
+               TestError("Unexpected order %s" % (self.done))
+
+        timings = queue.get_timings()
+        assert timings['run'].count == 4, \
+               TestError("Unexpected timings %s" % (timings))
+
+    def test_cancel(self):
+        queue = self.queue
+        queue.add('a', LoadQueue.PRI_PREFETCH, 'ch1', self.load, 'a')
+        queue.add('b', LoadQueue.PRI_PREFETCH, 'ch1', self.load, 'b')
+        queue.add('c', LoadQueue.PRI_PREFETCH, 'ch2', self.load, 'c')
+        assert queue.cancel_group('ch1') == 1, \
+               TestError("Unexpected number of jobs cancelled")
+
+        while len(self.started) > 0:
+            self.run_next()
+        assert self.done == ['a', 'c'], \
+               TestError("Unexpected jobs run %s" % (self.done))
+
+#END
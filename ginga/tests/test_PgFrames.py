@@ -0,0 +1,121 @@
+import unittest
+import logging
+import numpy
+
+from ginga.web.pgw import PgFrames
+
+class TestError(Exception):
+    pass
+
+class StubFrameStream(PgFrames.FrameStream):
+    """Encodes tiles as their raw bytes, without PIL."""
+
+    def __init__(self, *args, **kwdargs):
+        super(StubFrameStream, self).__init__(*args, **kwdargs)
+        self.formats = ['png', 'jpeg']
+
+    def encode(self, arr, fmt):
+        return numpy.ascontiguousarray(arr).tobytes()
+
+def parse_frame(frame):
+    """Returns the frame number and a list of the tiles in `frame`, as
+    tuples (x, y, width, height, format code).
+    """
+    num, wd, ht, num_tiles = PgFrames.frame_header.unpack_from(frame, 0)
+    offset = PgFrames.frame_header.size
+    tiles = []
+    for i in range(num_tiles):
+        x, y, w, h, code, length = PgFrames.tile_header.unpack_from(frame,
+                                                                    offset)
+        offset += PgFrames.tile_header.size + length
+        tiles.append((x, y, w, h, code))
+    assert offset == len(frame), \
+           TestError("Frame length does not match its tiles")
+    return num, tiles
+
+class TestPgFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("TestPgFrames")
+        self.frames = StubFrameStream(self.logger, tile_size=10,
+                                      max_in_flight=1, ack_timeout=1.0)
+        self.arr = numpy.zeros((25, 40, 3), dtype=numpy.uint8)
+
+    def test_changed_tiles(self):
+        frames = self.frames
+        changed = frames.get_changed_tiles(self.arr)
+        assert changed.shape == (3, 4) and changed.all(), \
+               TestError("First frame is not complete")
+
+        num, tiles = parse_frame(frames.make_frame(self.arr))
+        assert frames.make_frame(self.arr.copy()) is None, \
+               TestError("Frame made when nothing changed")
+
+        arr = self.arr.copy()
+        arr[22, 35] = 1
+        changed = frames.get_changed_tiles(arr)
+        assert list(zip(*numpy.nonzero(changed))) == [(2, 3)], \
+               TestError("Unexpected changed tiles %s" % (str(changed)))
+
+    def test_rows_merged(self):
+        frames = self.frames
+        # whole window: one tile per row, clipped at the edges
+        num, tiles = parse_frame(frames.make_frame(self.arr))
+        assert tiles == [(0, 0, 40, 10, 0), (0, 10, 40, 10, 0),
+                         (0, 20, 40, 5, 0)], \
+               TestError("Unexpected tiles %s" % (str(tiles)))
+
+        arr = self.arr.copy()
+        arr[5, 5] = arr[5, 15] = arr[5, 35] = arr[15, 25] = 1
+        num, tiles = parse_frame(frames.make_frame(arr))
+        assert tiles == [(0, 0, 20, 10, 0), (30, 0, 10, 10, 0),
+                         (20, 10, 10, 10, 0)], \
+               TestError("Unexpected tiles %s" % (str(tiles)))
+
+    def test_ack(self):
+        frames = self.frames
+        num1, tiles = parse_frame(frames.make_frame(self.arr))
+        assert not frames.can_send(), \
+               TestError("Frame can be sent before acknowledgement")
+        frames.ack(num1)
+        assert frames.can_send(), \
+               TestError("Frame cannot be sent after acknowledgement")
+
+        # acknowledging a frame drops the ones sent before it
+        frames.max_in_flight = 2
+        num2, tiles = parse_frame(frames.make_frame(self.arr + 1))
+        num3, tiles = parse_frame(frames.make_frame(self.arr + 2))
+        frames.ack(num3)
+        assert len(frames.in_flight) == 0, \
+               TestError("Frames left in flight %s" % (str(frames.in_flight)))
+
+        # frames not acknowledged in time are given up on
+        frames.max_in_flight = 1
+        frames.make_frame(self.arr + 3)
+        assert not frames.can_send(), \
+               TestError("Frame can be sent before acknowledgement")
+        for num in frames.in_flight.keys():
+            frames.in_flight[num] = (0.0, 0)
+        assert frames.can_send(), \
+               TestError("Frame cannot be sent after timeout")
+
+    def test_refine(self):
+        frames = self.frames
+        # no time for the lossless format
+        frames.latency = 0.0
+        num, tiles = parse_frame(frames.make_frame(self.arr))
+        code = PgFrames.FORMAT_CODES['jpeg']
+        assert [tile[4] for tile in tiles] == [code] * 3, \
+               TestError("Unexpected formats %s" % (str(tiles)))
+
+        assert frames.make_frame(self.arr) is None, \
+               TestError("Frame made without refine")
+        # lossy tiles are sent again losslessly, once
+        num, tiles = parse_frame(frames.make_frame(self.arr, refine=True))
+        code = PgFrames.FORMAT_CODES['png']
+        assert [tile[4] for tile in tiles] == [code] * 3, \
+               TestError("Unexpected formats %s" % (str(tiles)))
+        assert frames.make_frame(self.arr, refine=True) is None, \
+               TestError("Lossless tiles refined again")
+
+#END
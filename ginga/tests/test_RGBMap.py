@@ -0,0 +1,91 @@
+import unittest
+import logging
+import numpy
+
+from ginga import RGBMap, AutoCuts, cmap, imap
+
+class TestError(Exception):
+    pass
+
+class TestRGBMap(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("TestRGBMap")
+        self.rgbmap = RGBMap.RGBMapper(self.logger)
+        self.rgbmap.set_cmap(cmap.get_cmap('rainbow3'))
+        self.rgbmap.set_imap(imap.get_imap('log'))
+        self.autocuts = AutoCuts.Minmax(self.logger)
+        self.data = numpy.random.rand(300, 200).astype(numpy.float32) * 1000
+        self.data[10:20, 10:20] = numpy.nan
+
+    def _rgbarray(self, order, loval, hival):
+        vmax = self.rgbmap.get_hash_size() - 1
+        idx = self.autocuts.cut_levels(self.data, loval, hival,
+                                       vmin=0, vmax=vmax)
+        idx = idx.astype(numpy.uint)
+        return self.rgbmap.get_rgbarray(idx, order=order).get_array(order)
+
+    def test_rgbarray_from_data(self):
+        rgbmap = self.rgbmap
+        rgbmap.shift(0.1)
+        for name in ('linear', 'log', 'asinh'):
+            rgbmap.set_hash_algorithm(name)
+            for order in ('RGB', 'BGRA'):
+                arr1 = self._rgbarray(order, 100.0, 800.0)
+                rgbobj = rgbmap.get_rgbarray_from_data(self.data,
+                                                       100.0, 800.0,
+                                                       order=order)
+                assert numpy.array_equal(arr1, rgbobj.rgbarr), \
+                       TestError("Mapping differs for %s/%s" % (name, order))
+
+    def test_histeq_histogram(self):
+        rgbmap = self.rgbmap
+        rgbmap.set_hash_algorithm('histeq')
+        dist = rgbmap.get_dist()
+        assert not rgbmap.can_map_data(self.data), \
+               TestError("Unexpected fused mapping for histeq")
+
+        # without a histogram, each array is binned over its own range
+        idx = numpy.array([[10, 10, 20, 20], [20, 20, 30, 1000]])
+        hist, bins = numpy.histogram(idx, dist.hashsize)
+        cdf = hist.cumsum()
+        hash = ((cdf - cdf.min()) * (dist.colorlen - 1) /
+                (cdf.max() - cdf.min())).astype(numpy.uint)
+        assert numpy.array_equal(dist.hash_array(idx), hash[idx]), \
+               TestError("Unexpected hash without histogram")
+
+        # with a histogram, there is one bin per index value
+        vmax = rgbmap.get_hash_size() - 1
+        idx = self.autocuts.cut_levels(self.data, 100.0, 800.0,
+                                       vmin=0, vmax=vmax)
+        idx = idx.astype(numpy.uint).clip(0, vmax)
+        dist.set_histogram(dist.calc_histogram(idx))
+        cdf = numpy.bincount(idx.ravel().astype(numpy.intp),
+                             minlength=dist.hashsize).cumsum()
+        hash = ((cdf - cdf.min()) * (dist.colorlen - 1) /
+                (cdf.max() - cdf.min())).astype(numpy.uint)
+        assert numpy.array_equal(dist.hash_array(idx), hash[idx]), \
+               TestError("Unexpected hash with histogram set")
+
+        arr1 = self._rgbarray('RGB', 100.0, 800.0)
+        assert rgbmap.can_map_data(self.data), \
+               TestError("No fused mapping for histeq with histogram set")
+        rgbobj = rgbmap.get_rgbarray_from_data(self.data, 100.0, 800.0,
+                                               order='RGB')
+        assert numpy.array_equal(arr1, rgbobj.rgbarr), \
+               TestError("Fused mapping differs for histeq")
+
+    def test_lut_cache(self):
+        rgbmap = self.rgbmap
+        lut1 = rgbmap.get_lut('RGB')
+        assert rgbmap.get_lut('RGB') is lut1, \
+               TestError("Lookup table was recomputed")
+        rgbmap.set_cmap(cmap.get_cmap('gray'))
+        assert rgbmap.get_lut('RGB') is not lut1, \
+               TestError("Lookup table not updated after color map change")
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+#END
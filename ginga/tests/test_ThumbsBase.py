@@ -0,0 +1,61 @@
+import unittest
+import logging
+import threading
+
+from ginga.misc import Bunch, LoadQueue
+from ginga.misc.plugins.ThumbsBase import ThumbsBase
+
+class TestError(Exception):
+    pass
+
+class TestThumbsBase(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("TestThumbsBase")
+        # jobs handed to the "thread pool", run by the test
+        self.started = []
+        queue = LoadQueue.LoadQueue(self.logger, self.nongui_do,
+                                    max_concurrent=1)
+        fv = Bunch.Bunch(preload_queue=queue,
+                         gui_do=lambda method, *args, **kwdargs: None,
+                         load_image=None,
+                         name_image_from_path=lambda path: path)
+
+        # make the plugin without a reference viewer
+        thumbs = ThumbsBase.__new__(ThumbsBase)
+        thumbs.fv = fv
+        thumbs.logger = self.logger
+        thumbs.settings = {}
+        thumbs.thmblock = threading.RLock()
+        thumbs.thumbDict = {}
+        thumbs.thumb_jobs = set([])
+        thumbs.get_thumbpath = lambda path: None
+        thumbs.get_metadata = lambda image: {}
+        self.saves = []
+        thumbs.save_thumb_indexes = lambda: self.saves.append(True)
+        self.thumbs = thumbs
+
+    def nongui_do(self, method, *args):
+        self.started.append((method, args))
+
+    def run_all(self):
+        while len(self.started) > 0:
+            method, args = self.started.pop(0)
+            method(*args)
+
+    def test_index_saved(self):
+        thumbs = self.thumbs
+        loader = lambda path: path
+        thumbs.make_thumbs('ch1', ['a', 'b', 'c', 'c'], image_loader=loader)
+        assert len(thumbs.thumb_jobs) == 3, \
+               TestError("Unexpected thumb jobs %s" % (thumbs.thumb_jobs))
+
+        # a new list cancels the jobs not yet started
+        thumbs.make_thumbs('ch1', ['d'], image_loader=loader)
+        self.run_all()
+        assert len(thumbs.thumb_jobs) == 0, \
+               TestError("Thumb jobs left %s" % (thumbs.thumb_jobs))
+        assert len(self.saves) > 0, \
+               TestError("Thumb index not saved")
+
+#END
@@ -0,0 +1,109 @@
+import unittest
+import logging
+import numpy
+
+from ginga.util import iqcalc
+
+class TestError(Exception):
+    pass
+
+class TestIQCalc(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("TestIQCalc")
+        self.iqcalc = iqcalc.IQCalc(logger=self.logger)
+
+        # field of gaussian stars on a flat background
+        self.sdev = 2.0
+        self.stars = [(30.0, 40.0), (70.3, 20.0), (55.0, 75.6)]
+        yy, xx = numpy.mgrid[0:100, 0:100]
+        self.data = numpy.zeros((100, 100)) + 100.0
+        for x, y in self.stars:
+            self.data += 500.0 * numpy.exp(-((xx - x)**2 + (yy - y)**2) /
+                                           (2 * self.sdev**2))
+
+    def test_get_fwhms(self):
+        peaks = [(int(round(x)), int(round(y))) for x, y in self.stars]
+        fwhm = 2.0 * numpy.sqrt(2.0 * numpy.log(2.0)) * self.sdev
+        for refine in (False, True):
+            res = self.iqcalc.get_fwhms(peaks, 10, self.data, medv=100.0,
+                                        refine=refine)
+            assert res.ok.all(), \
+                   TestError("Objects could not be measured")
+            assert numpy.allclose(res.fwhm_x, fwhm, rtol=0.01) and \
+                   numpy.allclose(res.fwhm_y, fwhm, rtol=0.01), \
+                   TestError("Unexpected FWHM %s %s" % (
+                str(res.fwhm_x), str(res.fwhm_y)))
+            ctrs = numpy.array(self.stars)
+            assert numpy.allclose(res.ctr_x, ctrs[:, 0], atol=0.05) and \
+                   numpy.allclose(res.ctr_y, ctrs[:, 1], atol=0.05), \
+                   TestError("Unexpected centers")
+
+    def test_find_bright_peaks(self):
+        found = []
+        peaks = self.iqcalc.find_bright_peaks(self.data, threshold=200.0,
+                                              tile_size=32, num_threads=2,
+                                              cb_fn=found.extend)
+        expected = [(round(x), round(y)) for x, y in self.stars]
+        expected.sort(key=lambda pt: (pt[1], pt[0]))
+        assert peaks == expected, \
+               TestError("Unexpected peaks %s" % (str(peaks)))
+        assert sorted(found) == sorted(peaks), \
+               TestError("Peaks not passed to callback")
+
+    def test_find_bright_peaks_seams(self):
+        # saturated plateau much wider than the tile margin, across tiles
+        data = numpy.zeros((100, 100))
+        data[30:50, 20:50] = 60000.0
+        found = []
+        peaks = self.iqcalc.find_bright_peaks(data, threshold=1000.0,
+                                              tile_size=32, num_threads=2,
+                                              cb_fn=found.extend)
+        assert peaks == [(34.5, 39.5)], \
+               TestError("Unexpected peaks %s" % (str(peaks)))
+        assert found == peaks, \
+               TestError("Peaks not passed to callback")
+
+        # same peaks as when labeling the data in one piece
+        data = numpy.random.RandomState(1).randint(0, 6, (100, 100))
+        peaks1 = self.iqcalc.find_bright_peaks(data, threshold=3, radius=3,
+                                               tile_size=32)
+        peaks2 = self.iqcalc.find_bright_peaks(data, threshold=3, radius=3,
+                                               tile_size=100)
+        assert peaks1 == peaks2, \
+               TestError("Tiled peaks differ from whole data peaks")
+
+    def test_pick_field(self):
+        qs = self.iqcalc.pick_field(self.data, fwhm_radius=10)
+        assert (round(qs.objx), round(qs.objy)) in [
+            (round(x), round(y)) for x, y in self.stars], \
+               TestError("Unexpected object picked at %f,%f" % (
+            qs.objx, qs.objy))
+
+        # if no refined candidate matches the criteria, the best one as
+        # first evaluated is chosen instead
+        iqcalc = self.iqcalc
+        objlist = iqcalc.evaluate_peaks(iqcalc.find_bright_peaks(self.data),
+                                        self.data, fwhm_radius=10,
+                                        fwhm_method=2)
+        results = iqcalc.objlist_select(objlist, 100, 100)
+        qs = iqcalc.refine_select(results, self.data, fwhm_radius=10,
+                                  maxfwhm=0.1, num_refine=1)
+        assert qs is results[0], \
+               TestError("Unexpected object picked at %f,%f" % (
+            qs.objx, qs.objy))
+
+    def test_progress(self):
+        peaks = [(int(round(x)), int(round(y))) for x, y in self.stars]
+        done = []
+        self.iqcalc.evaluate_peaks(peaks, self.data, fwhm_radius=10,
+                                   fwhm_method=1, progress_fn=done.append)
+        # reported as each row is fitted, then at the end
+        assert done == [i / 6.0 for i in range(1, 7)] + [1.0], \
+               TestError("Unexpected progress %s" % (str(done)))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+#END
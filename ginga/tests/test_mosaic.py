@@ -0,0 +1,117 @@
+import unittest
+import logging
+import numpy
+
+from ginga.util import dp
+
+class TestError(Exception):
+    pass
+
+class LinearWCS(object):
+    """A WCS without projection, enough to place mosaic pieces."""
+
+    def __init__(self, image):
+        self.image = image
+
+    def load_header(self, header, fobj=None):
+        pass
+
+    def _get_params(self):
+        return self.image.get_keywords_list('CRPIX1', 'CRPIX2', 'CRVAL1',
+                                            'CRVAL2', 'CDELT1', 'CDELT2')
+
+    def pixtoradec(self, idxs, coords='data'):
+        crpix1, crpix2, crval1, crval2, cdelt1, cdelt2 = self._get_params()
+        x, y = idxs[:2]
+        return (crval1 + (x + 1 - crpix1) * cdelt1,
+                crval2 + (y + 1 - crpix2) * cdelt2)
+
+    def radectopix(self, ra_deg, dec_deg, coords='data', naxispath=None):
+        crpix1, crpix2, crval1, crval2, cdelt1, cdelt2 = self._get_params()
+        return ((ra_deg - crval1) / cdelt1 + crpix1 - 1,
+                (dec_deg - crval2) / cdelt2 + crpix2 - 1)
+
+
+class TestMosaic(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("TestMosaic")
+
+    def make_image(self, ra_deg, dec_deg, fov_deg, value):
+        image = dp.create_blank_image(ra_deg, dec_deg, fov_deg, 0.001, 0.0,
+                                      cdbase=[1, 1], logger=self.logger)
+        image.wcs = LinearWCS(image)
+        image.get_data()[:] = value
+        return image
+
+    def test_place(self):
+        img_mosaic = self.make_image(10.0, 20.0, 0.05, 0.0)
+        images = [self.make_image(10.0 + dx, 20.0 + dy, 0.02, i + 1.0)
+                  for i, (dx, dy) in enumerate([(0.0, 0.0), (0.03, 0.0),
+                                                (-0.03, 0.0), (0.0, 0.03)])]
+
+        changes = []
+        def _modified(image):
+            changes.append((image.get_size(), image.get_modified_region(),
+                            image.get_data()))
+        img_mosaic.add_callback('modified', _modified)
+        loc = img_mosaic.mosaic_inline(images, expand_pad_deg=0.0,
+                                       num_threads=2)
+
+        # expanded (once) to hold all of the images, and then each image
+        # is reported as it is placed
+        assert [size for size, region, data in changes] == [(80, 65)] * 5, \
+               TestError("Unexpected expansion of mosaic %s" % (changes))
+        regions = [region for size, region, data in changes]
+        assert (regions[0] is None) and (None not in regions[1:]), \
+               TestError("Unexpected regions modified %s" % (regions))
+        data = img_mosaic.get_data()
+        assert all([_data is data for size, region, _data in changes]), \
+               TestError("Data reallocated while placing images")
+        assert data.dtype == numpy.float32, \
+               TestError("Unexpected mosaic type %s" % (data.dtype))
+
+        boxes = [img_mosaic.mosaic_footprint(image) for image in images]
+        assert sorted(regions[1:]) == sorted(boxes) and loc == boxes[-1], \
+               TestError("Unexpected locations %s" % (regions))
+        for i, (xlo, ylo, xhi, yhi) in enumerate(boxes):
+            assert (xhi - xlo, yhi - ylo) == (20, 20), \
+                   TestError("Image %d covers %s" % (i, boxes[i]))
+            assert numpy.all(data[ylo:yhi, xlo:xhi] == i + 1.0), \
+                   TestError("Image %d not placed at %s" % (i, boxes[i]))
+        assert img_mosaic.get_minmax() == (0.0, 4.0), \
+               TestError("Unexpected min/max %s" % (
+            str(img_mosaic.get_minmax())))
+
+    def test_memory(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            # python 2
+            return
+        images = [self.make_image(10.0 + dx, 20.0 + dy, 0.2, 1.0)
+                  for dx in (-0.2, 0.0, 0.2) for dy in (-0.2, 0.0, 0.2)]
+
+        # after the one allocation, the images are reprojected a band at
+        # a time, so the memory used does not grow with their number
+        peaks = []
+        for num in (1, len(images)):
+            img_mosaic = self.make_image(10.0, 20.0, 0.6, 0.0)
+            img_mosaic.mosaic_band_size = 10000
+            boxes = [img_mosaic.mosaic_footprint(image)
+                     for image in images[:num]]
+            data = img_mosaic.get_data()
+            tracemalloc.start()
+            try:
+                img_mosaic.mosaic_fill(images[:num], boxes)
+                size, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            assert img_mosaic.get_data() is data, \
+                   TestError("Data reallocated while placing images")
+            peaks.append(peak)
+
+        assert peaks[1] < 1.5 * peaks[0], \
+               TestError("Peak memory grows with images: %s" % (peaks))
+
+#END
@@ -0,0 +1,57 @@
+import unittest
+import numpy
+
+from ginga.util import stats
+
+class TestError(Exception):
+    pass
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.data = numpy.arange(100000, dtype=numpy.float64).reshape(200, 500)
+        self.data[10:20, 10:20] = numpy.nan
+        self.data[0, 0] = numpy.inf
+        self.finite = self.data[numpy.isfinite(self.data)]
+
+    def test_range(self):
+        minval, maxval = stats.calc_range(self.data, chunk_size=1000)
+        assert (minval, maxval) == (1.0, 99999.0), \
+               TestError("Unexpected range (%f, %f)" % (minval, maxval))
+
+    def test_stats(self):
+        data = self.data.copy()
+        data[1, 1] = -numpy.inf
+        bnch = stats.calc_stats(data, chunk_size=1000)
+        assert (bnch.minval, bnch.maxval) == (-numpy.inf, numpy.inf), \
+               TestError("Unexpected min/max (%f, %f)" % (bnch.minval,
+                                                         bnch.maxval))
+        assert (bnch.minval_noinf, bnch.maxval_noinf) == (1.0, 99999.0), \
+               TestError("Unexpected finite min/max (%f, %f)" % (
+            bnch.minval_noinf, bnch.maxval_noinf))
+        assert (bnch.nan_count, bnch.inf_count) == (100, 2), \
+               TestError("Unexpected NaN/Inf counts (%d, %d)" % (
+            bnch.nan_count, bnch.inf_count))
+
+    def test_histogram(self):
+        dist, bins = stats.calc_histogram(self.data, numbins=100,
+                                          chunk_size=1000)
+        dist2, bins2 = numpy.histogram(self.finite, bins=100)
+        assert numpy.array_equal(dist, dist2), \
+               TestError("Histogram differs from numpy.histogram")
+        assert numpy.allclose(bins, bins2), \
+               TestError("Bins differ from numpy.histogram")
+
+    def test_percentiles(self):
+        pcts = [0.001, 0.5, 0.999]
+        res = stats.calc_percentiles(self.data, pcts, numbins=256,
+                                     chunk_size=1000)
+        expect = numpy.percentile(self.finite, [p * 100 for p in pcts])
+        assert numpy.allclose(res, expect, atol=2.0), \
+               TestError("Percentiles %s != %s" % (str(res), str(expect)))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+#END
@@ -0,0 +1,77 @@
+import unittest
+import numpy
+
+from ginga import trcalc
+
+class TestError(Exception):
+    pass
+
+class TestTrcalc(unittest.TestCase):
+
+    def setUp(self):
+        self.dst = numpy.zeros((20, 30, 4), dtype=numpy.uint8)
+        self.dst[..., 0:3] = 100
+
+    def test_overlay_opaque(self):
+        src = numpy.zeros((10, 10, 3), dtype=numpy.uint8)
+        src[..., 0] = 1
+        src[..., 2] = 3
+        trcalc.overlay_image(self.dst, 25, -5, src, dst_order='RGBA',
+                             src_order='BGR')
+        res = self.dst[0:5, 25:30]
+        assert (res[..., 0] == 3).all() and (res[..., 2] == 1).all(), \
+               TestError("Source channels not reordered")
+        assert (res[..., 3] == 255).all(), \
+               TestError("Alpha not filled")
+        assert (self.dst[5:, :, 0:3] == 100).all(), \
+               TestError("Data outside of overlay changed")
+
+    def test_overlay_alpha(self):
+        src = numpy.zeros((10, 10, 4), dtype=numpy.uint8)
+        src[..., 0:3] = 200
+        src[0:5, ..., 3] = 255
+        src[5:, ..., 3] = 51
+        trcalc.overlay_image(self.dst, 0, 0, src, dst_order='RGBA',
+                             src_order='RGBA')
+        assert (self.dst[0:5, 0:10, 0:3] == 200).all(), \
+               TestError("Opaque pixels not copied")
+        # 200 * 0.2 + 100 * 0.8
+        assert (self.dst[5:10, 0:10, 0:3] == 120).all(), \
+               TestError("Unexpected blended value %d" % self.dst[5, 0, 0])
+
+        trcalc.overlay_image(self.dst, 0, 0, src[..., 0:3], dst_order='RGBA',
+                             src_order='RGB', alpha=0.0)
+        assert self.dst[5, 0, 0] == 120, \
+               TestError("Transparent overlay changed data")
+
+    def test_sample_line(self):
+        data = numpy.arange(100.0).reshape((10, 10))
+        x, y, values = trcalc.sample_line(data, 2, 1, 12, 6)
+        assert (x[0], y[0], x[-1], y[-1]) == (2, 1, 12, 6), \
+               TestError("Unexpected end points")
+        assert numpy.all(numpy.abs(numpy.diff(y)) <= 1) and \
+               numpy.all(numpy.diff(x) == 1), \
+               TestError("Line pixels not connected")
+        assert numpy.array_equal(values[:8], data[y[:8], x[:8]]) and \
+               numpy.isnan(values[8:]).all(), \
+               TestError("Unexpected values along line")
+
+        # halfway between pixels
+        x, y, values = trcalc.sample_line(data, 0.5, 2, 0.5, 4,
+                                          method='bilinear')
+        assert numpy.allclose(values, [20.5, 30.5, 40.5]), \
+               TestError("Unexpected interpolated values %s" % str(values))
+
+        # averaged across the line
+        x, y, values = trcalc.sample_line(data, 2, 5, 6, 5, width=3)
+        assert numpy.allclose(values, data[5, 2:7]), \
+               TestError("Unexpected band averaged values %s" % str(values))
+
+        # through an image
+        from ginga.BaseImage import BaseImage
+        image = BaseImage(data_np=data)
+        values = image.get_pixels_on_line(2, 1, 9, 1)
+        assert values == data[1, 2:10].tolist(), \
+               TestError("Unexpected image values %s" % str(values))
+
+#END
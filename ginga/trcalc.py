@@ -10,6 +10,9 @@
 import math
 import numpy
 import time
+import threading
+
+from ginga.misc import LRUCache
 
 def use(pkgname):
     global have_opencv, cv2, cv2_resize
@@ -111,45 +114,70 @@ def rotate_clip(data_np, theta_deg, rotctr_x=None, rotctr_y=None,
                 new_wd, new_ht, wd, ht))
 
     else:
-        yi, xi = numpy.mgrid[0:ht, 0:wd]
-        xi -= rotctr_x
-        yi -= rotctr_y
-        cos_t = numpy.cos(numpy.radians(theta_deg))
-        sin_t = numpy.sin(numpy.radians(theta_deg))
-
-        #t1 = time.time()
-        if have_numexpr:
-            ap = ne.evaluate("(xi * cos_t) - (yi * sin_t) + rotctr_x")
-            bp = ne.evaluate("(xi * sin_t) + (yi * cos_t) + rotctr_y")
-        else:
-            ap = (xi * cos_t) - (yi * sin_t) + rotctr_x
-            bp = (xi * sin_t) + (yi * cos_t) + rotctr_y
-        #print "rotation in %.5f sec" % (time.time() - t1)
-
-        #ap = numpy.rint(ap).astype('int').clip(0, wd-1)
-        #bp = numpy.rint(bp).astype('int').clip(0, ht-1)
-        # Optomizations to reuse existing intermediate arrays
-        numpy.rint(ap, out=ap)
-        ap = ap.astype('int')
-        ap.clip(0, wd-1, out=ap)
-        numpy.rint(bp, out=bp)
-        bp = bp.astype('int')
-        bp.clip(0, ht-1, out=bp)
+        # look up which source pixel goes to each destination pixel
+        idx = get_rotate_table(ht, wd, theta_deg, rotctr_x, rotctr_y)
+
+        # gather from the data viewed as a flat array of pixels
+        # (reshape makes a copy if the data is not contiguous)
+        flat = data_np.reshape((ht * wd,) + data_np.shape[2:])
+        newdata = numpy.take(flat, idx, axis=0)
+        newdata = newdata.reshape(data_np.shape)
 
         if out is not None:
-            out[:, :, ...] = data_np[bp, ap]
+            out[:, :, ...] = newdata
             newdata = out
-        else:
-            newdata = data_np[bp, ap]
-            new_ht, new_wd = newdata.shape[:2]
-
-            assert (wd == new_wd) and (ht == new_ht), \
-                   Exception("rotated cutout is %dx%d original=%dx%d" % (
-                new_wd, new_ht, wd, ht))
 
     return newdata
 
 
+# cache of tables made by get_rotate_table()
+rotate_cache = LRUCache.LRUCache(maxbytes=64 * 1024 * 1024)
+
+def get_rotate_table(ht, wd, theta_deg, rotctr_x, rotctr_y):
+    """
+    Returns a flat array of indexes into the (ht, wd) pixels of an array
+    (flattened) that gives the result of rotating it by `theta_deg` around
+    (rotctr_x, rotctr_y), as done by rotate_clip().  Tables are cached
+    by size, angle and center, so that redraws at the same rotation don't
+    need to compute them again.
+    """
+    key = (ht, wd, theta_deg, rotctr_x, rotctr_y)
+    idx = rotate_cache.get(key, None)
+    if idx is not None:
+        return idx
+
+    yi, xi = numpy.mgrid[0:ht, 0:wd]
+    xi -= rotctr_x
+    yi -= rotctr_y
+    cos_t = numpy.cos(numpy.radians(theta_deg))
+    sin_t = numpy.sin(numpy.radians(theta_deg))
+
+    #t1 = time.time()
+    if have_numexpr:
+        ap = ne.evaluate("(xi * cos_t) - (yi * sin_t) + rotctr_x")
+        bp = ne.evaluate("(xi * sin_t) + (yi * cos_t) + rotctr_y")
+    else:
+        ap = (xi * cos_t) - (yi * sin_t) + rotctr_x
+        bp = (xi * sin_t) + (yi * cos_t) + rotctr_y
+    #print "rotation in %.5f sec" % (time.time() - t1)
+
+    # Optomizations to reuse existing intermediate arrays
+    numpy.rint(ap, out=ap)
+    ap = ap.astype(numpy.intp)
+    ap.clip(0, wd-1, out=ap)
+    numpy.rint(bp, out=bp)
+    bp = bp.astype(numpy.intp)
+    bp.clip(0, ht-1, out=bp)
+
+    # combine into indexes of the flattened array
+    bp *= wd
+    bp += ap
+    idx = bp.ravel()
+
+    rotate_cache.put(key, idx)
+    return idx
+
+
 def rotate(data_np, theta_deg, rotctr_x=None, rotctr_y=None):
 
     # If there is no rotation, then we are done
@@ -171,7 +199,7 @@ def rotate(data_np, theta_deg, rotctr_x=None, rotctr_y=None):
     new_wd = new_ht = side
     dims = (new_ht, new_wd) + data_np.shape[2:]
     # TODO: fill with a different value?
-    newdata = numpy.zeros(dims)
+    newdata = numpy.zeros(dims, dtype=data_np.dtype)
     # Find center of new data array
     ncx, ncy = new_wd // 2, new_ht // 2
 
@@ -234,6 +262,33 @@ def get_scaled_cutout_wdht_view(shp, x1, y1, x2, y2, new_wd, new_ht):
     return (view, (scale_x, scale_y))
 
 
+def get_scaled_tile_view(shp, x1, y1, x2, y2, scale_x, scale_y):
+    """
+    Returns the view/slice to extract the region (x1, y1) to (x2, y2)
+    (exclusive) of the array that would result from scaling an array of
+    shape `shp` by (scale_x, scale_y).
+
+    Unlike get_scaled_cutout_wdht_view, the sampling is anchored at the
+    origin of the data rather than at the corner of the cutout, so
+    neighboring regions (tiles) can be computed separately and joined
+    seamlessly.
+    """
+    ht, wd = shp[:2]
+
+    if (scale_x == 1.0) and (scale_y == 1.0):
+        # simple view will do
+        x1, x2 = max(0, min(x1, wd)), max(0, min(x2, wd))
+        y1, y2 = max(0, min(y1, ht)), max(0, min(y2, ht))
+        return numpy.s_[y1:y2, x1:x2]
+
+    xi = (numpy.arange(x1, x2) / float(scale_x)).astype('int')
+    xi.clip(0, wd-1, out=xi)
+    yi = (numpy.arange(y1, y2) / float(scale_y)).astype('int')
+    yi.clip(0, ht-1, out=yi)
+
+    return numpy.s_[yi.reshape(-1, 1), xi.reshape(1, -1)]
+
+
 def get_scaled_cutout_wdht(data_np, x1, y1, x2, y2, new_wd, new_ht,
                            interpolation='nearest'):
     if have_opencv and (interpolation != 'basic'):
@@ -293,6 +348,160 @@ def get_scaled_cutout_basic(data_np, x1, y1, x2, y2, scale_x, scale_y,
     return newdata, (scale_x, scale_y)
 
 
+def block_reduce(data_np, method='mean'):
+    """
+    Reduce the first two dimensions of `data_np` by a factor of two,
+    combining each 2x2 block of pixels into one with `method` ('mean'
+    or 'max').  An odd trailing row or column is dropped.
+    The result has the same dtype as the input.
+    """
+    ht, wd = data_np.shape[:2]
+    ht, wd = max(ht // 2, 1), max(wd // 2, 1)
+
+    if min(data_np.shape[:2]) < 2:
+        # too small to reduce in one of the dimensions--just step
+        return data_np[0:ht*2:2, 0:wd*2:2].copy()
+
+    # view each 2x2 block as two extra axes
+    data = data_np[:ht*2, :wd*2]
+    blocks = data.reshape((ht, 2, wd, 2) + data_np.shape[2:])
+
+    if method == 'mean':
+        # add up blocks in a wider type to avoid overflow
+        if issubclass(data_np.dtype.type, numpy.floating):
+            acc = data_np.dtype
+        else:
+            acc = numpy.float64
+        res = blocks[:, 0, :, 0].astype(acc)
+        res += blocks[:, 0, :, 1]
+        res += blocks[:, 1, :, 0]
+        res += blocks[:, 1, :, 1]
+        res *= 0.25
+
+    elif method == 'max':
+        res = numpy.maximum(blocks[:, 0, :, 0], blocks[:, 0, :, 1])
+        numpy.maximum(res, blocks[:, 1, :, 0], out=res)
+        numpy.maximum(res, blocks[:, 1, :, 1], out=res)
+
+    else:
+        raise ValueError("Reduction method not supported: '%s'" % (method))
+
+    return res.astype(data_np.dtype, copy=False)
+
+
+def get_line_coords(x1, y1, x2, y2):
+    """
+    Returns arrays (x, y) of the integer coordinates of the pixels on the
+    line from (x1, y1) to (x2, y2), the same ones that Bresenham's line
+    algorithm would visit, in order.
+    """
+    dx, dy = abs(x2 - x1), abs(y2 - y1)
+    sx = 1 if x1 < x2 else -1
+    sy = 1 if y1 < y2 else -1
+    n = max(dx, dy)
+    i = numpy.arange(n + 1, dtype=numpy.intp)
+    if n == 0:
+        return (i + x1, i + y1)
+    # step one pixel along the major axis, rounding (halves down) the
+    # position along the minor one
+    if dx >= dy:
+        x_arr = x1 + sx * i
+        y_arr = y1 + sy * ((2 * i * dy + dx - 1) // (2 * dx))
+    else:
+        y_arr = y1 + sy * i
+        x_arr = x1 + sx * ((2 * i * dx + dy - 1) // (2 * dy))
+    return (x_arr, y_arr)
+
+
+def sample_points(data_np, x_arr, y_arr, method='nearest', fill=numpy.nan):
+    """
+    Returns the values of `data_np` at the (possibly fractional) positions
+    in the arrays `x_arr` and `y_arr`, as a float array of their shape
+    (plus any extra dimensions of the data).  `method` is 'nearest' or
+    'bilinear'.  Positions outside of the data get the value `fill`.
+    """
+    ht, wd = data_np.shape[:2]
+    x_arr = numpy.asarray(x_arr, dtype=numpy.float64)
+    y_arr = numpy.asarray(y_arr, dtype=numpy.float64)
+    res = numpy.empty(x_arr.shape + data_np.shape[2:], dtype=numpy.float64)
+    res.fill(fill)
+
+    if method == 'nearest':
+        xi = numpy.floor(x_arr + 0.5).astype(numpy.intp)
+        yi = numpy.floor(y_arr + 0.5).astype(numpy.intp)
+        ok = (xi >= 0) & (xi < wd) & (yi >= 0) & (yi < ht)
+        res[ok] = data_np[yi[ok], xi[ok]]
+
+    elif method == 'bilinear':
+        ok = ((x_arr >= 0) & (x_arr <= wd - 1) &
+              (y_arr >= 0) & (y_arr <= ht - 1))
+        x_arr, y_arr = x_arr[ok], y_arr[ok]
+        # lower left of the 2x2 block of pixels around each point
+        x0 = numpy.clip(numpy.floor(x_arr), 0, max(wd - 2, 0)).astype(numpy.intp)
+        y0 = numpy.clip(numpy.floor(y_arr), 0, max(ht - 2, 0)).astype(numpy.intp)
+        x1, y1 = numpy.minimum(x0 + 1, wd - 1), numpy.minimum(y0 + 1, ht - 1)
+        fx, fy = x_arr - x0, y_arr - y0
+        if data_np.ndim > 2:
+            # weights apply to each of the extra dimensions
+            shape = fx.shape + (1,) * (data_np.ndim - 2)
+            fx, fy = fx.reshape(shape), fy.reshape(shape)
+        res[ok] = ((data_np[y0, x0] * (1.0 - fx) + data_np[y0, x1] * fx) *
+                   (1.0 - fy) +
+                   (data_np[y1, x0] * (1.0 - fx) + data_np[y1, x1] * fx) *
+                   fy)
+
+    else:
+        raise ValueError("Interpolation method not supported: '%s'" % (
+            method))
+
+    return res
+
+
+def sample_line(data_np, x1, y1, x2, y2, width=1, method='nearest',
+                fill=numpy.nan):
+    """
+    Samples `data_np` along the line from (x1, y1) to (x2, y2).
+
+    With method 'nearest' the pixels on the line are those of
+    get_line_coords() (the end points are rounded to whole pixels);
+    with 'bilinear' the line is sampled at intervals of about one pixel.
+    If `width` is more than 1, each value is the average of `width`
+    samples one pixel apart across the line (ignoring NaNs).
+
+    Returns arrays (x, y, values) of the positions along the line and
+    the values there; positions off the data get the value `fill`.
+    """
+    length = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    if method == 'nearest':
+        x_arr, y_arr = get_line_coords(int(round(x1)), int(round(y1)),
+                                       int(round(x2)), int(round(y2)))
+    else:
+        t = numpy.linspace(0.0, 1.0, int(round(length)) + 1)
+        x_arr, y_arr = x1 + t * (x2 - x1), y1 + t * (y2 - y1)
+
+    width = max(int(width), 1)
+    if (width == 1) or (length == 0):
+        values = sample_points(data_np, x_arr, y_arr, method=method,
+                               fill=fill)
+        return (x_arr, y_arr, values)
+
+    # offsets of the samples across the line, along its unit normal
+    offsets = numpy.arange(width) - (width - 1) / 2.0
+    nx, ny = -(y2 - y1) / length, (x2 - x1) / length
+    xs = x_arr[:, numpy.newaxis] + offsets * nx
+    ys = y_arr[:, numpy.newaxis] + offsets * ny
+    band = sample_points(data_np, xs, ys, method=method, fill=numpy.nan)
+
+    # NaN-ignoring mean across the band
+    isnum = ~numpy.isnan(band)
+    count = isnum.sum(axis=1)
+    total = numpy.where(isnum, band, 0.0).sum(axis=1)
+    values = numpy.empty(total.shape, dtype=numpy.float64)
+    values.fill(fill)
+    numpy.divide(total, count, out=values, where=(count > 0))
+    return (x_arr, y_arr, values)
+
+
 def transform(data_np, flip_x=False, flip_y=False, swap_xy=False):
 
     # Do transforms as necessary
@@ -414,34 +623,97 @@ def overlay_image(dstarr, dst_x, dst_y, srcarr, dst_order='RGBA',
     if fill and (da_idx >= 0):
         dstarr[dst_y:dst_y+src_ht, dst_x:dst_x+src_wd, da_idx] = 255
 
+    # destination area and source data to be combined, as views
+    dst = dstarr[dst_y:dst_y+src_ht, dst_x:dst_x+src_wd, :]
+    src = srcarr[0:src_ht, 0:src_wd, :]
+
+    # indexes of the source channels that go into the destination
+    # color channels (reordering is done by picking channels from views)
+    indexes = [ src_order.index(c) for c in dst_order[0:3] ]
+
+    sa_idx = -1
     if src_dp > 3:
+        # if overlay source contains an alpha channel, use it,
+        # otherwise use scalar keyword parameter
         sa_idx = src_order.index('A')
-        # if overlay source contains an alpha channel, extract it
-        # and use it, otherwise use scalar keyword parameter
-        alpha = srcarr[0:src_ht, 0:src_wd, sa_idx] / 255.0
-        alpha = numpy.dstack((alpha, alpha, alpha))
-
-    # reorder srcarr if necessary to match dstarr for alpha merge
-    get_order = dst_order
-    if ('A' in dst_order) and not ('A' in src_order):
-        get_order = dst_order.replace('A', '')
-    if get_order != src_order:
-        srcarr = reorder_image(get_order, srcarr, src_order)
-
-    # calculate alpha blending
+
+    elif alpha >= 1.0:
+        # opaque source: just copy it in
+        _copy_channels(dst, src, indexes)
+        return dstarr
+
+    elif alpha <= 0.0:
+        # fully transparent source: nothing to do
+        return dstarr
+
+    if (dst.dtype != numpy.uint8) or (src.dtype != numpy.uint8):
+        # not 8-bit data, do the blending in floating point
+        if sa_idx >= 0:
+            alpha = src[..., sa_idx] / 255.0
+        for i, idx in enumerate(indexes):
+            dst[..., i] = alpha * src[..., idx] + (1.0 - alpha) * dst[..., i]
+        return dstarr
+
+    # calculate alpha blending in 16-bit integers
     #   Co = CaAa + CbAb(1 - Aa)
-    a_arr = (alpha * srcarr[0:src_ht, 0:src_wd, 0:3]).astype(numpy.uint8)
-    b_arr = ((1.0 - alpha) * dstarr[dst_y:dst_y+src_ht,
-                                    dst_x:dst_x+src_wd,
-                                    0:3]).astype(numpy.uint8)
+    shape = (src_ht, src_wd)
+    t1 = _get_scratch('t1', shape, numpy.uint16)
+    t2 = _get_scratch('t2', shape, numpy.uint16)
+    if sa_idx >= 0:
+        a = src[..., sa_idx]
+        b = _get_scratch('b', shape, numpy.uint8)
+        numpy.subtract(255, a, out=b)
+    else:
+        a = int(round(alpha * 255))
+        b = 255 - a
 
-    # Place our srcarr into this dstarr at dst offsets
-    #dstarr[dst_y:dst_y+src_ht, dst_x:dst_x+src_wd, 0:3] += addarr[0:src_ht, 0:src_wd, 0:3]
-    dstarr[dst_y:dst_y+src_ht, dst_x:dst_x+src_wd, 0:3] = \
-             a_arr[0:src_ht, 0:src_wd, 0:3] + b_arr[0:src_ht, 0:src_wd, 0:3]
+    for i, idx in enumerate(indexes):
+        _blend(dst[..., i], src[..., idx], a, b, t1, t2)
 
     return dstarr
 
+# per-thread scratch buffers for overlay_image()
+_scratch = threading.local()
+
+def _get_scratch(name, shape, dtype):
+    """
+    Returns an uninitialized array of `shape` and `dtype`, using memory
+    that is kept between calls in the calling thread.
+    """
+    size = shape[0] * shape[1]
+    buf = getattr(_scratch, name, None)
+    if (buf is None) or (buf.size < size) or (buf.dtype != dtype):
+        buf = numpy.empty(size, dtype=dtype)
+        setattr(_scratch, name, buf)
+    return buf[:size].reshape(shape)
+
+def _copy_channels(dst, src, indexes):
+    """
+    Copy the source channels `indexes` into the first channels of `dst`.
+    """
+    k = indexes[0]
+    if indexes == list(range(k, k + len(indexes))):
+        dst[..., 0:len(indexes)] = src[..., k:k+len(indexes)]
+    else:
+        for i, idx in enumerate(indexes):
+            dst[..., i] = src[..., idx]
+
+def _blend(dst, src, a, b, t1, t2):
+    """
+    Set 8-bit channel `dst` to (src * a + dst * b) / 255, where a + b
+    is 255, rounding to nearest.  `t1` and `t2` are 16-bit scratch arrays.
+    """
+    numpy.multiply(src, a, out=t1, dtype=numpy.uint16)
+    numpy.multiply(dst, b, out=t2, dtype=numpy.uint16)
+    t1 += t2
+    # divide by 255 with rounding: x / 255 ~= (x + (x >> 8)) >> 8,
+    # exact for 0 <= x + 128 <= 65535
+    t1 += 128
+    numpy.right_shift(t1, 8, out=t2)
+    t1 += t2
+    t1 >>= 8
+    dst[...] = t1
+
 def reorder_image(dst_order, src_arr, src_order):
     indexes = [ src_order.index(c) for c in dst_order ]
     return numpy.dstack([ src_arr[..., idx] for idx in indexes ])
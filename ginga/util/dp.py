@@ -45,7 +45,12 @@ def make_image(data_np, oldimage, header, pfx='dp'):
 
 
 def create_blank_image(ra_deg, dec_deg, fov_deg, px_scale, rot_deg,
-                       cdbase=[1, 1], logger=None, pfx='dp'):
+                       cdbase=[1, 1], logger=None, pfx='dp',
+                       mmap_path=None):
+    """Create a blank (zero) float32 image with a simple WCS.  If
+    `mmap_path` is given, the data is memory mapped to that (new) file,
+    for images larger than memory.
+    """
 
     # ra and dec in traditional format
     ra_txt = wcs.raDegToString(ra_deg, format='%02d:%02d:%06.3f')
@@ -61,7 +66,12 @@ def create_blank_image(ra_deg, dec_deg, fov_deg, px_scale, rot_deg,
     ##     imagesize += 1
     width = height = imagesize
 
-    data = numpy.zeros((height, width), dtype=numpy.float32)
+    if mmap_path is not None:
+        # a new file is zero filled
+        data = numpy.memmap(mmap_path, dtype=numpy.float32, mode='w+',
+                            shape=(height, width))
+    else:
+        data = numpy.zeros((height, width), dtype=numpy.float32)
 
     crpix = float(imagesize // 2)
     header = OrderedDict((('SIMPLE', True),
@@ -87,6 +87,10 @@ class PyFitsFileHandler(BaseFitsFileHandler):
             raise FITSError("Need astropy or pyfits module installed to use this file handler")
         self.logger = logger
         self.kind = 'pyfits'
+        # default for load_file(): True to memory map the pixel data and
+        # read only the headers at load time, False to read the data into
+        # memory, or None to leave it to astropy/pyfits
+        self.memmap = None
 
     def fromHDU(self, hdu, ahdr):
         header = hdu.header
@@ -126,8 +130,25 @@ class PyFitsFileHandler(BaseFitsFileHandler):
         self.fromHDU(hdu, ahdr)
         return (data, naxispath)
 
+    def is_image_hdu(self, hdu):
+        """Decide from the header alone whether `hdu` holds (non-empty)
+        image data, so that the data does not need to be read.
+        """
+        if not getattr(hdu, 'is_image', True):
+            # table or other non-pixel hdu
+            return False
+        header = hdu.header
+        naxis = header.get('NAXIS', 0)
+        if naxis == 0:
+            return False
+        for i in range(1, naxis+1):
+            if header.get('NAXIS%d' % i, 0) == 0:
+                # zero-length data
+                return False
+        return True
+
     def load_file(self, filespec, ahdr, numhdu=None, naxispath=None,
-                  phdr=None):
+                  phdr=None, memmap=None):
 
         info = iohelper.get_fileinfo(filespec)
         if not info.ondisk:
@@ -135,27 +156,33 @@ class PyFitsFileHandler(BaseFitsFileHandler):
                 info.url))
         filepath = info.filepath
 
-        self.logger.debug("Loading file '%s' ..." % (filepath))
-        fits_f = pyfits.open(filepath, 'readonly')
+        if memmap is None:
+            memmap = self.memmap
+
+        self.logger.debug("Loading file '%s' (memmap=%s) ..." % (
+            filepath, memmap))
+        kwdargs = {}
+        if memmap is not None:
+            kwdargs['memmap'] = memmap
+        fits_f = pyfits.open(filepath, 'readonly', **kwdargs)
 
         # this seems to be necessary now for some fits files...
-        try:
-            fits_f.verify('fix')
-        except Exception as e:
-            raise FITSError("Error loading fits file '%s': %s" % (
-                filepath, str(e)))
+        # (in memmap mode only the header of the HDU we load is checked,
+        # since verifying the whole file reads every HDU)
+        if not memmap:
+            try:
+                fits_f.verify('fix')
+            except Exception as e:
+                raise FITSError("Error loading fits file '%s': %s" % (
+                    filepath, str(e)))
 
         if numhdu is None:
             found_valid_hdu = False
             for numhdu in range(len(fits_f)):
                 hdu = fits_f[numhdu]
-                if (hdu.data is None) or (0 in hdu.data.shape):
+                if not self.is_image_hdu(hdu):
                     # non-pixel or zero-length data hdu?
                     continue
-                if not isinstance(hdu.data, numpy.ndarray):
-                    # We need to open a numpy array
-                    continue
-                #print "data type is %s" % hdu.data.dtype.kind
                 # Looks good, let's try it
                 found_valid_hdu = True
                 break
@@ -168,6 +195,13 @@ class PyFitsFileHandler(BaseFitsFileHandler):
 
         hdu = fits_f[numhdu]
 
+        if memmap:
+            try:
+                hdu.verify('fix')
+            except Exception as e:
+                raise FITSError("Error loading fits file '%s': %s" % (
+                    filepath, str(e)))
+
         data, naxispath = self.load_hdu(hdu, ahdr, fobj=fits_f,
                                         naxispath=naxispath)
 
@@ -240,7 +274,9 @@ class FitsioFileHandler(BaseFitsFileHandler):
         return (data, naxispath)
 
     def load_file(self, filespec, ahdr, numhdu=None, naxispath=None,
-                  phdr=None):
+                  phdr=None, memmap=None):
+        # NOTE: `memmap` is accepted for compatibility with the astropy
+        # handler; fitsio always reads the data into memory
 
         info = iohelper.get_fileinfo(filespec)
         if not info.ondisk:
@@ -32,6 +32,32 @@ def get_median(data_np):
     return numpy.median(mdata)
 
 
+def gaussian(x, p):
+    """Gaussian function in 1D (see IQCalc.gaussian)."""
+    y = (1.0 / (p[1] * numpy.sqrt(2*numpy.pi)) *
+         numpy.exp(-(x - p[0])**2 / (2*p[1]**2))) * p[2]
+    return y
+
+def fit_gaussians(rows, p0s):
+    """Least square fit of a gaussian to each of the 1D arrays in `rows`,
+    starting from the parameters in `p0s`.  Returns a list of the fitted
+    parameters (mu, sdev, maxv), or None where the fit failed.
+
+    This is a module level function so that it can be run in another
+    process (see IQCalc.get_fwhms).
+    """
+    errfunc = lambda p, x, y: gaussian(x, p) - y
+    res = []
+    for Y, p0 in zip(rows, p0s):
+        X = numpy.arange(len(Y))
+        p1, success = optimize.leastsq(errfunc, p0, args=(X, Y))
+        if not success:
+            res.append(None)
+        else:
+            res.append(tuple(p1))
+    return res
+
+
 class IQCalcError(Exception):
     """Base exception for raising errors in this module."""
     pass
@@ -51,6 +77,11 @@ class IQCalc(object):
         self.skylevel_magnification = 1.05
         self.skylevel_offset = 40.0
 
+        # for finding peaks: number of values sampled to calculate the
+        # threshold, and size of the tiles the data is processed in
+        self.threshold_samples = 1000000
+        self.peak_tile_size = 512
+
     # FWHM CALCULATION
 
     def gaussian(self, x, p):
@@ -128,6 +159,182 @@ class IQCalc(object):
         return (fwhm_x, fwhm_y, ctr_x, ctr_y, sdx, sdy, maxx, maxy)
 
 
+    def cut_crosses(self, peaks, radius, data):
+        """Cut the X and Y cross sections of (radius) pixels around each
+        of the (x, y) positions in (peaks), all at once.  Returns arrays
+        (x0, y0, xarr, yarr): the coordinates of the first pixel of each
+        cut, and the cuts as the rows of 2D float arrays.  Cuts that run
+        off the data are padded with NaN at the end.
+        """
+        ht, wd = data.shape
+        pos = numpy.array(peaks, dtype=numpy.float64).reshape((-1, 2))
+        x = pos[:, 0].astype(numpy.intp)
+        y = pos[:, 1].astype(numpy.intp)
+        x0, y0 = numpy.maximum(x - radius, 0), numpy.maximum(y - radius, 0)
+        x1 = numpy.minimum(x + radius, wd - 1)
+        y1 = numpy.minimum(y + radius, ht - 1)
+
+        offsets = numpy.arange(2 * radius + 1)
+        xi = x0[:, numpy.newaxis] + offsets
+        yi = y0[:, numpy.newaxis] + offsets
+        xok = xi <= x1[:, numpy.newaxis]
+        yok = yi <= y1[:, numpy.newaxis]
+        xarr = data[y[:, numpy.newaxis], numpy.minimum(xi, wd - 1)]
+        yarr = data[numpy.minimum(yi, ht - 1), x[:, numpy.newaxis]]
+        xarr = numpy.where(xok, xarr, numpy.nan)
+        yarr = numpy.where(yok, yarr, numpy.nan)
+        return (x0, y0, xarr, yarr)
+
+    def estimate_gaussians(self, arr2d, medv):
+        """Estimate the gaussian (mu, sdev, maxv) of each row of cuts in
+        (arr2d) at once, without iterative fitting.  The data is prepared
+        as in calc_fwhm(), and then the log of the values above the
+        background is fit by a parabola, weighted by the square of the
+        values (Guo's method).  Returns three arrays, with NaN where no
+        estimate could be made.
+        """
+        Y = arr2d - medv
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            Y = Y.clip(0, None)
+            ok = Y > 0
+            w = numpy.where(ok, Y * Y, 0.0)
+            lnY = numpy.where(ok, numpy.log(numpy.where(ok, Y, 1.0)), 0.0)
+
+        X = numpy.arange(arr2d.shape[1], dtype=numpy.float64)
+        # normal equations of the weighted fit of ln(y) = a + b*x + c*x^2
+        S = [(w * X**k).sum(axis=1) for k in range(5)]
+        T = [(w * lnY * X**k).sum(axis=1) for k in range(3)]
+        M = numpy.array([[S[0], S[1], S[2]],
+                         [S[1], S[2], S[3]],
+                         [S[2], S[3], S[4]]]).transpose((2, 0, 1))
+        V = numpy.array(T).T
+
+        n = len(arr2d)
+        mu, sdev, maxv = (numpy.empty(n), numpy.empty(n), numpy.empty(n))
+        mu.fill(numpy.nan)
+        sdev.fill(numpy.nan)
+        maxv.fill(numpy.nan)
+        # need at least three points above the background
+        good = ok.sum(axis=1) >= 3
+        if not good.any():
+            return (mu, sdev, maxv)
+        good_idx = numpy.nonzero(good)[0]
+        with numpy.errstate(invalid='ignore', divide='ignore',
+                            over='ignore'):
+            try:
+                abc = numpy.linalg.solve(M[good], V[good])
+            except numpy.linalg.LinAlgError:
+                # some of the systems are singular--solve them one by one
+                abc = numpy.empty((len(good_idx), 3))
+                abc.fill(numpy.nan)
+                for i, j in enumerate(good_idx):
+                    try:
+                        abc[i] = numpy.linalg.solve(M[j], V[j])
+                    except numpy.linalg.LinAlgError:
+                        pass
+            a, b, c = abc[:, 0], abc[:, 1], abc[:, 2]
+            # must open downwards to be a gaussian
+            c = numpy.where(c < 0, c, numpy.nan)
+            _sdev = numpy.sqrt(-1.0 / (2.0 * c))
+            _mu = -b / (2.0 * c)
+            # peak value, then the area (as used by gaussian())
+            _maxv = (numpy.exp(a - b * b / (4.0 * c)) * _sdev *
+                     numpy.sqrt(2 * numpy.pi))
+        mu[good_idx], sdev[good_idx], maxv[good_idx] = _mu, _sdev, _maxv
+        return (mu, sdev, maxv)
+
+    def get_fwhms(self, peaks, radius, data, medv=None, refine=True,
+                  num_procs=1, ev_intr=None, progress_fn=None):
+        """Calculate the FWHM in X and Y of the objects at (peaks), as
+        get_fwhm() does for one object, but all at once.
+
+        The gaussians are first estimated by estimate_gaussians().  If
+        (refine) is True, each estimate is then refined by least square
+        fitting as in calc_fwhm(), split across (num_procs) processes if
+        it is more than 1.  If (progress_fn) is given, it is called with
+        the fraction of the work done as the fitting goes on, and with 1.0
+        at the end.
+
+        Returns a Bunch of arrays, with the same items as the result of
+        get_fwhm() plus `ok`, which is False for the objects that could
+        not be measured.
+        """
+        if medv is None:
+            medv = numpy.median(data)
+        x0, y0, xarr, yarr = self.cut_crosses(peaks, radius, data)
+        n = len(x0)
+        arr2d = numpy.concatenate((xarr, yarr))
+        mu, sdev, maxv = self.estimate_gaussians(arr2d, medv)
+
+        if refine and (n > 0):
+            rows, p0s = [], []
+            for i in range(2 * n):
+                # drop the padding, and treat other NaNs as background
+                Y = arr2d[i]
+                isnum = ~numpy.isnan(Y)
+                Y = numpy.where(isnum, Y, medv)[:isnum.nonzero()[0][-1]+1] \
+                    if isnum.any() else numpy.zeros(1)
+                Y = Y - medv
+                Y = Y.clip(0, max(Y.max(), 0))
+                if numpy.isfinite(sdev[i]):
+                    p0 = [mu[i], sdev[i], maxv[i]]
+                else:
+                    p0 = [0, len(Y) - 1, Y.max()]
+                rows.append(Y)
+                p0s.append(p0)
+            res = self._fit_gaussians(rows, p0s, num_procs, ev_intr,
+                                      progress_fn)
+            for i, p1 in enumerate(res):
+                if p1 is None:
+                    mu[i] = sdev[i] = maxv[i] = numpy.nan
+                else:
+                    mu[i], sdev[i], maxv[i] = p1
+
+        if progress_fn is not None:
+            progress_fn(1.0)
+
+        fwhm = 2.0 * numpy.sqrt(2.0 * numpy.log(2.0)) * sdev
+        ok = numpy.isfinite(fwhm[:n]) & numpy.isfinite(fwhm[n:])
+        return Bunch.Bunch(fwhm_x=fwhm[:n], fwhm_y=fwhm[n:],
+                           ctr_x=x0 + mu[:n], ctr_y=y0 + mu[n:],
+                           sdx=sdev[:n], sdy=sdev[n:],
+                           maxx=maxv[:n], maxy=maxv[n:], ok=ok)
+
+    def _fit_gaussians(self, rows, p0s, num_procs, ev_intr, progress_fn):
+        num_rows = len(rows)
+        if num_procs > 1:
+            # processes don't share the problem with threads (see
+            # calc_fwhm)
+            import multiprocessing
+            size = int(math.ceil(len(rows) / float(num_procs)))
+            jobs = [(rows[i:i+size], p0s[i:i+size])
+                    for i in range(0, len(rows), size)]
+            pool = multiprocessing.Pool(num_procs)
+            try:
+                results = [pool.apply_async(fit_gaussians, job)
+                           for job in jobs]
+                res = []
+                for result in results:
+                    res.extend(result.get())
+                    if progress_fn is not None:
+                        progress_fn(float(len(res)) / num_rows)
+            finally:
+                pool.terminate()
+            return res
+
+        # report progress about every percent
+        step = max(num_rows // 100, 1)
+        res = []
+        for i, (Y, p0) in enumerate(zip(rows, p0s)):
+            if ev_intr and ev_intr.isSet():
+                raise IQCalcError("Evaluation interrupted!")
+            with self.lock:
+                # NOTE: see calc_fwhm for why this mutex is needed
+                res.extend(fit_gaussians([Y], [p0]))
+            if (progress_fn is not None) and ((i + 1) % step == 0):
+                progress_fn(float(i + 1) / num_rows)
+        return res
+
     def starsize(self, fwhm_x, deg_pix_x, fwhm_y, deg_pix_y):
         cdelta1 = math.fabs(deg_pix_x)
         cdelta2 = math.fabs(deg_pix_y)
@@ -143,7 +350,19 @@ class IQCalc(object):
 
     # FINDING BRIGHT PEAKS
 
-    def get_threshold(self, data, sigma=5.0):
+    def get_threshold(self, data, sigma=5.0, max_samples=None):
+        """Calculate a threshold for finding peaks in (data), from the
+        median and the mean absolute deviation from it.  These are
+        estimated from at most (max_samples) values, taken at regular
+        intervals (for memory mapped data, only those are read).
+        """
+        if max_samples is None:
+            max_samples = self.threshold_samples
+        ht, wd = data.shape[:2]
+        step = int(math.ceil(math.sqrt(ht * wd / float(max(max_samples, 1)))))
+        if step > 1:
+            data = data[::step, ::step]
+        data = numpy.asarray(data)
         median = numpy.median(data)
         # NOTE: for this method a good default sigma is 5.0
         dist = numpy.fabs(data - median).mean()
@@ -154,7 +373,8 @@ class IQCalc(object):
         self.logger.debug("calc threshold=%f" % (threshold))
         return threshold
         
-    def find_bright_peaks(self, data, threshold=None, sigma=5, radius=5):
+    def find_bright_peaks(self, data, threshold=None, sigma=5, radius=5,
+                          tile_size=None, num_threads=1, cb_fn=None):
         """
         Find bright peak candidates in (data).  (threshold) specifies a
         threshold value below which an object is not considered a candidate.
@@ -162,6 +382,13 @@ class IQCalc(object):
         (radius) defines a pixel radius for determining local maxima--if the
         desired objects are larger in size, specify a larger radius.
 
+        The data is processed in overlapping tiles of (tile_size) pixels
+        on a side, by (num_threads) threads.  Only one tile at a time is
+        read from memory mapped data.  If (cb_fn) is given, it is called
+        with the list of peaks found in each tile as soon as the tile is
+        done (possibly from another thread), and at the end with the
+        peaks that lie across the edges of tiles.
+
         The routine returns a list of candidate object coordinate tuples
         (x, y) in data.
         """
@@ -171,23 +398,152 @@ class IQCalc(object):
             self.logger.debug("threshold defaults to %f (sigma=%f)" % (
                 threshold, sigma))
 
-        data_max = filters.maximum_filter(data, radius)
-        maxima = (data == data_max)
+        if tile_size is None:
+            tile_size = self.peak_tile_size
+        ht, wd = data.shape[:2]
+        tiles = [(x, y) for y in range(0, ht, tile_size)
+                 for x in range(0, wd, tile_size)]
+        peaks = []
+        edge_maxima = {}
+        lock = threading.Lock()
+
+        def _do_tile(x, y):
+            res, edges = self._find_tile_peaks(data, threshold, radius, x, y,
+                                               min(x + tile_size, wd),
+                                               min(y + tile_size, ht))
+            with lock:
+                peaks.extend(res)
+                edge_maxima[(x, y)] = edges
+            if cb_fn is not None:
+                cb_fn(res)
+
+        num_threads = min(num_threads, len(tiles))
+        if num_threads <= 1:
+            for x, y in tiles:
+                _do_tile(x, y)
+
+        else:
+            errors = []
+
+            def _worker():
+                while True:
+                    with lock:
+                        if (len(tiles) == 0) or (len(errors) > 0):
+                            return
+                        x, y = tiles.pop(0)
+                    try:
+                        _do_tile(x, y)
+                    except Exception as e:
+                        with lock:
+                            errors.append(e)
+
+            threads = [threading.Thread(target=_worker)
+                       for n in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if len(errors) > 0:
+                raise errors[0]
+
+        res = self._merge_tile_peaks(edge_maxima, tile_size)
+        peaks.extend(res)
+        if (cb_fn is not None) and (len(res) > 0):
+            cb_fn(res)
+
+        # same order, whatever order the tiles were done in
+        peaks.sort(key=lambda pt: (pt[1], pt[0]))
+        return peaks
+
+    def _find_tile_peaks(self, data, threshold, radius, x1, y1, x2, y2):
+        """Find the peaks in the tile from (x1, y1) up to (x2, y2).  The
+        tile is extended by a margin of (radius) pixels, so that the
+        maximum filter sees the same surroundings as it would on the whole
+        data.
+
+        Returns the list of peaks that lie entirely in the tile, and a
+        Bunch describing the maxima that touch its edges, which may
+        continue in the next tile (see _merge_tile_peaks).
+        """
+        ht, wd = data.shape[:2]
+        m = radius
+        mx1, my1 = max(x1 - m, 0), max(y1 - m, 0)
+        mx2, my2 = min(x2 + m, wd), min(y2 + m, ht)
+        tile = numpy.asarray(data[my1:my2, mx1:mx2])
+
+        data_max = filters.maximum_filter(tile, radius)
+        maxima = (tile == data_max)
         diff = data_max > threshold
         maxima[diff == 0] = 0
+        maxima = maxima[y1 - my1:y2 - my1, x1 - mx1:x2 - mx1]
 
         labeled, num_objects = ndimage.label(maxima)
         slices = ndimage.find_objects(labeled)
+        # labels of the maxima along each edge of the tile
+        edges = Bunch.Bunch(left=labeled[:, 0].copy(),
+                            right=labeled[:, -1].copy(),
+                            top=labeled[0, :].copy(),
+                            bottom=labeled[-1, :].copy(), boxes={})
+        on_edge = set(numpy.concatenate([edges.left, edges.right,
+                                         edges.top, edges.bottom]).tolist())
         peaks = []
-        for dy, dx in slices:
-            xc = (dx.start + dx.stop - 1)/2.0
-            yc = (dy.start + dy.stop - 1)/2.0
+        for i, (dy, dx) in enumerate(slices):
+            box = (x1 + dx.start, y1 + dy.start, x1 + dx.stop, y1 + dy.stop)
+            if (i + 1) in on_edge:
+                edges.boxes[i + 1] = box
+            else:
+                # This is only an approximate center; use FWHM or
+                # centroid calculation to refine further
+                peaks.append(self._box_center(box))
 
-            # This is only an approximate center; use FWHM or centroid
-            # calculation to refine further
-            peaks.append((xc, yc))
+        return peaks, edges
 
-        return peaks
+    def _merge_tile_peaks(self, edge_maxima, tile_size):
+        """Join the maxima touching the edges of the tiles in
+        (edge_maxima), a dict of the Bunch returned by _find_tile_peaks
+        for each tile, into whole peaks, as if the data had been labeled
+        in one piece.  Returns the list of their centers.
+        """
+        parent = {}
+
+        def _find(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for tile, edges in edge_maxima.items():
+            for label in edges.boxes.keys():
+                parent[(tile, label)] = (tile, label)
+
+        for (x, y), edges in edge_maxima.items():
+            for tile2, arr1, side2 in (((x + tile_size, y), edges.right, 'left'),
+                                       ((x, y + tile_size), edges.bottom, 'top')):
+                if tile2 not in edge_maxima:
+                    continue
+                arr2 = edge_maxima[tile2][side2]
+                touch = (arr1 > 0) & (arr2 > 0)
+                for label1, label2 in set(zip(arr1[touch].tolist(),
+                                              arr2[touch].tolist())):
+                    key1 = _find(((x, y), label1))
+                    key2 = _find((tile2, label2))
+                    parent[key2] = key1
+
+        boxes = {}
+        for tile, edges in edge_maxima.items():
+            for label, box in edges.boxes.items():
+                key = _find((tile, label))
+                if key in boxes:
+                    box2 = boxes[key]
+                    box = (min(box[0], box2[0]), min(box[1], box2[1]),
+                           max(box[2], box2[2]), max(box[3], box2[3]))
+                boxes[key] = box
+
+        return [self._box_center(box) for box in boxes.values()]
+
+    def _box_center(self, box):
+        x1, y1, x2, y2 = box
+        return ((x1 + x2 - 1) / 2.0, (y1 + y2 - 1) / 2.0)
 
 
     def cut_region(self, x, y, radius, data):
@@ -233,7 +589,16 @@ class IQCalc(object):
     # EVALUATION ON A FIELD
     
     def evaluate_peaks(self, peaks, data, bright_radius=2, fwhm_radius=15,
-                       fwhm_method=1, cb_fn=None, ev_intr=None):
+                       fwhm_method=1, cb_fn=None, ev_intr=None, num_procs=1,
+                       progress_fn=None):
+        """Measure the objects at (peaks) in (data).  With (fwhm_method)
+        1 the FWHM is found by fitting gaussians, and with 2 it is only
+        estimated (much faster, see get_fwhms).  Returns a list of Bunch.
+
+        As all the objects are measured together, (cb_fn) is only called
+        with each object once all are done; to follow the progress of the
+        measurement itself, pass (progress_fn) (see get_fwhms).
+        """
 
         height, width = data.shape
         hh = float(height) / 2.0
@@ -249,36 +614,39 @@ class IQCalc(object):
         # Old SOSS qualsize() applied this calculation to skylevel
         skylevel = median * self.skylevel_magnification + self.skylevel_offset
 
+        # Find the fwhm in x and y of all the objects
+        if fwhm_method not in (1, 2):
+            raise IQCalcError("Method (%d) not supported for fwhm calculation!" %(
+                fwhm_method))
+        res = self.get_fwhms(peaks, fwhm_radius, data, medv=median,
+                             refine=(fwhm_method == 1),
+                             num_procs=num_procs, ev_intr=ev_intr,
+                             progress_fn=progress_fn)
+
+        # Average the X and Y gaussian fitting near the peak
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            bx = self.gaussian(numpy.round(res.ctr_x),
+                               (res.ctr_x, res.sdx, res.maxx))
+            by = self.gaussian(numpy.round(res.ctr_y),
+                               (res.ctr_y, res.sdy, res.maxy))
+        bright_arr = (bx + by) / 2.0
+
         # Form a list of objects and their characteristics
         objlist = []
-        for x, y in peaks:
+        for i, (x, y) in enumerate(peaks):
             if ev_intr and ev_intr.isSet():
                 raise IQCalcError("Evaluation interrupted!")
-            
-            # Find the fwhm in x and y
-            try:
-                if fwhm_method == 1:
-                    (fwhm_x, fwhm_y, ctr_x, ctr_y,
-                     sdx, sdy, maxx, maxy) = self.fwhm_data(x, y, data,
-                                                            radius=fwhm_radius)
-
-                    ## # Average the X and Y gaussian fitting near the peak
-                    bx = self.gaussian(round(ctr_x), (ctr_x, sdx, maxx))
-                    by = self.gaussian(round(ctr_y), (ctr_y, sdy, maxy))
-                    ## ## bx = self.gaussian(ctr_x, (ctr_x, sdx, maxx))
-                    ## ## by = self.gaussian(ctr_y, (ctr_y, sdy, maxy))
-                    bright = float((bx + by)/2.0)
 
-                else:
-                    raise IQCalcError("Method (%d) not supported for fwhm calculation!" %(
-                        fwhm_method))
-
-            except Exception as e:
+            if not res.ok[i]:
                 # Error doing FWHM, skip this object
-                self.logger.debug("Error doing FWHM on object at %.2f,%.2f: %s" % (
-                    x, y, str(e)))
+                self.logger.debug("Error doing FWHM on object at %.2f,%.2f" % (
+                    x, y))
                 continue
 
+            fwhm_x, fwhm_y = float(res.fwhm_x[i]), float(res.fwhm_y[i])
+            ctr_x, ctr_y = float(res.ctr_x[i]), float(res.ctr_y[i])
+            bright = float(bright_arr[i])
+
             self.logger.debug("orig=%f,%f  ctr=%f,%f  fwhm=%f,%f bright=%f" % (
                 x, y, ctr_x, ctr_y, fwhm_x, fwhm_y, bright))
             # overall measure of fwhm as a single value
@@ -349,10 +717,41 @@ class IQCalc(object):
         results.sort(key=self._sortkey, reverse=True)
         return results
 
+    def refine_select(self, results, data, bright_radius=2, fwhm_radius=15,
+                      minfwhm=2.0, maxfwhm=50.0, minelipse=0.5,
+                      edgew=0.01, num_refine=10, ev_intr=None):
+        """Evaluate the best candidates in (results), as returned by
+        objlist_select(), again with the gaussian fitting method, (num_refine)
+        at a time, and return the best object of the first batch that
+        still matches the selection criteria.  If neither of the first two
+        batches does, the best candidate as first evaluated is returned.
+        """
+        height, width = data.shape
+
+        for i in range(0, min(len(results), 2 * num_refine), num_refine):
+            peaks = [(obj.x, obj.y) for obj in results[i:i+num_refine]]
+            objlist = self.evaluate_peaks(peaks, data,
+                                          bright_radius=bright_radius,
+                                          fwhm_radius=fwhm_radius,
+                                          fwhm_method=1, ev_intr=ev_intr)
+            refined = self.objlist_select(objlist, width, height,
+                                          minfwhm=minfwhm, maxfwhm=maxfwhm,
+                                          minelipse=minelipse, edgew=edgew)
+            if len(refined) > 0:
+                return refined[0]
+
+        self.logger.debug("No refined candidate matches selection criteria")
+        return results[0]
+
     def pick_field(self, data, peak_radius=5, bright_radius=2, fwhm_radius=15,
                    threshold=None,
                    minfwhm=2.0, maxfwhm=50.0, minelipse=0.5,
-                   edgew=0.01):
+                   edgew=0.01, fwhm_method=2, num_refine=10, num_procs=1):
+        """Find the best object in (data).  All the bright peaks are
+        evaluated with (fwhm_method); with the fast method (2), the best
+        (num_refine) candidates are then evaluated again with the gaussian
+        fitting method (1) before making the final choice.
+        """
 
         height, width = data.shape
 
@@ -367,23 +766,35 @@ class IQCalc(object):
         # Evaluate those peaks
         objlist = self.evaluate_peaks(peaks, data,
                                       bright_radius=bright_radius,
-                                      fwhm_radius=fwhm_radius)
+                                      fwhm_radius=fwhm_radius,
+                                      fwhm_method=fwhm_method,
+                                      num_procs=num_procs)
         if len(objlist) == 0:
             raise IQCalcError("Error evaluating bright peaks")
         
         results = self.objlist_select(objlist, width, height,
                                       minfwhm=minfwhm, maxfwhm=maxfwhm,
                                       minelipse=minelipse, edgew=edgew)
+
         if len(results) == 0:
             raise IQCalcError("No object matches selection criteria")
 
+        if (fwhm_method != 1) and (num_refine > 0):
+            # measure the best candidates more precisely, and choose again
+            return self.refine_select(results, data,
+                                      bright_radius=bright_radius,
+                                      fwhm_radius=fwhm_radius,
+                                      minfwhm=minfwhm, maxfwhm=maxfwhm,
+                                      minelipse=minelipse, edgew=edgew,
+                                      num_refine=num_refine)
+
         return results[0]
 
 
     def qualsize(self, image, x1=None, y1=None, x2=None, y2=None,
                  radius=5, bright_radius=2, fwhm_radius=15, threshold=None, 
                  minfwhm=2.0, maxfwhm=50.0, minelipse=0.5,
-                 edgew=0.01):
+                 edgew=0.01, fwhm_method=2, num_procs=1):
         
         x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
         data = image.cutout_data(x1, y1, x2, y2, astype='float32')
@@ -393,7 +804,8 @@ class IQCalc(object):
                              fwhm_radius=fwhm_radius,
                              threshold=threshold,
                              minfwhm=minfwhm, maxfwhm=maxfwhm,
-                             minelipse=minelipse, edgew=edgew)
+                             minelipse=minelipse, edgew=edgew,
+                             fwhm_method=fwhm_method, num_procs=num_procs)
 
         # Add back in offsets into image to get correct values with respect
         # to the entire image
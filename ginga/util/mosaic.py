@@ -23,7 +23,7 @@ from ginga.util import wcs, io_fits, dp
 from ginga.misc import log
 
 
-def mosaic(logger, itemlist, fov_deg=None):
+def mosaic(logger, itemlist, fov_deg=None, num_threads=1):
     """
     Parameters
     ----------
@@ -31,6 +31,8 @@ def mosaic(logger, itemlist, fov_deg=None):
         a logger object passed to created AstroImage instances
     itemlist : sequence like
         a sequence of either filenames or AstroImage instances
+    num_threads : int
+        number of images to load and place at the same time
     """
 
     if isinstance(itemlist[0], AstroImage.AstroImage):
@@ -66,26 +68,29 @@ def mosaic(logger, itemlist, fov_deg=None):
     logger.debug("mosaic rot=%f cdelt1=%f cdelt2=%f" % (rot, cdelt1, cdelt2))
 
     logger.debug("Processing '%s' ..." % (name))
-    tup = img_mosaic.mosaic_inline([ image0 ],
-                                   allow_expand=expand)
-    logger.debug("placement %s" % (str(tup)))
 
-    count = 1
-    for item in itemlist[1:]:
+    def _load(item, memmap=None):
         if isinstance(item, AstroImage.AstroImage):
-            image = item
-            name = image.get('name', 'image%d' % (count))
-        else:
-            # Create and load the image
-            filepath = item
-            logger.info("Reading file '%s' ..." % (filepath))
-            image = AstroImage.AstroImage(logger=logger)
-            image.load_file(filepath)
-
-        logger.debug("Inlining '%s' ..." % (name))
-        tup = img_mosaic.mosaic_inline([ image ])
-        logger.debug("placement %s" % (str(tup)))
-        count += 1
+            return item
+        # Create and load the image
+        filepath = item
+        logger.info("Reading file '%s' ..." % (filepath))
+        image = AstroImage.AstroImage(logger=logger)
+        image.load_file(filepath, memmap=memmap)
+        return image
+
+    # find where all of the images go first (from their headers only),
+    # so that the mosaic is expanded at most once
+    items = [image0] + list(itemlist[1:])
+    boxes = [img_mosaic.mosaic_footprint(_load(item, memmap=True))
+             for item in items]
+    boxes = img_mosaic.mosaic_allocate(boxes, allow_expand=expand)
+
+    # then load and reproject them, several at a time in parallel threads
+    logger.debug("Inlining %d images ..." % (len(items)))
+    img_mosaic.mosaic_fill(items, boxes, num_threads=max(num_threads, 1),
+                           load_fn=_load)
+    logger.debug("placement %s" % (str(boxes[-1])))
 
     logger.info("Done.")
     return img_mosaic
@@ -95,7 +100,8 @@ def main(options, args):
 
     logger = log.get_logger(name="mosaic", options=options)
 
-    img_mosaic = mosaic(logger, args, fov_deg=options.fov)
+    img_mosaic = mosaic(logger, args, fov_deg=options.fov,
+                        num_threads=options.num_threads)
 
     if options.outfile:
         outfile = options.outfile
@@ -130,6 +136,9 @@ if __name__ == "__main__":
                       help="Set logging level to LEVEL")
     optprs.add_option("-o", "--outfile", dest="outfile", metavar="FILE",
                       help="Write mosaic output to FILE")
+    optprs.add_option("-t", "--threads", dest="num_threads", metavar="NUM",
+                      type='int', default=1,
+                      help="Place NUM images at a time in parallel")
     optprs.add_option("--stderr", dest="logstderr", default=False,
                       action="store_true",
                       help="Copy logging also to stderr")
@@ -0,0 +1,215 @@
+#
+# stats.py -- streaming statistics on image data
+#
+# Eric Jeschke (eric@naoj.org)
+#
+# Copyright (c) Eric R. Jeschke.  All rights reserved.
+# This is open-source software licensed under a BSD license.
+# Please see the file LICENSE.txt for details.
+#
+"""
+Statistics that are calculated by going through the data a piece at a
+time.  NaN and Inf values are skipped, the input array is never copied
+as a whole, and memory-mapped data is read only one piece at a time.
+"""
+import numpy
+
+from ginga.misc import Bunch
+
+# default number of data values processed at a time
+chunk_size = 1024 * 1024
+
+
+def iter_chunks(data_np, chunk_size=None):
+    """
+    Iterate over `data_np` in pieces of about `chunk_size` values, split
+    along the first axis.  The pieces are views of the data.
+    """
+    if chunk_size is None:
+        chunk_size = globals()['chunk_size']
+    if data_np.ndim == 0:
+        yield data_np.reshape(1)
+        return
+    n = data_np.shape[0]
+    if n == 0:
+        return
+    rowsize = max(data_np.size // n, 1)
+    rows = max(chunk_size // rowsize, 1)
+    for i in range(0, n, rows):
+        yield data_np[i:i+rows]
+
+
+def get_finite(data_np):
+    """
+    Returns the finite values of `data_np` as a flat array.  This is a
+    view (no copy) if there are no NaN or Inf values in a contiguous array.
+    """
+    if isinstance(data_np, numpy.ma.MaskedArray):
+        data_np = data_np.compressed()
+    if not issubclass(data_np.dtype.type, numpy.inexact):
+        # integer data is always finite
+        return data_np.ravel()
+    mask = numpy.isfinite(data_np)
+    if mask.all():
+        return data_np.ravel()
+    return data_np[mask]
+
+
+def calc_stats(data_np, chunk_size=65536):
+    """
+    Calculate in a single pass through `data_np`:
+
+    minval, maxval:  min and max, ignoring NaNs (may be +/-Inf)
+    minval_noinf, maxval_noinf:  min and max of the finite values
+    nan_count, inf_count:  number of NaN and Inf values
+
+    Returns a Bunch.  The min and max values are 0 if there are no
+    (finite) values.  The default `chunk_size` is kept small, so that each
+    piece stays in the CPU cache for the several operations done on it.
+    """
+    if isinstance(data_np, numpy.ma.MaskedArray):
+        data_np = data_np.compressed()
+    is_float = issubclass(data_np.dtype.type, numpy.inexact)
+
+    minval = maxval = minval_noinf = maxval_noinf = None
+    nan_count = inf_count = 0
+    posinf = neginf = False
+
+    for chunk in iter_chunks(data_np, chunk_size=chunk_size):
+        if chunk.size == 0:
+            continue
+        if is_float:
+            mask = numpy.isfinite(chunk)
+            if not mask.all():
+                # rare case: work out what the non-finite values are
+                n_nan = int(numpy.count_nonzero(numpy.isnan(chunk)))
+                n_inf = chunk.size - int(numpy.count_nonzero(mask)) - n_nan
+                nan_count += n_nan
+                if n_inf > 0:
+                    inf_count += n_inf
+                    posinf = posinf or bool(numpy.any(chunk == numpy.inf))
+                    neginf = neginf or bool(numpy.any(chunk == -numpy.inf))
+                chunk = chunk[mask]
+                if chunk.size == 0:
+                    continue
+        lo, hi = chunk.min(), chunk.max()
+        if minval_noinf is None:
+            minval_noinf, maxval_noinf = lo, hi
+        else:
+            minval_noinf = min(minval_noinf, lo)
+            maxval_noinf = max(maxval_noinf, hi)
+
+    if minval_noinf is None:
+        minval_noinf = maxval_noinf = 0
+    minval, maxval = minval_noinf, maxval_noinf
+    if neginf:
+        minval = -numpy.inf
+    if posinf:
+        maxval = numpy.inf
+
+    return Bunch.Bunch(minval=minval, maxval=maxval,
+                       minval_noinf=minval_noinf, maxval_noinf=maxval_noinf,
+                       nan_count=nan_count, inf_count=inf_count)
+
+
+def calc_range(data_np, chunk_size=None):
+    """
+    Returns the (min, max) of the finite values in `data_np`, or
+    (0, 0) if there are none.
+    """
+    bnch = calc_stats(data_np, chunk_size=chunk_size)
+    return (bnch.minval_noinf, bnch.maxval_noinf)
+
+
+def calc_histogram(data_np, numbins=2048, range=None, chunk_size=None):
+    """
+    Histogram of the finite values in `data_np`, calculated piece by
+    piece.  `range` is (min, max) of the bins, and defaults to the range
+    of the finite data.  Returns (dist, bins) like numpy.histogram().
+    """
+    if range is None:
+        range = calc_range(data_np, chunk_size=chunk_size)
+    range = (float(range[0]), float(range[1]))
+
+    dist, bins = None, None
+    for chunk in iter_chunks(data_np, chunk_size=chunk_size):
+        chunk = get_finite(chunk)
+        _dist, _bins = numpy.histogram(chunk, bins=numbins, range=range,
+                                       density=False)
+        if dist is None:
+            dist, bins = _dist, _bins
+        else:
+            dist += _dist
+
+    if dist is None:
+        # no data at all
+        dist, bins = numpy.histogram([], bins=numbins, range=range)
+    return (dist, bins)
+
+
+def calc_percentiles(data_np, pcts, numbins=2048, hist=None,
+                     chunk_size=None):
+    """
+    Estimate the values below which the fractions `pcts` (each in the
+    range 0..1) of the finite values in `data_np` lie.
+
+    This uses two passes through the data: a coarse histogram over the
+    whole range, then a fine histogram (of `numbins` bins) within each
+    coarse bin that holds one of the percentiles.  A coarse histogram
+    (dist, bins) that was already calculated can be passed in `hist`
+    to skip the first pass.
+    """
+    if hist is None:
+        hist = calc_histogram(data_np, numbins=numbins,
+                              chunk_size=chunk_size)
+    dist, bins = hist
+    cumsum = numpy.cumsum(dist)
+    total = cumsum[-1] if len(cumsum) > 0 else 0
+    if total == 0:
+        return [float(bins[0])] * len(pcts)
+
+    # find the coarse bin holding each percentile, and the count of values
+    # that fall before it
+    targets = []
+    for pct in pcts:
+        count = min(max(float(pct), 0.0), 1.0) * total
+        i = int(numpy.searchsorted(cumsum, count, side='left'))
+        i = min(i, len(dist) - 1)
+        nprev = cumsum[i-1] if i > 0 else 0
+        targets.append((i, count - nprev))
+
+    # second pass: fine histograms of the selected coarse bins
+    fine = {}
+    for i, _ in targets:
+        fine[i] = numpy.zeros(numbins, dtype=numpy.int64)
+    last = len(dist) - 1
+    for chunk in iter_chunks(data_np, chunk_size=chunk_size):
+        chunk = get_finite(chunk)
+        for i, fdist in fine.items():
+            lo, hi = bins[i], bins[i+1]
+            # last bin includes its upper edge, like numpy.histogram()
+            if i == last:
+                sel = chunk[(chunk >= lo) & (chunk <= hi)]
+            else:
+                sel = chunk[(chunk >= lo) & (chunk < hi)]
+            if len(sel) > 0:
+                fdist += numpy.histogram(sel, bins=numbins,
+                                         range=(lo, hi))[0]
+
+    res = []
+    for i, count in targets:
+        fdist = fine[i]
+        lo, hi = float(bins[i]), float(bins[i+1])
+        step = (hi - lo) / numbins
+        fcumsum = numpy.cumsum(fdist)
+        j = int(numpy.searchsorted(fcumsum, count, side='left'))
+        j = min(j, numbins - 1)
+        nprev = fcumsum[j-1] if j > 0 else 0
+        # interpolate within the fine bin
+        n = fdist[j]
+        interp = (count - nprev) / float(n) if n > 0 else 0.0
+        res.append(lo + step * (j + min(max(interp, 0.0), 1.0)))
+
+    return res
+
+#END
@@ -11,11 +11,13 @@
 from __future__ import print_function
 import threading
 import time
+import numpy
 
 from ginga import Mixins, Bindings
 from ginga.misc import log, Bunch
 from ginga.canvas.mixins import DrawingMixin, CanvasMixin, CompoundMixin
 import PgHelp
+from ginga.web.pgw import PgFrames
 
 
 try:
@@ -67,15 +69,25 @@ class ImageViewPg(ImageView):
             return
 
         try:
-            self.logger.debug("getting png image...")
-            buf = self.get_rgb_image_as_buffer(format='png')
-            self.logger.debug("got png image")
-
-            self.pgcanvas.do_update(buf)
+            # the canvas sends what changed, when the browser is ready
+            self.pgcanvas.do_update_frame()
             self.logger.debug("informed update")
         except Exception as e:
             self.logger.error("Couldn't update canvas: %s" % (str(e)))
 
+    def get_rgb_array(self):
+        """Returns a (new) RGB array of the contents of the window."""
+        surface = self.get_surface()
+        order = self.get_rgb_order()
+        if isinstance(surface, numpy.ndarray):
+            arr = surface
+        else:
+            # agg surface
+            wd, ht = self.get_window_size()
+            arr = numpy.fromstring(surface.tostring(), dtype=numpy.uint8)
+            arr = arr.reshape((ht, wd, len(order)))
+        return arr[..., [order.index(c) for c in 'RGB']]
+
     def reschedule_redraw(self, time_sec):
         if self.pgcanvas is not None:
             self.pgcanvas.reset_timer('redraw', time_sec)
@@ -540,6 +552,18 @@ class RenderWidgetZoom(PgHelp.PantographHandler):
         self._panning = False
         self._rotating = False
 
+        # for sending only what changed in the window, and only when the
+        # browser has drawn what was sent before
+        latency = self.settings.get("frame_latency", 0.1)
+        tile_size = self.settings.get("frame_tile_size", 128)
+        if self.name in self.settings:
+            latency = self.settings[self.name].get("frame_latency", latency)
+            tile_size = self.settings[self.name].get("frame_tile_size",
+                                                     tile_size)
+        self.frames = PgFrames.FrameStream(self.logger, tile_size=tile_size,
+                                           latency=latency)
+        self._frame_pending = False
+
     def set_viewer(self, viewer):
         self.logger.info("set_viewer called")
         self.viewer = viewer
@@ -564,6 +588,9 @@ class RenderWidgetZoom(PgHelp.PantographHandler):
         ## self.add_timer('redraw', self.viewer.delayed_redraw)
         ## self.add_timer('msg', self.viewer.clear_onscreen_message)
         self._configured = True
+        # browser has nothing drawn yet
+        self.frames.reset()
+        self._frame_pending = False
         self.get()
 
     def do_update(self, buf):
@@ -574,6 +601,28 @@ class RenderWidgetZoom(PgHelp.PantographHandler):
                         buffer=buf)
         self.logger.debug("drew image")
 
+    def do_update_frame(self):
+        if (self.viewer is None) or (not self.frames.can_send()):
+            # send the latest contents when the browser catches up
+            self._frame_pending = True
+            return
+        self._frame_pending = False
+        frame = self.frames.make_frame(self.viewer.get_rgb_array())
+        if frame is not None:
+            self.draw_frame(frame)
+
+    def on_frame_ack(self, frame_num):
+        self.frames.ack(frame_num)
+        if self._frame_pending:
+            self.do_update_frame()
+
+        elif (self.viewer is not None) and self.frames.can_send():
+            # nothing new--improve any tiles sent in a lossy format
+            frame = self.frames.make_frame(self.viewer.get_rgb_array(),
+                                           refine=True)
+            if frame is not None:
+                self.draw_frame(frame)
+
     def update(self):
         #self.logger.debug("update called")
         funcs = []
@@ -588,6 +637,11 @@ class RenderWidgetZoom(PgHelp.PantographHandler):
             func()
             #self.logger.debug("update should have been called.")
 
+        # a frame held back for an acknowledgement that has not come
+        # (see FrameStream.can_send) is sent when it times out
+        if self._frame_pending and self.frames.can_send():
+            self.do_update_frame()
+
     def add_timer(self, name, func):
         with self._canvas_lock:
             self._timer[name] = Bunch.Bunch(timer=None, func=func)
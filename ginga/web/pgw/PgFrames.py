@@ -0,0 +1,234 @@
+#
+# PgFrames.py -- binary frames of changed tiles for the web backend
+#
+# Eric Jeschke (eric@naoj.org)
+#
+# Copyright (c) Eric R. Jeschke.  All rights reserved.
+# This is open-source software licensed under a BSD license.
+# Please see the file LICENSE.txt for details.
+#
+"""
+Frames sent to the browser are binary WebSocket messages holding only
+the parts of the window that changed since the last frame was sent.
+
+Layout (little endian):
+
+    frame header:  uint32 frame number, uint16 width, uint16 height,
+                   uint16 number of tiles
+    each tile:     uint16 x, y, width, height, uint8 format,
+                   uint32 length, followed by `length` bytes of the
+                   image encoded in that format (see FORMATS)
+
+The browser acknowledges each frame with a JSON message
+{"type": "ack", "frame": <frame number>}.
+"""
+import struct
+import time
+from io import BytesIO
+
+import numpy
+
+try:
+    from PIL import Image as PILimage
+    have_PIL = True
+except ImportError:
+    have_PIL = False
+
+# format codes used in the frames, in order of preference (best quality
+# first)
+FORMATS = ['png', 'webp', 'jpeg']
+FORMAT_CODES = dict(png=0, jpeg=1, webp=2)
+
+frame_header = struct.Struct('<IHHH')
+tile_header = struct.Struct('<HHHHBI')
+
+
+def have_format(fmt):
+    """Returns True if images can be encoded in format `fmt`."""
+    if not have_PIL:
+        return False
+    if fmt == 'webp':
+        try:
+            from PIL import features
+            return features.check('webp')
+        except Exception:
+            return False
+    return True
+
+
+class FrameStream(object):
+    """Makes frames of the tiles of a window that changed, for sending
+    to a browser, and keeps track of the frames not yet acknowledged.
+
+    The format of each frame is chosen so that the estimated time to
+    encode and send it is within `latency` seconds: PNG if possible,
+    otherwise WebP (if available) or JPEG.  Tiles sent in a lossy format
+    are sent again losslessly when the window is not changing.
+    """
+
+    def __init__(self, logger, tile_size=128, latency=0.1, quality=85,
+                 max_in_flight=1, ack_timeout=1.0):
+        self.logger = logger
+        self.tile_size = tile_size
+        self.latency = latency
+        self.quality = quality
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+
+        self.formats = [fmt for fmt in FORMATS if have_format(fmt)]
+        # estimates, per format, of seconds to encode and bytes to send
+        # per pixel (updated as frames are made)
+        self.enc_rate = dict(png=5.0e-8, webp=4.0e-8, jpeg=1.0e-8)
+        self.size_rate = dict(png=1.5, webp=0.2, jpeg=0.3)
+        # estimate of bytes per second to the browser
+        self.bandwidth = 5.0e6
+
+        self.reset()
+
+    def reset(self):
+        """Forget what was sent, so that the next frame is complete."""
+        self.count = 0
+        self.last_arr = None
+        # frame number -> (time sent, size), for frames not acknowledged
+        self.in_flight = {}
+        # tiles last sent in a lossy format
+        self.lossy = None
+
+    def can_send(self):
+        """Returns True if a frame can be sent now, i.e. if the browser
+        has acknowledged enough of the frames sent before.
+        """
+        if len(self.in_flight) < self.max_in_flight:
+            return True
+        # give up on frames that are not acknowledged in time
+        now = time.time()
+        oldest = min([tup[0] for tup in self.in_flight.values()])
+        if now - oldest > self.ack_timeout:
+            self.logger.debug("frames not acknowledged--sending anyway")
+            self.in_flight = {}
+            return True
+        return False
+
+    def ack(self, frame_num):
+        """Record that the browser has drawn frame `frame_num`."""
+        tup = self.in_flight.pop(frame_num, None)
+        if tup is None:
+            return
+        sent_time, size = tup
+        secs = time.time() - sent_time
+        if (size > 10000) and (secs > 0):
+            # only frames of some size say much about the bandwidth
+            self.bandwidth = 0.8 * self.bandwidth + 0.2 * (size / secs)
+        # frames sent before this one are not coming
+        for num in list(self.in_flight.keys()):
+            if num < frame_num:
+                del self.in_flight[num]
+
+    def get_changed_tiles(self, arr):
+        """Returns a boolean array of the tiles of `arr` that are
+        different from the last frame.
+        """
+        ts = self.tile_size
+        ht, wd = arr.shape[:2]
+        rows, cols = (ht + ts - 1) // ts, (wd + ts - 1) // ts
+        last = self.last_arr
+        if (last is None) or (last.shape != arr.shape):
+            return numpy.ones((rows, cols), dtype=numpy.bool_)
+
+        diff = (arr != last).any(axis=2)
+        # pad to whole tiles, and reduce each tile to one value
+        padded = numpy.zeros((rows * ts, cols * ts), dtype=numpy.bool_)
+        padded[:ht, :wd] = diff
+        return padded.reshape((rows, ts, cols, ts)).any(axis=3).any(axis=1)
+
+    def choose_format(self, npix):
+        """Choose the best format whose estimated time to encode and send
+        `npix` pixels is within the latency budget.
+        """
+        best, best_secs = None, None
+        for fmt in self.formats:
+            secs = npix * (self.enc_rate[fmt] +
+                           self.size_rate[fmt] / self.bandwidth)
+            if secs <= self.latency:
+                return fmt
+            if (best is None) or (secs < best_secs):
+                best, best_secs = fmt, secs
+        return best
+
+    def encode(self, arr, fmt):
+        """Encode the RGB array `arr` in format `fmt`."""
+        t1 = time.time()
+        ibuf = BytesIO()
+        image = PILimage.fromarray(numpy.ascontiguousarray(arr))
+        image.save(ibuf, format=fmt, quality=self.quality)
+        buf = ibuf.getvalue()
+
+        npix = float(arr.shape[0] * arr.shape[1])
+        self.enc_rate[fmt] = (0.8 * self.enc_rate[fmt] +
+                              0.2 * (time.time() - t1) / npix)
+        self.size_rate[fmt] = 0.8 * self.size_rate[fmt] + 0.2 * len(buf) / npix
+        return buf
+
+    def make_frame(self, arr, refine=False):
+        """Make a frame from the RGB array `arr` of the whole window
+        (which is kept for comparing with the next one, so it should not
+        be modified afterwards).  Returns the frame (bytes), or None if
+        nothing changed.
+
+        If `refine` is True and nothing changed, the tiles last sent in
+        a lossy format are sent again losslessly.
+        """
+        if len(self.formats) == 0:
+            raise ValueError("Please install PIL to encode frames")
+
+        changed = self.get_changed_tiles(arr)
+        if self.lossy is None or self.lossy.shape != changed.shape:
+            self.lossy = numpy.zeros(changed.shape, dtype=numpy.bool_)
+        if not changed.any():
+            if not (refine and self.lossy.any()):
+                return None
+            changed, fmt = self.lossy.copy(), self.formats[0]
+        else:
+            fmt = None
+
+        ts = self.tile_size
+        ht, wd = arr.shape[:2]
+        # changed tiles next to each other in a row are sent together
+        rects = []
+        for row in range(changed.shape[0]):
+            cols = numpy.nonzero(changed[row])[0]
+            if len(cols) == 0:
+                continue
+            start = prev = cols[0]
+            for col in list(cols[1:]) + [None]:
+                if (col is not None) and (col == prev + 1):
+                    prev = col
+                    continue
+                rects.append((row, start, prev))
+                start = prev = col
+
+        if fmt is None:
+            npix = int(changed.sum()) * ts * ts
+            fmt = self.choose_format(npix)
+        code = FORMAT_CODES[fmt]
+        lossy = (fmt != 'png')
+
+        self.count += 1
+        parts = [frame_header.pack(self.count, wd, ht, len(rects))]
+        for row, col1, col2 in rects:
+            x1, y1 = col1 * ts, row * ts
+            x2, y2 = min((col2 + 1) * ts, wd), min(y1 + ts, ht)
+            buf = self.encode(arr[y1:y2, x1:x2], fmt)
+            parts.append(tile_header.pack(x1, y1, x2 - x1, y2 - y1, code,
+                                          len(buf)))
+            parts.append(buf)
+            self.lossy[row, col1:col2+1] = lossy
+        frame = b''.join(parts)
+
+        self.last_arr = arr
+        self.in_flight[self.count] = (time.time(), len(frame))
+        self.logger.debug("frame %d: %d tiles as %s (%d bytes)" % (
+            self.count, int(changed.sum()), fmt, len(frame)))
+        return frame
+
+#END
@@ -104,6 +104,8 @@ class PantographHandler(tornado.websocket.WebSocketHandler):
 
         if event_type == "setbounds":
             self.on_canvas_init(message)
+        elif event_type == "ack":
+            self.on_frame_ack(message.get("frame"))
         else:
             try:
                 method, EventClass = self.event_callbacks[event_type]
@@ -181,6 +183,10 @@ class PantographHandler(tornado.websocket.WebSocketHandler):
                            width=width, height=height, **extra)
 
 
+    def draw_frame(self, frame):
+        """Send a binary frame (see PgFrames) to be drawn."""
+        self.write_message(frame, binary=True)
+
     def timer_tick(self):
         self.update()
         self.do_operation("refresh")
@@ -193,6 +199,9 @@ class PantographHandler(tornado.websocket.WebSocketHandler):
     def update(self):
         pass
 
+    def on_frame_ack(self, frame_num):
+        pass
+
     def on_mouse_down(self, event):
         pass
 
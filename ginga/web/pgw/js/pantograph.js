@@ -7,6 +7,7 @@ var reqAnimFrame = window.requestAnimationFrame ||
 
 var pantograph = {};
 pantograph.socket = new WebSocket(ws_url);
+pantograph.socket.binaryType = "arraybuffer";
 
 pantograph.canvas_id = canvas_id
 pantograph.context = canvas.getContext("2d");
@@ -260,6 +261,66 @@ pantograph.drawImage = function(ctx, imgInfo) {
         })
 }
 
+// formats of the tiles in binary frames (see PgFrames.py)
+pantograph.frameFormats = ["image/png", "image/jpeg", "image/webp"];
+
+pantograph.drawFrame = function(buffer) {
+    var view = new DataView(buffer);
+    var frameNum = view.getUint32(0, true);
+    var numTiles = view.getUint16(8, true);
+    var offset = 10;
+    var tiles = [];
+    for (var i = 0; i < numTiles; i++) {
+	var tile = {
+	    x: view.getUint16(offset, true),
+	    y: view.getUint16(offset + 2, true),
+	    format: view.getUint8(offset + 8)
+	};
+	var length = view.getUint32(offset + 9, true);
+	offset += 13;
+	tile.blob = new Blob([new Uint8Array(buffer, offset, length)],
+			     {type: pantograph.frameFormats[tile.format]});
+	offset += length;
+	tiles.push(tile);
+    }
+
+    // decode all the tiles, then draw them together and tell the server
+    // it can send the next frame
+    var count = 0;
+    var images = new Array(tiles.length);
+    var finish = function () {
+	var ctx = pantograph.hiddenContext;
+	for (var i = 0; i < tiles.length; i++) {
+	    if (images[i]) {
+		ctx.drawImage(images[i], tiles[i].x, tiles[i].y);
+	    }
+	}
+	pantograph.redrawCanvas();
+	pantograph.socket.send(JSON.stringify({
+	    type: "ack", frame: frameNum
+	}));
+    };
+    if (tiles.length == 0) {
+	finish();
+	return;
+    }
+    tiles.forEach(function (tile, i) {
+	var url = URL.createObjectURL(tile.blob);
+	var img = new Image();
+	img.onload = img.onerror = function (e) {
+	    URL.revokeObjectURL(url);
+	    if (e.type == "load") {
+		images[i] = img;
+	    }
+	    count += 1;
+	    if (count == tiles.length) {
+		finish();
+	    }
+	};
+	img.src = url;
+    });
+}
+
 pantograph.drawCompound = function(ctx, compound) {
     compound.shapes.forEach(function (shp) {
 	pantograph.shapeToFunc[shp["type"]](ctx, shp);
@@ -305,6 +366,10 @@ pantograph.socket.onopen = function(e) {
 }
 
 pantograph.socket.onmessage = function(e) {
+    if (e.data instanceof ArrayBuffer) {
+	pantograph.drawFrame(e.data);
+	return;
+    }
     message = JSON.parse(e.data);
     if (message.operation == "refresh")
 	pantograph.redrawCanvas();